@@ -1,16 +1,27 @@
 from __future__ import print_function
 import argparse
+from collections import deque
 import copy
 import os
+import time
 
-import colors
 import httplib2
 
 from apiclient import discovery
+from apiclient import errors
 from oauth2client import client
 from oauth2client import tools
 from oauth2client.file import Storage
 
+from GmailFilters.Config import config_file, account_file # pylint: disable=unused-import
+from GmailFilters.Labels import LabelCache
+from GmailFilters.Printer import Printer # pylint: disable=unused-import
+from GmailFilters.Scheduler import Scheduler, AdaptiveLimit, QUOTA_COSTS, \
+                                   is_unsafe_retry
+from GmailFilters.Timings import phase, instrument_http
+from GmailFilters.Write import DEFAULT_BATCH_SIZE, MAX_BATCH_SIZE, \
+                               FilterWriteResult, find_created
+
 # If modifying these scopes, delete your previously saved credentials
 # at ~/.credentials/gmail-python-quickstart.json
 # SCOPES = 'https://www.googleapis.com/auth/gmail.readonly'
@@ -19,13 +30,25 @@ SCOPES = ' '.join( [
    'https://www.googleapis.com/auth/gmail.metadata' # for getProfile
    ] )
 
-home_dir = os.path.expanduser( '~' )
-config_dir = os.path.join( home_dir, '.gmail_filters' )
-
-CLIENT_SECRET_FILE = os.path.join( config_dir, 'client_secret.json' )
 APPLICATION_NAME = 'Gmail Filter Tools CLI'
 
-credential_path = os.path.join( config_dir, 'credentials.json' )
+def client_secret_file():
+   return config_file( 'client_secret.json' )
+
+def credential_path():
+   return config_file( 'credentials.json' )
+
+# A copy of Gmail's discovery document, with only the methods used here, so
+# that building a Service needs no request for, or parsing of, the full one.
+discovery_doc_path = os.path.join( os.path.dirname( __file__ ), 'gmail.v1.json' )
+_discoveryDoc = None
+
+def bundled_discovery_doc():
+   global _discoveryDoc
+   if _discoveryDoc is None:
+      with open( discovery_doc_path ) as f:
+         _discoveryDoc = f.read()
+   return _discoveryDoc
 
 def new_argparser_base( addHelp=True ):
    return argparse.ArgumentParser( parents=[ tools.argparser ], add_help=addHelp )
@@ -39,136 +62,229 @@ def get_credentials( flags ):
    Returns:
        Credentials, the obtained credential.
    """
-   if not os.path.exists( config_dir ):
-      os.makedirs( config_dir )
+   credentialPath = credential_path()
+   if not os.path.exists( os.path.dirname( credentialPath ) ):
+      os.makedirs( os.path.dirname( credentialPath ) )
 
-   store = Storage( credential_path )
+   store = Storage( credentialPath )
    credentials = store.get()
    if not credentials or credentials.invalid:
-      if not os.path.exists( CLIENT_SECRET_FILE ):
+      secretFile = client_secret_file()
+      if not os.path.exists( secretFile ):
          print( "Ensure that you have downloaded a client secret and placed it at "
-                "%s" % CLIENT_SECRET_FILE )
-      flow = client.flow_from_clientsecrets( CLIENT_SECRET_FILE, SCOPES )
+                "%s" % secretFile )
+      flow = client.flow_from_clientsecrets( secretFile, SCOPES )
       flow.user_agent = APPLICATION_NAME
       credentials = tools.run_flow( flow, store, flags )
-      print( 'Storing credentials to ' + credential_path )
+      print( 'Storing credentials to ' + credentialPath )
    return credentials
 
 def get_auth_http( flags ):
-   credentials = get_credentials( flags )
-   return credentials.authorize( httplib2.Http() )
+   with phase( 'credentials' ):
+      credentials = get_credentials( flags )
+   # Instrumented before authorizing, so that token refreshes are timed too
+   return credentials.authorize( instrument_http( httplib2.Http() ) )
+
+def get_auth_http_factory( flags ):
+   '''Returns a function returning a new authorized Http on each call, for
+   threads which each need their own.
+   '''
+   with phase( 'credentials' ):
+      credentials = get_credentials( flags )
+   return lambda: credentials.authorize( instrument_http( httplib2.Http() ) )
 
 class Service( object ):
-   def __init__( self, http, dryWrites=False ):
-      self._service = discovery.build( 'gmail', 'v1', http=http )
+   '''The filters, labels and profile of the authorized account.
+
+   Requests are paced and retried by scheduler, which should be shared by
+   every Service of the account, as they share its quota.
+   '''
+   def __init__( self, http, dryWrites=False, discoveryDoc=None, scheduler=None ):
+      start = time.perf_counter()
+      if discoveryDoc is None:
+         discoveryDoc = bundled_discovery_doc()
+      with phase( 'build service' ):
+         self._service = discovery.build_from_document( discoveryDoc, http=http )
+      # Resources are built anew on each call, so look up the ones used once
+      # pylint: disable=no-member
+      self._users = self._service.users()
+      self._labels = self._users.labels()
+      self._filters = self._users.settings().filters()
       self.dryWrites = dryWrites
+      self.scheduler = scheduler if scheduler is not None else Scheduler()
+      self.emailAddr = None
+      self._labelCache = None
+      self.buildTime = time.perf_counter() - start
+
+   def _execute( self, method, request, reconcile=None ):
+      return self.scheduler.call( method, request.execute, reconcile=reconcile )
 
    def get_email_addr( self ):
-      # pylint: disable=no-member
-      results = self._service.users().getProfile( userId='me' ).execute()
+      results = self._execute( 'get_email_addr', self._users.getProfile( userId='me' ) )
       return results.get( 'emailAddress', None )
 
    def get_labels( self ):
-      # pylint: disable=no-member
-      results = self._service.users().labels().list( userId='me' ).execute()
+      results = self._execute( 'get_labels', self._labels.list( userId='me' ) )
       return results.get( 'labels', [] )
 
+   def label_cache( self ):
+      '''Returns the LabelCache of the account, kept on disk between runs once
+      emailAddr is known.
+      '''
+      if self._labelCache is None:
+         self._labelCache = LabelCache.for_account( self.get_labels, self.emailAddr )
+      return self._labelCache
+
    def get_filter( self, filterId ):
-      # pylint: disable=no-member
-      return self._service.users().settings().filters().get( userId='me',
-                                                             id=filterId ).execute()
+      return self._execute( 'get_filter', self._filters.get( userId='me', id=filterId ) )
 
    def get_filters( self ):
-      # pylint: disable=no-member
-      results = self._service.users().settings().filters().list( userId='me' ).execute()
+      results = self._execute( 'get_filters', self._filters.list( userId='me' ) )
       return results.get( 'filter', [] )
 
    def create_filter( self, filterObj ):
       if not self.dryWrites:
-         # pylint: disable=no-member
-         results = self._service.users().settings().filters()\
-               .create( userId='me', body=filterObj ).execute()
+         results = self._execute( 'create_filter',
+                                  self._filters.create( userId='me', body=filterObj ),
+                                  reconcile=lambda: find_created( self.get_filters(),
+                                                                  filterObj ) )
          print( "create: %r" % ( results, ) )
       else:
          results = copy.deepcopy( filterObj )
          # The id is not the same, when returned from the server
-         results[ 'id' ] = results[ 'id' ] + '_FAKE_NEW_ID'
+         results[ 'id' ] = results.get( 'id', 'new' ) + '_FAKE_NEW_ID'
          print( "DRY create: %r" % ( results, ) )
       return results
 
    def delete_filter( self, filterId ):
       if not self.dryWrites:
-         # pylint: disable=no-member
-         results = self._service.users().settings().filters()\
-               .delete( userId='me', id=filterId ).execute()
+         results = self._execute( 'delete_filter',
+                                  self._filters.delete( userId='me', id=filterId ) )
          print( "delete: %r: %r" % ( filterId, results, ) )
       else:
          results = self.get_filter( filterId )
          print( "DRY delete %r: %r" % ( filterId, results, ) )
       return results
 
-class Printer( object ):
-   def __init__( self, service, color ):
-      self.service = service
-      self.color = color
-      self.labelMap = None
-
-   def maybe_color( self, msg, fg=None, style=None ):
-      if self.color:
-         return colors.color( msg, fg=fg, style=style )
-
-      return msg
-
-   def label_map( self ):
-      if self.labelMap is None:
-         self.labelMap = {}
-         labels = self.service.get_labels()
-         for label in labels:
-            self.labelMap[ label[ 'id' ] ] = label[ 'name' ]
-
-      return self.labelMap
-
-   def print_filter( self, filter_, newFilter=None ):
-      print( 'Filter %s:' % filter_[ 'id' ] )
-      # Get all criteria keys, so we don't miss any, between the filter and
-      # new filter if it is provided.
-      criteriaKeys = set( filter_[ 'criteria' ].keys() )
-      if newFilter is not None:
-         criteriaKeys.update( newFilter[ 'criteria' ].keys() )
-
-      # Print all criteria
-      for k in criteriaKeys:
-         v = filter_[ 'criteria' ].get( k )
-         newValLine = None
-         oldValStr = v if v is not None else repr( v )
-         oldValLine = "  %s: %s" % ( k, oldValStr )
-
-         if newFilter is not None:
-            newValue = newFilter[ 'criteria' ].get( k )
-            if newValue != v:
-               oldValLine = self.maybe_color( '-' + oldValLine, fg='red' )
-               oldValStr = repr( oldValStr )
-               newValStr = newValue if newValue is not None else repr( newValue )
-               newValLine = self.maybe_color( '+  %s: %s' % ( k, newValStr ),
-                                              fg='green' )
-
-         print( oldValLine )
-         if newValLine is not None:
-            print( newValLine )
-
-      # This is cached, so it's ok to call it every time.
-      labelIdsToName = self.label_map()
-      # Print all actions to apply to the filter
-      for k, v in filter_[ 'action' ].items():
-         # Labels appear in a list, with the label id, which is not very useful
-         # to read. Replace them with their readable name.
-         if k == 'addLabelIds':
-            for i in range( len( v ) ):
-               if v[ i ] in labelIdsToName:
-                  v[ i ] = labelIdsToName[ v[ i ] ]
-
-         if isinstance( v, list ):
-            v = ', '.join( str( x ) for x in v )
-
-         print( "  -> %s: %s" % ( k, v ) )
+   def replace_filters( self, filterObjs, batchSize=DEFAULT_BATCH_SIZE, journal=None ):
+      '''Replaces each filter in filterObjs, like create_filter followed by
+      delete_filter of its id, but sending batches of up to batchSize requests.
+
+      The old version of a filter is only deleted once its new version was
+      created. Requests which fail in a way the scheduler retries are sent
+      again in a later batch, and batches shrink while requests are being
+      throttled. Creates which failed with a 5xx are looked for among the
+      filters first, and only sent again if they made none. Each create and
+      delete is recorded in journal, if given, as soon as it succeeds. Returns
+      a FilterWriteResult for each filter, in order.
+      '''
+      assert 0 < batchSize <= MAX_BATCH_SIZE
+      results = [ FilterWriteResult( f ) for f in filterObjs ]
+      if self.dryWrites:
+         for result in results:
+            result.created = self.create_filter( result.filter )
+            self.delete_filter( result.oldId )
+            result.deleted = True
+         return results
+
+      filters = self._filters
+      limit = AdaptiveLimit( batchSize )
+      self.scheduler.limits.append( limit )
+      pending = deque( results )
+      attempts = {}
+      try:
+         while pending:
+            chunk = [ pending.popleft() for _ in range( min( limit.value, len( pending ) ) ) ]
+
+            def created( result, response ):
+               result.created = response
+               if journal is not None:
+                  journal.created( result.oldId, response[ 'id' ] )
+               print( "create: %r" % ( response, ) )
+            self._execute_batch( 'create_filter',
+                                 [ r for r in chunk if r.created is None ],
+                                 lambda r: filters.create( userId='me', body=r.filter ),
+                                 created )
+
+            def deleted( result, response ):
+               result.deleted = True
+               if journal is not None:
+                  journal.deleted( result.oldId )
+               print( "delete: %r: %r" % ( result.oldId, response, ) )
+            self._execute_batch( 'delete_filter',
+                                 [ r for r in chunk if r.ok() and r.created is not None ],
+                                 lambda r: filters.delete( userId='me', id=r.oldId ),
+                                 deleted )
+
+            delay, unsure = self._requeue_failed( chunk, pending, attempts )
+            if delay is not None:
+               self.scheduler.sleep( delay )
+            else:
+               self.scheduler.succeeded()
+            self._reconcile_creates( unsure, created )
+      finally:
+         self.scheduler.limits.remove( limit )
+      return results
+
+   def _requeue_failed( self, chunk, pending, attempts ):
+      '''Puts the results of chunk which failed in a way worth retrying back at
+      the front of pending. Returns how long to wait before sending them, or
+      None if there are none, and those whose create may have been made
+      despite failing.
+      '''
+      delays = []
+      unsure = []
+      for result in reversed( chunk ):
+         if result.ok():
+            continue
+         delay = self.scheduler.retry_delay( result.error, attempts.get( result, 0 ) )
+         if delay is not None:
+            if result.created is None and \
+               is_unsafe_retry( 'create_filter', result.error ):
+               unsure.append( result )
+            attempts[ result ] = attempts.get( result, 0 ) + 1
+            result.error = None
+            pending.appendleft( result )
+            delays.append( delay )
+      return ( max( delays ) if delays else None ), unsure
+
+   def _reconcile_creates( self, results, on_created ):
+      '''Calls on_created( result, filter ) for each of results whose failed
+      create made filter anyway, so that it is not made again.
+      '''
+      if not results:
+         return
+      currentFilters = self.get_filters()
+      for result in results:
+         found = find_created( currentFilters, result.filter )
+         if found is not None:
+            on_created( result, found )
+
+   def _execute_batch( self, method, results, make_request, on_response ):
+      '''Sends make_request( result ) for each of results in one batch, once
+      the quota allows them, and calls on_response( result, response ) for each
+      one that succeeds. The errors of the others are set on their result.
+      '''
+      if not results:
+         return
+      answered = set()
+
+      def callback( requestId, response, exception ):
+         result = results[ int( requestId ) ]
+         answered.add( result )
+         if exception is not None:
+            result.error = exception
+         else:
+            on_response( result, response )
 
+      # pylint: disable=no-member
+      batch = self._service.new_batch_http_request( callback=callback )
+      for i, result in enumerate( results ):
+         batch.add( make_request( result ), request_id=str( i ) )
+      self.scheduler.wait( QUOTA_COSTS[ method ] * len( results ) )
+      try:
+         batch.execute()
+      except ( errors.Error, httplib2.HttpLib2Error, IOError ) as e:
+         for result in results:
+            if result not in answered:
+               result.error = e
@@ -0,0 +1,287 @@
+from __future__ import print_function
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import copy
+import json
+import threading
+from urllib.parse import quote, urlencode
+
+import httplib2
+
+from GmailFilters.FakeBackend import FakeGmail
+from GmailFilters.Labels import LabelCache
+from GmailFilters.Scheduler import Scheduler, AdaptiveLimit, QUOTA_COSTS, \
+                                   is_unsafe_retry
+from GmailFilters.Write import FilterWriteResult, find_created
+
+API_ROOT = 'https://gmail.googleapis.com/gmail/v1/'
+DEFAULT_CONCURRENCY = 10
+
+class ApiError( Exception ):
+   def __init__( self, status, message, retryAfter=None ):
+      Exception.__init__( self, "HTTP %d: %s" % ( status, message ) )
+      self.status = status
+      self.message = message
+      self.retryAfter = retryAfter
+
+class Transport( object ):
+   '''Sends Gmail API requests for an AsyncService.
+
+   request() takes the HTTP method, the path under users/<userId>/, optional
+   query parameters and JSON body, and returns ( status, decoded JSON body,
+   headers ), with lower case header names.
+   '''
+   async def request( self, method, path, params=None, body=None ):
+      raise NotImplementedError
+
+   def close( self ):
+      pass
+
+class HttpTransport( Transport ):
+   '''Sends requests with httplib2, from a bounded pool of threads, each with
+   its own Http from make_http.
+   '''
+   def __init__( self, make_http, userId='me', maxWorkers=DEFAULT_CONCURRENCY ):
+      self.make_http = make_http
+      self.userId = userId
+      self._pool = ThreadPoolExecutor( max_workers=maxWorkers )
+      self._local = threading.local()
+
+   def _http( self ):
+      http = getattr( self._local, 'http', None )
+      if http is None:
+         http = self.make_http()
+         self._local.http = http
+      return http
+
+   def _send( self, method, url, body ):
+      headers = { 'content-type': 'application/json' }
+      try:
+         response, content = self._http().request(
+               url, method=method, headers=headers,
+               body=json.dumps( body ) if body is not None else None )
+      except httplib2.HttpLib2Error as e:
+         raise IOError( str( e ) )
+      try:
+         result = json.loads( content.decode( 'utf-8' ) ) if content else {}
+      except ValueError:
+         # Errors from proxies and load balancers may not be JSON
+         result = {}
+      return int( response.status ), result, dict( response )
+
+   async def request( self, method, path, params=None, body=None ):
+      url = API_ROOT + 'users/%s/%s' % ( quote( self.userId ), path )
+      if params:
+         url += '?' + urlencode( params )
+      loop = asyncio.get_running_loop()
+      return await loop.run_in_executor( self._pool, self._send, method, url, body )
+
+   def close( self ):
+      self._pool.shutdown()
+
+class FakeTransport( Transport ):
+   '''Serves requests from gmail, a FakeBackend.FakeGmail, or one holding
+   filters and labels in memory, after its delay each, for testing and load
+   testing without a network.
+   '''
+   def __init__( self, emailAddr='me@example.com', filters=None, labels=None,
+                 latency=0.0, gmail=None ):
+      if gmail is None:
+         gmail = FakeGmail( emailAddr, filters=filters, labels=labels,
+                            latency=latency )
+      self.gmail = gmail
+      self.requests = 0
+      self.inFlight = 0
+      self.maxInFlight = 0
+
+   @property
+   def filters( self ):
+      return self.gmail.filters
+
+   async def request( self, method, path, params=None, body=None ):
+      self.requests += 1
+      self.inFlight += 1
+      self.maxInFlight = max( self.maxInFlight, self.inFlight )
+      try:
+         await asyncio.sleep( self.gmail.delay() )
+         return self.gmail.respond( method, path, body )
+      finally:
+         self.inFlight -= 1
+
+class AdaptiveSlots( object ):
+   '''Like an asyncio.Semaphore, entered by at most limit.value coroutines at
+   once, as the AdaptiveLimit limit changes.
+   '''
+   def __init__( self, limit ):
+      self.limit = limit
+      self.inUse = 0
+      self._condition = asyncio.Condition()
+
+   async def __aenter__( self ):
+      async with self._condition:
+         await self._condition.wait_for( lambda: self.inUse < self.limit.value )
+         self.inUse += 1
+
+   async def __aexit__( self, *excInfo ):
+      async with self._condition:
+         self.inUse -= 1
+         self._condition.notify_all()
+
+class AsyncService( object ):
+   '''The coroutine version of Api.Service, sending requests with transport.
+
+   Many requests, and many AsyncServices for different accounts, can be in
+   flight from one event loop. Requests are paced and retried by scheduler,
+   like those of Api.Service.
+   '''
+   def __init__( self, transport, dryWrites=False, scheduler=None ):
+      self.transport = transport
+      self.dryWrites = dryWrites
+      self.scheduler = scheduler if scheduler is not None else Scheduler()
+
+   async def _request( self, method, httpMethod, path, params=None, body=None,
+                       reconcile=None ):
+      '''Returns the result of the request, sent again while it fails in a way
+      worth retrying. An unsafe method is only sent again after a 5xx if the
+      coroutine reconcile() returns None, rather than what the request made,
+      like with Scheduler.call.
+      '''
+      attempt = 0
+      while True:
+         await asyncio.sleep( self.scheduler.reserve( QUOTA_COSTS[ method ] ) )
+         status, result, headers = await self.transport.request(
+               httpMethod, path, params=params, body=body )
+         if 200 <= status < 300:
+            self.scheduler.succeeded()
+            return result
+         message = result.get( 'error', {} ).get( 'message', '' ) \
+                   if isinstance( result, dict ) else ''
+         error = ApiError( status, message, retryAfter=headers.get( 'retry-after' ) )
+         unsafe = is_unsafe_retry( method, error )
+         delay = None if unsafe and reconcile is None else \
+                 self.scheduler.retry_delay( error, attempt )
+         if delay is None:
+            raise error
+         attempt += 1
+         await asyncio.sleep( delay )
+         if unsafe:
+            result = await reconcile()
+            if result is not None:
+               return result
+
+   async def get_email_addr( self ):
+      results = await self._request( 'get_email_addr', 'GET', 'profile' )
+      return results.get( 'emailAddress', None )
+
+   async def get_labels( self ):
+      results = await self._request( 'get_labels', 'GET', 'labels' )
+      return results.get( 'labels', [] )
+
+   async def get_filter( self, filterId ):
+      return await self._request( 'get_filter', 'GET',
+                                  'settings/filters/' + quote( filterId ) )
+
+   async def get_filters( self ):
+      results = await self._request( 'get_filters', 'GET', 'settings/filters' )
+      return results.get( 'filter', [] )
+
+   async def create_filter( self, filterObj ):
+      if not self.dryWrites:
+         async def reconcile():
+            return find_created( await self.get_filters(), filterObj )
+         results = await self._request( 'create_filter', 'POST', 'settings/filters',
+                                        body=filterObj, reconcile=reconcile )
+         print( "create: %r" % ( results, ) )
+      else:
+         results = copy.deepcopy( filterObj )
+         # The id is not the same, when returned from the server
+         results[ 'id' ] = results.get( 'id', 'new' ) + '_FAKE_NEW_ID'
+         print( "DRY create: %r" % ( results, ) )
+      return results
+
+   async def delete_filter( self, filterId ):
+      if not self.dryWrites:
+         results = await self._request( 'delete_filter', 'DELETE',
+                                        'settings/filters/' + quote( filterId ) )
+         print( "delete: %r: %r" % ( filterId, results, ) )
+      else:
+         results = await self.get_filter( filterId )
+         print( "DRY delete %r: %r" % ( filterId, results, ) )
+      return results
+
+   async def _replace_filter( self, result, slots, journal ):
+      async with slots:
+         try:
+            result.created = await self.create_filter( result.filter )
+            if journal is not None:
+               journal.created( result.oldId, result.created[ 'id' ] )
+            await self.delete_filter( result.oldId )
+            result.deleted = True
+            if journal is not None:
+               journal.deleted( result.oldId )
+         except ( ApiError, IOError ) as e:
+            result.error = e
+
+   async def replace_filters( self, filterObjs, concurrency=DEFAULT_CONCURRENCY,
+                              journal=None ):
+      '''Like Service.replace_filters, but with up to concurrency filters being
+      replaced at once, each created before its old version is deleted. Fewer
+      are while requests are being throttled.
+      '''
+      results = [ FilterWriteResult( f ) for f in filterObjs ]
+      limit = AdaptiveLimit( concurrency )
+      self.scheduler.limits.append( limit )
+      try:
+         slots = AdaptiveSlots( limit )
+         await asyncio.gather( *[ self._replace_filter( r, slots, journal ) for r in results ] )
+      finally:
+         self.scheduler.limits.remove( limit )
+      return results
+
+class BlockingService( object ):
+   '''Gives an AsyncService the blocking interface of Api.Service, so that
+   the commands can run on it.
+   '''
+   def __init__( self, asyncService, concurrency=DEFAULT_CONCURRENCY ):
+      self.asyncService = asyncService
+      self.concurrency = concurrency
+      self.dryWrites = asyncService.dryWrites
+      self.emailAddr = None
+      self._labelCache = None
+      self._loop = asyncio.new_event_loop()
+
+   def _run( self, coroutine ):
+      return self._loop.run_until_complete( coroutine )
+
+   def get_email_addr( self ):
+      return self._run( self.asyncService.get_email_addr() )
+
+   def get_labels( self ):
+      return self._run( self.asyncService.get_labels() )
+
+   def label_cache( self ):
+      if self._labelCache is None:
+         self._labelCache = LabelCache.for_account( self.get_labels, self.emailAddr )
+      return self._labelCache
+
+   def get_filter( self, filterId ):
+      return self._run( self.asyncService.get_filter( filterId ) )
+
+   def get_filters( self ):
+      return self._run( self.asyncService.get_filters() )
+
+   def create_filter( self, filterObj ):
+      return self._run( self.asyncService.create_filter( filterObj ) )
+
+   def delete_filter( self, filterId ):
+      return self._run( self.asyncService.delete_filter( filterId ) )
+
+   def replace_filters( self, filterObjs, batchSize=None, # pylint: disable=unused-argument
+                        journal=None ):
+      # Requests are not batched, but sent concurrently
+      return self._run( self.asyncService.replace_filters(
+            filterObjs, concurrency=self.concurrency, journal=journal ) )
+
+   def close( self ):
+      self.asyncService.transport.close()
+      self._loop.close()
@@ -0,0 +1,32 @@
+from __future__ import print_function
+import os
+import tempfile
+
+home_dir = os.path.expanduser( '~' )
+config_dir = os.path.join( home_dir, '.gmail_filters' )
+
+# config_dir may be changed after import, eg. for a fake backend, so paths in
+# it are found when needed, and not kept.
+def config_file( name ):
+   '''Returns the path of the file name, kept for all accounts.'''
+   return os.path.join( config_dir, name )
+
+def account_file( emailAddr, name ):
+   '''Returns the path of the file name, kept for the account emailAddr.'''
+   return os.path.join( config_dir, 'accounts', emailAddr or 'unknown', name )
+
+def atomic_write( path, data, mode='w' ):
+   '''Writes data to path through a temporary file, so readers never see a
+   partially written file.
+   '''
+   dirName = os.path.dirname( path ) or '.'
+   if not os.path.exists( dirName ):
+      os.makedirs( dirName )
+   fd, tmpPath = tempfile.mkstemp( dir=dirName, prefix='.tmp-' )
+   try:
+      with os.fdopen( fd, mode ) as f:
+         f.write( data )
+      os.replace( tmpPath, path )
+   except:
+      os.unlink( tmpPath )
+      raise
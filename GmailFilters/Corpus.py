@@ -0,0 +1,79 @@
+from __future__ import print_function
+import os
+import re
+
+from GmailFilters.Match import Message
+
+mbox_escape_regexp = re.compile( br'^>+From ' )
+
+def iter_mbox( path ):
+   '''Yields ( key, raw bytes ) of each message of the mbox at path, reading
+   one message at a time.
+   '''
+   lines = []
+   count = 0
+   with open( path, 'rb' ) as f:
+      for line in f:
+         # Like the mailbox module, every From line starts a message, as
+         # writers escape those in bodies
+         if line.startswith( b'From ' ):
+            if lines:
+               yield '%s:%d' % ( path, count ), b''.join( lines )
+               count += 1
+            lines = []
+         else:
+            if mbox_escape_regexp.match( line ):
+               line = line[ 1: ]
+            lines.append( line )
+   if lines:
+      yield '%s:%d' % ( path, count ), b''.join( lines )
+
+def read_file( path ):
+   with open( path, 'rb' ) as f:
+      return f.read()
+
+def iter_maildir( path ):
+   for subDir in ( 'new', 'cur' ):
+      dirPath = os.path.join( path, subDir )
+      if not os.path.isdir( dirPath ):
+         continue
+      for entry in sorted( os.scandir( dirPath ), key=lambda e: e.name ):
+         if entry.is_file() and not entry.name.startswith( '.' ):
+            yield entry.path, read_file( entry.path )
+
+def iter_eml_dir( path ):
+   for dirPath, dirNames, fileNames in os.walk( path ):
+      dirNames.sort()
+      for name in sorted( fileNames ):
+         if name.lower().endswith( '.eml' ):
+            filePath = os.path.join( dirPath, name )
+            yield filePath, read_file( filePath )
+
+def is_maildir( path ):
+   return os.path.isdir( os.path.join( path, 'cur' ) ) and \
+          os.path.isdir( os.path.join( path, 'new' ) )
+
+def iter_raw_messages( path ):
+   '''Yields ( key, raw bytes ) of the messages at path, which is an mbox file,
+   a .eml file, a Maildir, or a directory tree of .eml files.
+   '''
+   if os.path.isdir( path ):
+      if is_maildir( path ):
+         for item in iter_maildir( path ):
+            yield item
+      else:
+         for item in iter_eml_dir( path ):
+            yield item
+   elif path.lower().endswith( '.eml' ):
+      yield path, read_file( path )
+   else:
+      for item in iter_mbox( path ):
+         yield item
+
+def iter_messages( paths ):
+   '''Yields a Message for each message at paths, one at a time, so that
+   corpora of any size are read in bounded memory.
+   '''
+   for path in paths:
+      for key, raw in iter_raw_messages( path ):
+         yield Message( raw, key )
@@ -0,0 +1,213 @@
+from __future__ import print_function
+from collections import Counter
+import re
+
+from GmailFilters import parse_filter_element
+from GmailFilters.Template import META_LABEL, META_PRIMARY_LABEL, meta_regexp, \
+                                  find_all_meta_group_keys, TemplateError
+
+DEFAULT_MIN_COUNT = 2
+DEFAULT_MIN_SIZE = 20
+
+name_regexp = re.compile( r'^[\w.-]+$' )
+
+class SubtreeTable( object ):
+   '''Hash-conses FilterElement trees, so that subtrees which are equal but for
+   whitespace get the same id, and are stored once.
+
+   nodes[ id ] is ( delims, filterStr, childIds, spaced ), where text and
+   quoted elements have childIds None, and groups have filterStr None. Only
+   whether siblings are separated by whitespace is kept, in spaced, as
+   subject:(x) is not subject: (x). counts[ id ] is how many times the subtree
+   occurs in the added trees, and sizes[ id ] the length of its text with
+   whitespace normalized.
+   '''
+   def __init__( self ):
+      self.nodes = []
+      self.idByNode = {}
+      self.counts = []
+      self.sizes = []
+      self.hasMeta = []
+      self.roots = {}
+
+   def _node( self, elem, intern ):
+      if elem.subElems is None:
+         return ( elem.delims, elem.filterStr, None, None )
+      childIds = []
+      spaced = []
+      ws = False
+      for se in elem.subElems:
+         ws = ws or bool( se.preWs )
+         if se.subElems is not None or se.delims is not None or se.filterStr:
+            childId = intern( se )
+            if childId is None:
+               return None
+            spaced.append( ws and bool( childIds ) )
+            childIds.append( childId )
+            ws = False
+         ws = ws or bool( se.postWs )
+      return ( elem.delims, None, tuple( childIds ), tuple( spaced ) )
+
+   def add( self, elem ):
+      '''Adds an occurrence of elem and its subtrees, and returns elem's id.'''
+      node = self._node( elem, self.add )
+      id_ = self.idByNode.get( node )
+      if id_ is None:
+         id_ = len( self.nodes )
+         self.nodes.append( node )
+         self.idByNode[ node ] = id_
+         self.counts.append( 0 )
+         self.sizes.append( self._size( node ) )
+         self.hasMeta.append( self._has_meta( node ) )
+      self.counts[ id_ ] += 1
+      return id_
+
+   def lookup( self, elem ):
+      '''Returns the id of elem, or None if no equal subtree was added.'''
+      node = self._node( elem, self.lookup )
+      return self.idByNode.get( node ) if node is not None else None
+
+   def add_filter( self, filterId, filterElem ):
+      self.roots[ filterId ] = self.add( filterElem )
+
+   def _size( self, node ):
+      delims, filterStr, childIds, spaced = node
+      delimsLen = 2 if delims is not None else 0
+      if childIds is None:
+         return len( filterStr ) + delimsLen
+      return sum( self.sizes[ c ] for c in childIds ) + sum( spaced ) + delimsLen
+
+   def _has_meta( self, node ):
+      _, filterStr, childIds, _ = node
+      if childIds is None:
+         return any( meta_regexp.match( w ) for w in filterStr.split() )
+      return any( self.hasMeta[ c ] for c in childIds )
+
+   def text( self, id_ ):
+      '''Returns the text of subtree id_, with whitespace normalized.'''
+      delims, filterStr, childIds, spaced = self.nodes[ id_ ]
+      if childIds is None:
+         string = filterStr
+      else:
+         string = ''.join( ( ' ' if s else '' ) + self.text( c )
+                           for c, s in zip( childIds, spaced ) )
+      if delims is not None:
+         string = delims[ 0 ] + string + delims[ 1 ]
+      return string
+
+   def descendant_counts( self, id_ ):
+      '''Returns how many times each subtree occurs within one occurrence of
+      subtree id_.
+      '''
+      counts = Counter()
+      pending = list( self.nodes[ id_ ][ 2 ] or () )
+      while pending:
+         c = pending.pop()
+         counts[ c ] += 1
+         pending.extend( self.nodes[ c ][ 2 ] or () )
+      return counts
+
+   def total_nodes( self ):
+      return sum( self.counts )
+
+class Repeat( object ):
+   '''A subexpression which occurs count times, in the filters filterIds.'''
+   __slots__ = ( 'id', 'text', 'size', 'count', 'filterIds' )
+
+   def __init__( self, id_, text, size, count, filterIds ):
+      self.id = id_
+      self.text = text
+      self.size = size
+      self.count = count
+      self.filterIds = filterIds
+
+   def score( self ):
+      return self.size * self.count
+
+def subtree_table( filterElemById ):
+   table = SubtreeTable()
+   for id_, filterElem in filterElemById.items():
+      table.add_filter( id_, filterElem )
+   return table
+
+def repeated_subexpressions( table, minCount=DEFAULT_MIN_COUNT,
+                             minSize=DEFAULT_MIN_SIZE ):
+   '''Returns the groups which occur at least minCount times, ranked by size
+   times count. Groups holding template groups are left out, as are groups
+   whose every occurrence is within a higher ranked repeat.
+   '''
+   candidates = [ id_ for id_, ( delims, _, childIds, _ ) in enumerate( table.nodes )
+                  if childIds is not None and delims is not None and
+                  table.counts[ id_ ] >= minCount and
+                  table.sizes[ id_ ] >= minSize and not table.hasMeta[ id_ ] ]
+   candidates.sort( key=lambda c: ( -table.sizes[ c ] * table.counts[ c ], c ) )
+
+   filterIdsById = {}
+   for filterId, rootId in table.roots.items():
+      seen = set( table.descendant_counts( rootId ) )
+      seen.add( rootId )
+      for id_ in seen:
+         filterIdsById.setdefault( id_, [] ).append( filterId )
+
+   repeats = []
+   covered = Counter()
+   for id_ in candidates:
+      count = table.counts[ id_ ] - covered[ id_ ]
+      if count < minCount:
+         continue
+      repeats.append( Repeat( id_, table.text( id_ ), table.sizes[ id_ ], count,
+                              filterIdsById.get( id_, [] ) ) )
+      for descendant, n in table.descendant_counts( id_ ).items():
+         covered[ descendant ] += n * count
+   return repeats
+
+def template_strs( name, text ):
+   '''Returns the reference and the primary group of template name, for a
+   subexpression text. An OR group's members become the template's members.
+   '''
+   members = text[ 1:-1 ] if text.startswith( '{' ) else text
+   return ( '{(%s %s) %s}' % ( META_LABEL, name, members ),
+            '{(%s %s) %s}' % ( META_PRIMARY_LABEL, name, members ) )
+
+def extract_templates( filterElemById, table, extractions ):
+   '''Replaces every occurrence of each subexpression in extractions, a list of
+   ( template name, subtree id ), with a reference to a new template.
+
+   Returns { template name: primary query }, for the filters which must be
+   created to define them, and the ids of the filters which changed.
+   '''
+   existingKeys = set()
+   for filterElem in filterElemById.values():
+      existingKeys |= find_all_meta_group_keys( filterElem )
+
+   refById = {}
+   primaries = {}
+   for name, id_ in extractions:
+      if not name_regexp.match( name ) or meta_regexp.match( name ):
+         raise TemplateError( "Bad template name: %r" % name )
+      if ( name, ) in existingKeys or name in primaries:
+         raise TemplateError( "Template %r already exists" % name )
+      refStr, primaries[ name ] = template_strs( name, table.text( id_ ) )
+      refById[ id_ ] = refStr
+
+   changedIds = []
+   def replace( elem ):
+      changed = False
+      for i, se in enumerate( elem.subElems ):
+         if se.subElems is None:
+            continue
+         refStr = refById.get( table.lookup( se ) )
+         if refStr is not None:
+            ref = parse_filter_element( refStr ).subElems[ 0 ]
+            ref.preWs = se.preWs
+            ref.postWs = se.postWs
+            elem.subElems[ i ] = ref
+            changed = True
+         elif replace( se ):
+            changed = True
+      return changed
+
+   for filterId, filterElem in filterElemById.items():
+      if filterElem.subElems is not None and replace( filterElem ):
+         changedIds.append( filterId )
+   return primaries, changedIds
@@ -0,0 +1,296 @@
+from __future__ import print_function
+from bisect import bisect_left
+from difflib import SequenceMatcher
+from itertools import accumulate
+import re
+
+from GmailFilters import CLOSE_DELIMS, DELIM_PAIRS, OPEN_DELIMS, \
+                          FilterElement, delim_regexp, parse_filter_element
+from GmailFilters.Template import get_template_group_key, TemplateError
+
+DIFF_MODES = ( 'lines', 'tree', 'summary' )
+EQUAL = '='
+DELETE = '-'
+INSERT = '+'
+# How each delim changes the depth of groups
+DELIM_STEPS = dict( [ ( c, 1 ) for c in OPEN_DELIMS ] +
+                    [ ( c, -1 ) for c in CLOSE_DELIMS ] )
+# Text up to and including a delim
+to_delim_regexp = re.compile( '[^(){}]*[(){}]' )
+# The start of a group or quote, or a word, at the top level of a query
+element_start_regexp = re.compile( r'[({"]|[^ (){}"]+' )
+# The characters which end a word of a query
+WORD_BREAKS = ' (){}"'
+# How much of a changed subexpression a summary shows
+SUMMARY_TEXT_LEN = 60
+
+def unpadded_text( elem, text=None ):
+   '''Returns the text of elem, without its own padding.'''
+   if text is None:
+      text = elem.full_filter_str()
+   return text[ len( elem.preWs ):len( text ) - len( elem.postWs ) ]
+
+class KeyTable( object ):
+   '''Gives subtrees with the same text, aside from their own padding, the
+   same int key. Group strings are memoized, so keying an element is only
+   linear in its text, and not in the size of its subtree, once its tree has
+   been serialized.
+   '''
+   def __init__( self ):
+      self.keyByText = {}
+
+   def key( self, elem ):
+      return self.text_key( unpadded_text( elem ) )
+
+   def text_key( self, text ):
+      return self.keyByText.setdefault( text, len( self.keyByText ) )
+
+def template_key( elem ):
+   try:
+      return get_template_group_key( elem )
+   except TemplateError:
+      return None
+
+def joins_word( text, i ):
+   '''Returns whether the characters of text either side of index i are both
+   within words, ie. would be parsed as one element.
+   '''
+   return 0 < i < len( text ) and text[ i - 1 ] not in WORD_BREAKS and \
+          text[ i ] not in WORD_BREAKS
+
+class TreeDiff( object ):
+   '''The changes from a query to a parsed new query.
+
+   The old query is not parsed. The new query's children which the old
+   text starts or ends with are unchanged. The top level elements of the
+   text between them are found, and aligned with the remaining children by
+   key, and only groups with the same delimiters in the same place are
+   compared further. The new tree's strings are memoized, so the diff of a
+   query only looks at the text around its changes. segments is the new
+   query as a list of ( kind, text ), where kind is EQUAL, DELETE or INSERT,
+   and hunks holds the ( template key, removed text, inserted text ) of each
+   change, with the key of the innermost template group holding it, or None.
+   '''
+   def __init__( self, oldQuery, new ):
+      self.keys = KeyTable()
+      self.segments = []
+      self.hunks = []
+      self.old = oldQuery
+      # The new groups holding the one being diffed, innermost last
+      self.groups = []
+      self.templateKeyById = {}
+      if oldQuery == new.full_filter_str():
+         self.segments.append( ( EQUAL, oldQuery ) )
+         return
+      # The positions of the delims of the old query, and the depth of
+      # groups after each, found when first needed
+      self.delimStarts = None
+      self.depths = None
+      self._diff_group( 0, len( oldQuery ), new )
+
+   @classmethod
+   def from_queries( cls, oldQuery, newQuery ):
+      return cls( oldQuery, parse_filter_element( newQuery ) )
+
+   def changed( self ):
+      return bool( self.hunks )
+
+   def _group_end( self, groupStart ):
+      '''Returns the end of the old query's group starting at groupStart.
+      Delims are counted as the parser balances them.
+      '''
+      if self.delimStarts is None:
+         self.delimStarts = [ end - 1 for end in accumulate(
+               map( len, to_delim_regexp.findall( self.old ) ) ) ]
+         self.depths = list( accumulate( map( DELIM_STEPS.__getitem__,
+                                              delim_regexp.findall( self.old ) ) ) )
+      i = bisect_left( self.delimStarts, groupStart )
+      return self.delimStarts[ self.depths.index( self.depths[ i ] - 1, i ) ] + 1
+
+   def _element_spans( self, start, end ):
+      '''Returns the ( start, end ) of each element of the old query between
+      start and end, without its padding. Only the elements at the top level
+      are found, without looking into their contents.
+      '''
+      spans = []
+      while True:
+         m = element_start_regexp.search( self.old, start, end )
+         if m is None:
+            return spans
+         c = m.group()
+         if c in OPEN_DELIMS:
+            start = self._group_end( m.start() )
+         elif c == '"':
+            start = self.old.index( '"', m.end() ) + 1
+         else:
+            start = m.end()
+         spans.append( ( m.start(), start ) )
+
+   def _template_key( self ):
+      '''Returns the key of the innermost template group being diffed, or
+      None. It is only looked up once a change is found in it.
+      '''
+      for group in reversed( self.groups ):
+         if id( group ) not in self.templateKeyById:
+            self.templateKeyById[ id( group ) ] = template_key( group )
+         key = self.templateKeyById[ id( group ) ]
+         if key is not None:
+            return key
+      return None
+
+   def _diff_group( self, start, end, new ):
+      '''Diffs the old query between start and end, the inside of a group,
+      with the children of new.
+      '''
+      old = self.old
+      newElems = new.subElems
+      i = 0
+      j = len( newElems )
+      # Children are matched aside from their padding, and only to whole
+      # elements of the old text, not to the start or end of a longer word.
+      while i < j:
+         while start < end and old[ start ] == ' ':
+            start += 1
+         core = unpadded_text( newElems[ i ] )
+         if not old.startswith( core, start, end ) or \
+            joins_word( old, start + len( core ) ):
+            break
+         start += len( core )
+         i += 1
+      while j > i:
+         while end > start and old[ end - 1 ] == ' ':
+            end -= 1
+         core = unpadded_text( newElems[ j - 1 ] )
+         if not old.endswith( core, start, end ) or \
+            joins_word( old, end - len( core ) ):
+            break
+         end -= len( core )
+         j -= 1
+
+      if i:
+         self.segments.append( ( EQUAL, FilterElement.full_filter_list_str(
+               newElems[ :i ] ) ) )
+      if start < end or i < j:
+         self.groups.append( new )
+         self._diff_middle( start, end, newElems[ i:j ] )
+         self.groups.pop()
+      if j < len( newElems ):
+         self.segments.append( ( EQUAL, FilterElement.full_filter_list_str(
+               newElems[ j: ] ) ) )
+
+   def _diff_middle( self, start, end, newElems ):
+      old = self.old
+      oldSpans = self._element_spans( start, end )
+      if len( oldSpans ) == 1 and len( newElems ) == 1:
+         # Most often, one element changed
+         self._diff_elem( oldSpans[ 0 ][ 0 ], oldSpans[ 0 ][ 1 ], newElems[ 0 ] )
+         return
+      oldKeys = [ self.keys.text_key( old[ s:e ] ) for s, e in oldSpans ]
+      matcher = SequenceMatcher( None, oldKeys, [ self.keys.key( e ) for e in newElems ],
+                                 autojunk=False )
+      for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+         if tag == 'equal':
+            self.segments.append( ( EQUAL, FilterElement.full_filter_list_str(
+                  newElems[ j1:j2 ] ) ) )
+         elif tag == 'replace' and i2 - i1 == j2 - j1:
+            for ( s, e ), n in zip( oldSpans[ i1:i2 ], newElems[ j1:j2 ] ):
+               self._diff_elem( s, e, n )
+         else:
+            removed = old[ oldSpans[ i1 ][ 0 ]:oldSpans[ i2 - 1 ][ 1 ] ] \
+                      if i1 < i2 else ''
+            self._change( removed,
+                          FilterElement.full_filter_list_str( newElems[ j1:j2 ] ) )
+
+   def _diff_elem( self, start, end, new ):
+      '''Diffs the old element between start and end with new.'''
+      if new.subElems is None or new.delims not in DELIM_PAIRS or \
+         not self.old.startswith( new.delims[ 0 ], start ):
+         self._change( self.old[ start:end ], new.full_filter_str() )
+         return
+      self.segments.append( ( EQUAL, new.preWs + new.delims[ 0 ] ) )
+      self._diff_group( start + 1, end - 1, new )
+      self.segments.append( ( EQUAL, new.delims[ 1 ] + new.postWs ) )
+
+   def _change( self, removed, inserted ):
+      if removed:
+         self.segments.append( ( DELETE, removed ) )
+      if inserted:
+         self.segments.append( ( INSERT, inserted ) )
+      self.hunks.append( ( self._template_key(), removed.strip(), inserted.strip() ) )
+
+   def render( self, color=None ):
+      '''Returns the new query, with removed text marked [-like this-] and
+      inserted text [+like this+], or in red and green when given color, a
+      function of a string and fg.
+      '''
+      parts = []
+      for i, ( kind, text ) in enumerate( self.segments ):
+         if kind == EQUAL:
+            parts.append( text )
+            continue
+         prevKind = self.segments[ i - 1 ][ 0 ] if i > 0 else None
+         nextKind, nextText = self.segments[ i + 1 ] \
+                              if i + 1 < len( self.segments ) else ( None, '' )
+         replaced = kind == DELETE and nextKind == INSERT
+         if replaced:
+            # The insertion brings its own trailing whitespace
+            text = text.rstrip()
+         # The whitespace around a change is left unmarked. The whitespace
+         # separating a change from its siblings may be the other query's, so
+         # a space is kept between them, unless the change is one half of a
+         # replacement or is next to a group's delimiter.
+         core = text.strip()
+         before = text[ :len( text ) - len( text.lstrip() ) ]
+         after = text[ len( before ) + len( core ): ]
+         prevChar = parts[ -1 ][ -1: ] if parts else ''
+         if not before and prevChar and \
+            not ( prevChar.isspace() or prevChar in OPEN_DELIMS ) and \
+            not ( kind == INSERT and prevKind == DELETE ):
+            before = ' '
+         nextChar = nextText[ :1 ]
+         if not after and nextChar and \
+            not ( nextChar.isspace() or nextChar in CLOSE_DELIMS ) and \
+            not replaced:
+            after = ' '
+         if color is not None:
+            core = color( core, fg='red' if kind == DELETE else 'green' )
+         else:
+            core = '[%s%s%s]' % ( kind, core, kind )
+         parts.append( before + core + after )
+      return ''.join( parts )
+
+def shortened( text, length=SUMMARY_TEXT_LEN ):
+   return text if len( text ) <= length else text[ :length - 3 ] + '...'
+
+def summarize( queryDiffById ):
+   '''Groups filters whose queries changed in the same way.
+
+   Returns a list of ( hunks, filter ids ), most common first, where hunks
+   is the set of ( template key, removed text, inserted text ) they share.
+   '''
+   idsByHunks = {}
+   for id_, diff in queryDiffById.items():
+      hunks = frozenset( diff.hunks )
+      idsByHunks.setdefault( hunks, [] ).append( id_ )
+   return sorted( idsByHunks.items(), key=lambda item: ( -len( item[ 1 ] ),
+                                                         sorted( item[ 1 ] ) ) )
+
+def summary_lines( hunks, filterIds, color=None ):
+   '''Returns the lines describing one group of summarize().'''
+   keys = set( k for k, _, _ in hunks )
+   count = len( filterIds )
+   plural = 's' if count != 1 else ''
+   if len( keys ) == 1 and None not in keys:
+      title = "template %s changed in %d filter%s" % (
+            ' '.join( next( iter( keys ) ) ), count, plural )
+   else:
+      title = "%d filter%s changed" % ( count, plural )
+   lines = [ title + ": " + shortened( ', '.join( filterIds ) ) ]
+   for _, removed, inserted in sorted( hunks, key=lambda h: ( h[ 1 ], h[ 2 ] ) ):
+      if removed:
+         line = '  - ' + shortened( removed )
+         lines.append( color( line, fg='red' ) if color is not None else line )
+      if inserted:
+         line = '  + ' + shortened( inserted )
+         lines.append( color( line, fg='green' ) if color is not None else line )
+   return lines
@@ -0,0 +1,56 @@
+from __future__ import print_function
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+from GmailFilters.Write import DEFAULT_BATCH_SIZE, FilterWriteResult
+
+class ConcurrentWriter( object ):
+   '''Replaces filters from a bounded pool of worker threads.
+
+   An httplib2.Http, and so a Service, must not be shared between threads, so
+   each worker calls make_service once, for a Service of its own. Filters are
+   split into chunks, which the workers replace with Service.replace_filters,
+   so each filter is still created before its old version is deleted.
+   '''
+   def __init__( self, make_service, jobs ):
+      assert jobs > 0
+      self.make_service = make_service
+      self.jobs = jobs
+      self._local = threading.local()
+      self._lock = threading.Lock()
+      self.services = []
+
+   def service( self ):
+      service = getattr( self._local, 'service', None )
+      if service is None:
+         service = self.make_service()
+         self._local.service = service
+         with self._lock:
+            self.services.append( service )
+      return service
+
+   def chunk_size( self, count, batchSize ):
+      # Spread small changes over every worker, rather than batching them all
+      # into one.
+      return max( 1, min( batchSize, -( -count // self.jobs ) ) )
+
+   def _replace_chunk( self, chunk, batchSize, journal ):
+      try:
+         return self.service().replace_filters( chunk, batchSize=batchSize,
+                                                journal=journal )
+      except Exception as e: # pylint: disable=broad-except
+         results = [ FilterWriteResult( f ) for f in chunk ]
+         for result in results:
+            result.error = e
+         return results
+
+   def replace_filters( self, filterObjs, batchSize=DEFAULT_BATCH_SIZE, journal=None ):
+      '''Like Service.replace_filters. The results are in the order of
+      filterObjs, whatever order the workers finish in.
+      '''
+      size = self.chunk_size( len( filterObjs ), batchSize )
+      chunks = [ filterObjs[ i:i + size ] for i in range( 0, len( filterObjs ), size ) ]
+      with ThreadPoolExecutor( max_workers=self.jobs ) as pool:
+         futures = [ pool.submit( self._replace_chunk, chunk, size, journal )
+                     for chunk in chunks ]
+         return [ result for future in futures for result in future.result() ]
@@ -0,0 +1,265 @@
+from __future__ import print_function
+import atexit
+import copy
+from email.parser import FeedParser
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from urllib.parse import urlparse, unquote
+
+import httplib2
+
+from GmailFilters.Config import atomic_write
+
+STORE_VERSION = 1
+DEFAULT_EMAIL = 'fake@example.com'
+# Saves of the store are at most this often, but always made on exit
+SAVE_INTERVAL = 1.0
+# The exit status of a process crashed by crashAfter
+CRASH_STATUS = 75
+
+# The options of a fake backend spec, and their types
+OPTIONS = {
+   'latency': float,
+   'jitter': float,
+   'rateLimitRate': float,
+   'errorRate': float,
+   'retryAfter': float,
+   'seed': int,
+   'crashAfter': int,
+}
+
+class BackendError( Exception ):
+   pass
+
+def parse_spec( spec ):
+   '''Returns the path and options of a backend spec, like
+   fake:PATH,latency=0.05,errorRate=0.01.
+   '''
+   if not spec.startswith( 'fake:' ):
+      raise BackendError( "Unknown backend %r. Only fake:PATH is supported" % spec )
+   path, _, optionStr = spec[ len( 'fake:' ): ].partition( ',' )
+   if not path:
+      raise BackendError( "The fake backend needs the path of its store" )
+   options = {}
+   for option in optionStr.split( ',' ) if optionStr else []:
+      key, _, value = option.partition( '=' )
+      if key not in OPTIONS:
+         raise BackendError( "Unknown fake backend option %r. Options are: %s" %
+                             ( key, ', '.join( sorted( OPTIONS ) ) ) )
+      try:
+         options[ key ] = OPTIONS[ key ]( value )
+      except ValueError:
+         raise BackendError( "Bad value for %s: %r" % ( key, value ) )
+   return path, options
+
+def error_response( status, message, reason ):
+   return status, { 'error': { 'code': status, 'message': message,
+                               'errors': [ { 'reason': reason,
+                                             'message': message } ] } }
+
+class FakeGmail( object ):
+   '''The profile, labels and filters endpoints of the Gmail API for one
+   account, served from memory, and saved to a JSON store at path, if given.
+
+   Each request should be delayed by delay(): latency seconds plus up to
+   jitter more. rateLimitRate of requests fail with 429, with a Retry-After
+   of retryAfter seconds if given, and errorRate of them with 500 or 503.
+   If crashAfter is given, the process exits with CRASH_STATUS as soon as
+   that many creates and deletes were made, before responding to the last,
+   like it was killed. Requests may come from any thread.
+   '''
+   def __init__( self, emailAddr=DEFAULT_EMAIL, filters=None, labels=None,
+                 path=None, latency=0.0, jitter=0.0, rateLimitRate=0.0,
+                 errorRate=0.0, retryAfter=None, seed=None, crashAfter=None ):
+      self.emailAddr = emailAddr
+      self.filters = { f[ 'id' ]: f for f in copy.deepcopy( filters or [] ) }
+      self.labels = copy.deepcopy( labels or [] )
+      self.path = path
+      self.latency = latency
+      self.jitter = jitter
+      self.rateLimitRate = rateLimitRate
+      self.errorRate = errorRate
+      self.retryAfter = retryAfter
+      self.crashAfter = crashAfter
+      self.requests = 0
+      self.writes = 0
+      self.injectedErrors = 0
+      self._rng = random.Random( seed )
+      self._ids = itertools.count( 1 )
+      # Reentrant, for saves made while responding
+      self._lock = threading.RLock()
+      self._dirty = False
+      self._lastSave = 0.0
+
+   @classmethod
+   def load( cls, path, **options ):
+      '''Returns the FakeGmail of the store at path, which is created empty if
+      it does not exist. The store holds emailAddr, and filters and labels as
+      Gmail returns them.
+      '''
+      obj = {}
+      if os.path.exists( path ):
+         try:
+            with open( path ) as f:
+               obj = json.load( f )
+         except ValueError as e:
+            raise BackendError( "%s: %s" % ( path, e ) )
+         if isinstance( obj, list ):
+            obj = { 'filters': obj }
+      gmail = cls( emailAddr=obj.get( 'emailAddr', DEFAULT_EMAIL ),
+                   filters=obj.get( 'filters' ), labels=obj.get( 'labels' ),
+                   path=path, **options )
+      ids = [ int( id_[ len( 'fake' ): ] ) for id_ in gmail.filters
+              if id_.startswith( 'fake' ) and id_[ len( 'fake' ): ].isdigit() ]
+      gmail._ids = itertools.count( max( ids + [ 0 ] ) + 1 )
+      atexit.register( gmail.save )
+      return gmail
+
+   @classmethod
+   def from_spec( cls, spec ):
+      path, options = parse_spec( spec )
+      return cls.load( path, **options )
+
+   def to_json( self ):
+      return { 'version': STORE_VERSION, 'emailAddr': self.emailAddr,
+               'filters': list( self.filters.values() ), 'labels': self.labels }
+
+   def save( self ):
+      with self._lock:
+         if self.path is None or not self._dirty:
+            return
+         atomic_write( self.path, json.dumps( self.to_json() ) )
+         self._dirty = False
+         self._lastSave = time.time()
+
+   def _changed( self ):
+      self._dirty = True
+      self.writes += 1
+      if self.crashAfter is not None and self.writes >= self.crashAfter:
+         self.save()
+         # Nothing else is cleaned up, not even buffered output
+         os._exit( CRASH_STATUS ) # pylint: disable=protected-access
+      if time.time() - self._lastSave >= SAVE_INTERVAL:
+         self.save()
+
+   def delay( self ):
+      with self._lock:
+         return self.latency + self._rng.uniform( 0, self.jitter ) if self.jitter \
+                else self.latency
+
+   def _injected_error( self ):
+      r = self._rng.random()
+      if r < self.rateLimitRate:
+         return error_response( 429, 'Rate Limit Exceeded', 'rateLimitExceeded' )
+      if r < self.rateLimitRate + self.errorRate:
+         if self._rng.random() < 0.5:
+            return error_response( 500, 'Backend Error', 'backendError' )
+         return error_response( 503, 'The service is currently unavailable.',
+                                'backendError' )
+      return None
+
+   def respond( self, method, path, body=None ):
+      '''Returns the status, decoded JSON body and headers of the response to
+      a request for path under users/<userId>/.
+      '''
+      with self._lock:
+         self.requests += 1
+         error = self._injected_error()
+         if error is not None:
+            self.injectedErrors += 1
+            headers = {}
+            if error[ 0 ] == 429 and self.retryAfter is not None:
+               headers[ 'retry-after' ] = '%g' % self.retryAfter
+            return error[ 0 ], error[ 1 ], headers
+         status, result = self._handle( method, path.strip( '/' ).split( '/' ), body )
+         return status, result, {}
+
+   def _handle( self, method, parts, body ):
+      if method == 'GET' and parts == [ 'profile' ]:
+         return 200, { 'emailAddress': self.emailAddr }
+      if method == 'GET' and parts == [ 'labels' ]:
+         return 200, { 'labels': copy.deepcopy( self.labels ) }
+      if parts[ :2 ] != [ 'settings', 'filters' ]:
+         return error_response( 404, 'Not Found', 'notFound' )
+
+      if len( parts ) == 2:
+         if method == 'GET':
+            return 200, { 'filter': copy.deepcopy( list( self.filters.values() ) ) }
+         if method == 'POST':
+            if not body or not body.get( 'criteria' ):
+               return error_response( 400, 'Filter criteria is required',
+                                      'invalidArgument' )
+            filterObj = copy.deepcopy( body )
+            filterObj[ 'id' ] = 'fake%d' % next( self._ids )
+            self.filters[ filterObj[ 'id' ] ] = filterObj
+            self._changed()
+            return 200, copy.deepcopy( filterObj )
+      elif len( parts ) == 3 and unquote( parts[ 2 ] ) in self.filters:
+         filterId = unquote( parts[ 2 ] )
+         if method == 'GET':
+            return 200, copy.deepcopy( self.filters[ filterId ] )
+         if method == 'DELETE':
+            del self.filters[ filterId ]
+            self._changed()
+            return 204, {}
+      return error_response( 404, 'Not Found', 'notFound' )
+
+def api_path( path ):
+   '''Returns the part of an API request path under users/<userId>/.'''
+   return path.split( '/users/', 1 )[ -1 ].partition( '/' )[ 2 ]
+
+def response( status, headers, content ):
+   info = dict( headers, status=str( status ) )
+   if content:
+      info.setdefault( 'content-type', 'application/json; charset=UTF-8' )
+   return httplib2.Response( info ), content
+
+class FakeHttp( object ):
+   '''An httplib2.Http whose requests are served by a FakeGmail, for an
+   Api.Service built from the bundled discovery document. Batches are
+   delayed once, and each of their requests may fail on its own.
+   '''
+   def __init__( self, gmail ):
+      self.gmail = gmail
+
+   def request( self, uri, method='GET', body=None, headers=None,
+                redirections=None, connection_type=None ): # pylint: disable=unused-argument
+      time.sleep( self.gmail.delay() )
+      path = urlparse( uri ).path
+      if path == '/batch' or path.startswith( '/batch/' ):
+         return self._batch( body, headers or {} )
+      status, result, respHeaders = self.gmail.respond(
+            method, api_path( path ), json.loads( body ) if body else None )
+      content = json.dumps( result ).encode( 'utf-8' ) if status != 204 else b''
+      return response( status, respHeaders, content )
+
+   def _batch( self, body, headers ):
+      parser = FeedParser()
+      parser.feed( 'content-type: %s\r\n\r\n%s' % ( headers[ 'content-type' ], body ) )
+      boundary = 'batch_fake_boundary'
+      lines = []
+      for part in parser.close().get_payload():
+         requestLines, _, partBody = part.get_payload().replace( '\r\n', '\n' ) \
+                                         .partition( '\n\n' )
+         method, target, _ = requestLines.split( '\n', 1 )[ 0 ].split( ' ', 2 )
+         status, result, respHeaders = self.gmail.respond(
+               method, api_path( urlparse( target ).path ),
+               json.loads( partBody ) if partBody.strip() else None )
+         content = json.dumps( result ) if status != 204 else ''
+         lines += [ '--' + boundary,
+                    'Content-Type: application/http',
+                    'Content-ID: <response-%s>' % part[ 'Content-ID' ].strip( '<>' ),
+                    '',
+                    'HTTP/1.1 %d %s' % ( status, 'OK' if status < 300 else 'Error' ) ]
+         lines += [ '%s: %s' % item for item in respHeaders.items() ]
+         lines += [ 'Content-Type: application/json; charset=UTF-8',
+                    'Content-Length: %d' % len( content ),
+                    '',
+                    content ]
+      lines.append( '--' + boundary + '--' )
+      return response( 200, { 'content-type': 'multipart/mixed; boundary=' + boundary },
+                       '\r\n'.join( lines ).encode( 'utf-8' ) )
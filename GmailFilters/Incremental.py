@@ -0,0 +1,176 @@
+from __future__ import print_function
+import hashlib
+import json
+
+from GmailFilters import parse_filter_element
+from GmailFilters.Config import atomic_write
+from GmailFilters.Template import find_all_meta_group_keys, \
+                                  find_primary_template_group, \
+                                  get_template_group_key, \
+                                  normalized_primary_elem
+
+STATE_VERSION = 1
+
+def text_hash( string ):
+   return hashlib.sha1( string.encode( 'utf-8' ) ).hexdigest()
+
+class QueryInfo( object ):
+   '''What update needs to know about a query, without parsing it again.'''
+   __slots__ = ( 'refs', 'primaryKey', 'primaryHash' )
+
+   def __init__( self, refs, primaryKey=None, primaryHash=None ):
+      self.refs = refs
+      self.primaryKey = primaryKey
+      self.primaryHash = primaryHash
+
+   @classmethod
+   def from_elem( cls, filterElem ):
+      primaryKey = None
+      primaryHash = None
+      primaryGroup = find_primary_template_group( filterElem )
+      if primaryGroup is not None:
+         primaryKey = get_template_group_key( primaryGroup, primaryOnly=True )
+         primaryHash = text_hash(
+               normalized_primary_elem( primaryGroup ).full_filter_str() )
+      refs = find_all_meta_group_keys( filterElem )
+      refs.discard( primaryKey )
+      return cls( refs, primaryKey, primaryHash )
+
+   def to_json( self ):
+      return [ sorted( list( k ) for k in self.refs ),
+               list( self.primaryKey ) if self.primaryKey else None,
+               self.primaryHash ]
+
+   @classmethod
+   def from_json( cls, obj ):
+      refs, primaryKey, primaryHash = obj
+      return cls( set( tuple( k ) for k in refs ),
+                  tuple( primaryKey ) if primaryKey else None, primaryHash )
+
+class TemplateState( object ):
+   '''The template dependencies of an account's filters, as of the last update.
+
+   queries caches a QueryInfo by query hash. upToDate holds the hashes of the
+   queries as they were after the last complete update, and primaries the
+   hash of each primary's normalized text at that time. A filter whose query
+   is in upToDate, and which references no primary that changed since, does
+   not need to be expanded again.
+   '''
+   def __init__( self, path=None ):
+      self.path = path
+      self.queries = {}
+      self.primaries = {}
+      self.upToDate = set()
+
+   @classmethod
+   def load( cls, path ):
+      state = cls( path )
+      try:
+         with open( path ) as f:
+            obj = json.load( f )
+      except ( IOError, ValueError ):
+         return state
+
+      if obj.get( 'version' ) != STATE_VERSION:
+         return state
+      state.queries = { h: QueryInfo.from_json( info )
+                        for h, info in obj[ 'queries' ].items() }
+      state.primaries = { tuple( k ): h for k, h in obj[ 'primaries' ] }
+      state.upToDate = set( obj[ 'upToDate' ] )
+      return state
+
+   def save( self ):
+      obj = {
+         'version': STATE_VERSION,
+         'queries': { h: info.to_json() for h, info in self.queries.items() },
+         'primaries': sorted( [ list( k ), h ] for k, h in self.primaries.items() ),
+         'upToDate': sorted( self.upToDate ),
+      }
+      atomic_write( self.path, json.dumps( obj ) )
+
+   def query_info( self, query, filterElem=None ):
+      h = text_hash( query )
+      info = self.queries.get( h )
+      if info is None:
+         if filterElem is None:
+            filterElem = parse_filter_element( query )
+         info = QueryInfo.from_elem( filterElem )
+         self.queries[ h ] = info
+      return info
+
+   def mark_up_to_date( self, queries ):
+      '''Records queries as the complete, updated set of filter queries.'''
+      hashes = set( text_hash( q ) for q in queries )
+      self.primaries = {}
+      for query in queries:
+         info = self.query_info( query )
+         if info.primaryKey is not None:
+            self.primaries[ info.primaryKey ] = info.primaryHash
+      self.upToDate = hashes
+      # Forget queries that no longer exist
+      self.queries = { h: info for h, info in self.queries.items() if h in hashes }
+
+def filter_elems_to_update( queryById, state=None ):
+   '''Returns { filter id: parsed query } for the filters that need their
+   templates expanded, along with the primaries those depend on.
+
+   Without a state, every filter is returned.
+   '''
+   if state is None:
+      return { id_: parse_filter_element( q ) for id_, q in queryById.items() }
+
+   filterElemById = {}
+   infoById = {}
+   dirtyIds = set()
+   for id_, query in queryById.items():
+      if text_hash( query ) not in state.upToDate:
+         dirtyIds.add( id_ )
+         filterElemById[ id_ ] = parse_filter_element( query )
+      infoById[ id_ ] = state.query_info( query, filterElemById.get( id_ ) )
+
+   primaryIdsByKey = {}
+   dependentIdsByKey = {}
+   for id_, info in infoById.items():
+      if info.primaryKey is not None:
+         primaryIdsByKey.setdefault( info.primaryKey, [] ).append( id_ )
+      for key in info.refs:
+         dependentIdsByKey.setdefault( key, set() ).add( id_ )
+
+   # Primaries which changed, or were added or removed, since the last update
+   dirtyKeys = [ key for key, ids in primaryIdsByKey.items()
+                 if any( infoById[ id_ ].primaryHash != state.primaries.get( key )
+                         for id_ in ids ) ]
+   dirtyKeys += [ key for key in state.primaries if key not in primaryIdsByKey ]
+
+   # Everything referencing a dirty primary is expanded. If that is itself a
+   # primary, what references it is expanded too.
+   expandIds = set( dirtyIds )
+   seenKeys = set( dirtyKeys )
+   while dirtyKeys:
+      key = dirtyKeys.pop()
+      for id_ in dependentIdsByKey.get( key, () ):
+         expandIds.add( id_ )
+         primaryKey = infoById[ id_ ].primaryKey
+         if primaryKey is not None and primaryKey not in seenKeys:
+            seenKeys.add( primaryKey )
+            dirtyKeys.append( primaryKey )
+
+   # The primaries referenced by expanded filters ( and by those primaries )
+   # are needed to expand them. Every filter defining a key defined more than
+   # once is needed too, so that the collision is reported as in a full update.
+   neededIds = set( expandIds )
+   for ids in primaryIdsByKey.values():
+      if len( ids ) > 1:
+         neededIds.update( ids )
+   pending = list( neededIds )
+   while pending:
+      for key in infoById[ pending.pop() ].refs:
+         for id_ in primaryIdsByKey.get( key, () ):
+            if id_ not in neededIds:
+               neededIds.add( id_ )
+               pending.append( id_ )
+
+   for id_ in neededIds:
+      if id_ not in filterElemById:
+         filterElemById[ id_ ] = parse_filter_element( queryById[ id_ ] )
+   return { id_: filterElemById[ id_ ] for id_ in queryById if id_ in neededIds }
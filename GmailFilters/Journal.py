@@ -0,0 +1,210 @@
+from __future__ import print_function
+import json
+import os
+import threading
+import time
+
+from GmailFilters.Config import account_file, atomic_write
+from GmailFilters.Plan import filter_key
+
+JOURNAL_VERSION = 1
+
+class JournalError( Exception ):
+   pass
+
+class Recovery( object ):
+   '''What is left of an interrupted run, as found by Journal.reconcile.
+
+   adopted maps the old ids of filters whose new version was created, but not
+   recorded, to the id of that version, and addedAdopted does the same for
+   the indexes of new filters. duplicates holds the ids of extra copies of
+   new versions and new filters, created by requests sent more than once.
+   creates holds the ( index, filter ) of the new filters still to be
+   created. deletes holds the old ids whose new version exists, but which
+   were not deleted yet, and replaces the new versions still to be created.
+   done holds the old ids which were deleted, but not recorded, and missing
+   those which are gone without their new version having been created.
+   '''
+   def __init__( self ):
+      self.adopted = {}
+      self.addedAdopted = {}
+      self.duplicates = []
+      self.creates = []
+      self.deletes = []
+      self.replaces = []
+      self.done = []
+      self.missing = []
+
+   def empty( self ):
+      return not ( self.duplicates or self.creates or self.deletes or self.replaces )
+
+class Journal( object ):
+   '''A write-ahead log of the filter replacements of an update, replace or
+   dedup, and of the new filters a dedup creates before them.
+
+   The first line, written before any request is sent, holds the new version
+   of each filter, with the id of its old version, the new filters, and the
+   ids of every filter of the account at the time. Each create and delete
+   confirmed by Gmail then appends a line. A run that is interrupted leaves
+   its journal behind, so that it can be resumed without being planned
+   again, and any filters it created, but did not record, can be found.
+   '''
+   def __init__( self, path, command, filters, existingIds, startedAt=None,
+                 info=None, creates=None ):
+      self.path = path
+      self.command = command
+      self.filters = filters
+      self.creates = creates or []
+      self.existingIds = set( existingIds )
+      self.startedAt = startedAt if startedAt is not None else time.time()
+      self.info = info or {}
+      self.createdIds = {}
+      self.addedIds = {}
+      self.deletedIds = set()
+      self._file = None
+      self._lock = threading.Lock()
+
+   @staticmethod
+   def path_for( emailAddr ):
+      return account_file( emailAddr, 'journal.jsonl' )
+
+   @classmethod
+   def begin( cls, path, command, filters, existingIds, creates=None, **info ):
+      journal = cls( path, command, filters, existingIds, info=info,
+                     creates=creates )
+      atomic_write( path, json.dumps( {
+         'version': JOURNAL_VERSION,
+         'command': command,
+         'startedAt': journal.startedAt,
+         'filters': filters,
+         'creates': journal.creates,
+         'existingIds': sorted( journal.existingIds ),
+         'info': info,
+      } ) + '\n' )
+      return journal
+
+   @classmethod
+   def load( cls, path ):
+      '''Returns the journal at path, or None if there is none.'''
+      try:
+         with open( path ) as f:
+            lines = f.read().splitlines()
+      except IOError:
+         return None
+      try:
+         header = json.loads( lines[ 0 ] )
+      except ( IndexError, ValueError ):
+         raise JournalError( "%s: not a journal" % path )
+      if header.get( 'version' ) != JOURNAL_VERSION:
+         raise JournalError( "%s: unsupported journal version %r" %
+                             ( path, header.get( 'version' ) ) )
+      journal = cls( path, header[ 'command' ], header[ 'filters' ],
+                     header[ 'existingIds' ], header[ 'startedAt' ],
+                     header.get( 'info' ), header.get( 'creates' ) )
+      for line in lines[ 1: ]:
+         try:
+            record = json.loads( line )
+         except ValueError:
+            # The last line may have been cut short by a crash
+            continue
+         if 'created' in record:
+            journal.createdIds[ record[ 'created' ] ] = record[ 'id' ]
+         elif 'added' in record:
+            journal.addedIds[ record[ 'added' ] ] = record[ 'id' ]
+         elif 'deleted' in record:
+            journal.deletedIds.add( record[ 'deleted' ] )
+      return journal
+
+   def _append( self, record ):
+      with self._lock:
+         if self._file is None:
+            self._file = open( self.path, 'a' )
+         self._file.write( json.dumps( record ) + '\n' )
+         self._file.flush()
+         os.fsync( self._file.fileno() )
+
+   def created( self, oldId, newId ):
+      self.createdIds[ oldId ] = newId
+      self._append( { 'created': oldId, 'id': newId } )
+
+   def added( self, index, newId ):
+      '''Records that the new filter at index of creates was created.'''
+      self.addedIds[ index ] = newId
+      self._append( { 'added': index, 'id': newId } )
+
+   def deleted( self, oldId ):
+      self.deletedIds.add( oldId )
+      self._append( { 'deleted': oldId } )
+
+   def pending( self ):
+      '''Returns the new versions of the filters whose old version was not
+      deleted yet.
+      '''
+      return [ f for f in self.filters if f[ 'id' ] not in self.deletedIds ]
+
+   def pending_creates( self ):
+      '''Returns the ( index, filter ) of the new filters not created yet.'''
+      return [ ( i, f ) for i, f in enumerate( self.creates ) if i not in self.addedIds ]
+
+   def close( self ):
+      with self._lock:
+         if self._file is not None:
+            self._file.close()
+            self._file = None
+
+   def finish( self ):
+      '''Removes the journal, once every replacement is done.'''
+      self.close()
+      try:
+         os.remove( self.path )
+      except OSError:
+         pass
+
+   def reconcile( self, filters ):
+      '''Returns the Recovery of the pending replacements, given the current
+      filters of the account.
+
+      A filter that is new since the journal was begun, and the same as a new
+      version whose create was not recorded, is taken to be that version. Any
+      more such copies are duplicates.
+      '''
+      recovery = Recovery()
+      currentIds = set( f[ 'id' ] for f in filters )
+      claimed = set( self.createdIds.values() ) | set( self.addedIds.values() )
+      candidates = {}
+      for filterObj in filters:
+         if filterObj[ 'id' ] not in self.existingIds and \
+            filterObj[ 'id' ] not in claimed:
+            candidates.setdefault( filter_key( filterObj ), [] ).append( filterObj[ 'id' ] )
+
+      self._reconcile_creates( candidates, recovery )
+      for filterObj in self.pending():
+         oldId = filterObj[ 'id' ]
+         key = filter_key( filterObj )
+         newId = self.createdIds.get( oldId )
+         if newId is None and candidates.get( key ):
+            newId = candidates[ key ].pop( 0 )
+            recovery.adopted[ oldId ] = newId
+         if newId is None:
+            if oldId in currentIds:
+               recovery.replaces.append( filterObj )
+            else:
+               recovery.missing.append( oldId )
+         elif oldId in currentIds:
+            recovery.deletes.append( oldId )
+         else:
+            recovery.done.append( oldId )
+      for key in set( filter_key( f ) for f in self.filters + self.creates ):
+         recovery.duplicates.extend( candidates.get( key, [] ) )
+      return recovery
+
+   def _reconcile_creates( self, candidates, recovery ):
+      '''Adopts the first of candidates, by filter key, that is the same as each
+      pending new filter, or adds it to the creates of recovery.
+      '''
+      for index, filterObj in self.pending_creates():
+         key = filter_key( filterObj )
+         if candidates.get( key ):
+            recovery.addedAdopted[ index ] = candidates[ key ].pop( 0 )
+         else:
+            recovery.creates.append( ( index, filterObj ) )
@@ -0,0 +1,121 @@
+from __future__ import print_function
+import json
+import os
+import time
+
+from GmailFilters.Config import account_file, atomic_write
+
+LABELS_VERSION = 1
+# Labels are rarely added or renamed, and an unknown id refetches them anyway
+DEFAULT_LABEL_TTL = 3600
+
+class LabelCache( object ):
+   '''The labels of an account, indexed by id and by name.
+
+   fetch returns the account's labels from Gmail. It is called when the
+   labels are older than ttl, and at most once more when an id or name is
+   looked up that they don't have. When path is given, the labels are kept
+   there between runs.
+   '''
+   def __init__( self, fetch=None, path=None, ttl=DEFAULT_LABEL_TTL ):
+      self.fetch = fetch
+      self.path = path
+      self.ttl = ttl
+      self.labels = None
+      self.fetchedAt = None
+      self.byId = {}
+      self.byName = {}
+      self.fetches = 0
+      self._refetched = False
+
+   @classmethod
+   def for_account( cls, fetch, emailAddr, ttl=DEFAULT_LABEL_TTL ):
+      path = account_file( emailAddr, 'labels.json' ) if emailAddr else None
+      return cls( fetch, path, ttl )
+
+   @classmethod
+   def from_labels( cls, labels, fetchedAt=None ):
+      '''Returns a cache of labels fetched at fetchedAt, which never refetches.'''
+      cache = cls( ttl=None )
+      cache.set_labels( labels, fetchedAt )
+      return cache
+
+   def set_labels( self, labels, fetchedAt=None ):
+      self.labels = labels
+      self.fetchedAt = fetchedAt if fetchedAt is not None else time.time()
+      self.byId = { l[ 'id' ]: l for l in labels }
+      self.byName = { l[ 'name' ]: l for l in labels }
+
+   def _load( self ):
+      try:
+         with open( self.path ) as f:
+            obj = json.load( f )
+      except ( IOError, ValueError ):
+         return False
+      if obj.get( 'version' ) != LABELS_VERSION:
+         return False
+      self.set_labels( obj[ 'labels' ], obj[ 'fetchedAt' ] )
+      return True
+
+   def save( self ):
+      if self.path is None or self.labels is None:
+         return
+      atomic_write( self.path, json.dumps( {
+         'version': LABELS_VERSION,
+         'fetchedAt': self.fetchedAt,
+         'labels': self.labels,
+      } ) )
+
+   def expired( self ):
+      return self.labels is None or \
+             ( self.ttl is not None and time.time() - self.fetchedAt >= self.ttl )
+
+   def refresh( self ):
+      self.set_labels( self.fetch() )
+      self.fetches += 1
+      self.save()
+
+   def invalidate( self ):
+      '''Forgets the labels, here and on disk, so that the next lookup fetches
+      them.
+      '''
+      self.labels = None
+      if self.path is not None:
+         try:
+            os.remove( self.path )
+         except OSError:
+            pass
+
+   def _ensure( self ):
+      if self.labels is None and self.path is not None:
+         self._load()
+      if self.expired() and self.fetch is not None:
+         self.refresh()
+
+   def _lookup( self, index, key ):
+      self._ensure()
+      label = getattr( self, index ).get( key )
+      if label is None and self.fetch is not None and not self._refetched:
+         # The label may be newer than the cache
+         self._refetched = True
+         self.refresh()
+         label = getattr( self, index ).get( key )
+      return label
+
+   def get_labels( self ):
+      self._ensure()
+      return self.labels or []
+
+   def name( self, labelId ):
+      '''Returns the name of the label labelId, or labelId if it is unknown.'''
+      label = self._lookup( 'byId', labelId )
+      return label[ 'name' ] if label is not None else labelId
+
+   def id_for_name( self, name ):
+      '''Returns the id of the label called name, or None.'''
+      label = self._lookup( 'byName', name )
+      return label[ 'id' ] if label is not None else None
+
+   def names( self, labelIds ):
+      '''Returns a new list of the names of labelIds.'''
+      return [ self.name( labelId ) for labelId in labelIds ]
@@ -0,0 +1,141 @@
+from __future__ import print_function
+import json
+
+from GmailFilters import parse_filter_element, ParseError
+
+FORMATS = ( 'text', 'json', 'jsonl', 'table' )
+ACTIONS = ( 'addLabelIds', 'removeLabelIds', 'forward' )
+LABEL_ACTIONS = ( 'addLabelIds', 'removeLabelIds' )
+# Filters written per write to the output
+CHUNK_SIZE = 256
+
+def query_terms( query ):
+   '''Returns the set of the lowercased text and quoted leaves of query.'''
+   terms = set()
+   pending = [ parse_filter_element( query ) ]
+   while pending:
+      elem = pending.pop()
+      if elem.subElems is not None:
+         pending.extend( elem.subElems )
+      elif elem.filterStr:
+         terms.add( elem.filterStr.lower() )
+   return terms
+
+class FilterSearch( object ):
+   '''Which filters list shows.
+
+   pattern is a compiled regexp, searched for in the criteria named by fields,
+   or in the whole filter when fields is empty. labelId limits the filters to
+   those adding or removing that label, action to those with that action,
+   and term to those whose query has it as a word, quoted phrase or operator
+   term, like from:x, rather than only somewhere in its text.
+   '''
+   def __init__( self, pattern=None, fields=None, labelId=None, action=None,
+                 term=None ):
+      self.pattern = pattern
+      self.fields = fields or []
+      self.labelId = labelId
+      self.action = action
+      self.term = term.lower() if term is not None else None
+
+   def matches( self, filterObj ):
+      criteria = filterObj.get( 'criteria', {} )
+      actions = filterObj.get( 'action', {} )
+      if self.action is not None and not actions.get( self.action ):
+         return False
+      if self.labelId is not None and \
+         not any( self.labelId in actions.get( k, () ) for k in LABEL_ACTIONS ):
+         return False
+      if self.term is not None:
+         try:
+            if self.term not in query_terms( criteria.get( 'query', '' ) ):
+               return False
+         except ParseError:
+            return False
+      if self.pattern is not None:
+         if self.fields:
+            return any( self.pattern.search( str( criteria[ f ] ) )
+                        for f in self.fields if f in criteria )
+         return self.pattern.search( repr( filterObj ) ) is not None
+      return True
+
+def criteria_str( filterObj ):
+   criteria = filterObj.get( 'criteria', {} )
+   parts = []
+   for k in sorted( criteria ):
+      if k == 'query':
+         continue
+      parts.append( '%s:%s' % ( k, criteria[ k ] ) )
+   if criteria.get( 'query' ):
+      parts.append( criteria[ 'query' ] )
+   return ' '.join( parts )
+
+def actions_str( filterObj, labels ):
+   actions = filterObj.get( 'action', {} )
+   parts = []
+   for k in sorted( actions ):
+      v = actions[ k ]
+      if k == 'addLabelIds':
+         parts.extend( '+' + name for name in labels.names( v ) )
+      elif k == 'removeLabelIds':
+         parts.extend( '-' + name for name in labels.names( v ) )
+      else:
+         parts.append( '%s=%s' % ( k, v ) )
+   return ' '.join( parts )
+
+def format_chunk( filters, fmt, labels=None, first=False, idWidth=0 ):
+   '''Returns the output of filters in format fmt, which follows the output
+   of earlier filters unless first.
+   '''
+   if fmt == 'jsonl':
+      return ''.join( json.dumps( f, sort_keys=True ) + '\n' for f in filters )
+   if fmt == 'json':
+      sep = '\n' if first else ',\n'
+      return sep + ',\n'.join( json.dumps( f, sort_keys=True ) for f in filters )
+   assert fmt == 'table', fmt
+   return ''.join( '%-*s  %-24s  %s\n' % ( idWidth, f[ 'id' ],
+                                           actions_str( f, labels ),
+                                           criteria_str( f ) )
+                   for f in filters )
+
+def write_filters( out, filters, fmt, labels=None, chunkSize=CHUNK_SIZE ):
+   '''Writes filters to out in format fmt, json, jsonl or table, one chunk of
+   filters at a time, flushing each, so that output can be consumed while the
+   rest is formatted. labels is the LabelCache for the table's label names.
+   The table's id column is as wide as the longest id so far, so it only
+   widens, and stays aligned, if a later chunk has longer ids.
+   Returns the number of filters written.
+   '''
+   if fmt == 'json':
+      out.write( '[' )
+
+   count = 0
+   idWidth = 2
+   chunk = []
+   def flush():
+      nonlocal idWidth
+      first = count == len( chunk )
+      if fmt == 'table':
+         idWidth = max( [ len( f[ 'id' ] ) for f in chunk ] + [ idWidth ] )
+         if first:
+            out.write( '%-*s  %-24s  %s\n' % ( idWidth, 'ID', 'ACTIONS', 'CRITERIA' ) )
+      out.write( format_chunk( chunk, fmt, labels=labels, first=first,
+                               idWidth=idWidth ) )
+      out.flush()
+      del chunk[ : ]
+
+   for filterObj in filters:
+      chunk.append( filterObj )
+      count += 1
+      if len( chunk ) >= chunkSize:
+         flush()
+   if chunk:
+      flush()
+
+   if fmt == 'json':
+      out.write( '\n]\n' if count else ']\n' )
+      out.flush()
+   elif fmt == 'table' and not count:
+      out.write( '%-*s  %-24s  %s\n' % ( idWidth, 'ID', 'ACTIONS', 'CRITERIA' ) )
+      out.flush()
+   return count
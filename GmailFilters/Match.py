@@ -0,0 +1,324 @@
+from __future__ import print_function
+import email
+from email.header import decode_header, make_header
+import email.parser
+import email.policy
+import re
+
+from GmailFilters import parse_filter_element
+
+word_regexp = re.compile( r'\w+' )
+tag_regexp = re.compile( r'<[^>]*>' )
+size_regexp = re.compile( r'^(\d+)([kKmM]?)$' )
+
+# The headers searched by each operator. Terms without an operator search all
+# of these, the body, and the names of attachments.
+FIELD_HEADERS = {
+   'from': ( 'from', 'sender' ),
+   'to': ( 'to', 'cc', 'bcc', 'delivered-to' ),
+   'cc': ( 'cc', ),
+   'bcc': ( 'bcc', ),
+   'deliveredto': ( 'delivered-to', ),
+   'subject': ( 'subject', ),
+   'list': ( 'list-id', ),
+}
+ALL_HEADERS = tuple( sorted( set( h for hs in FIELD_HEADERS.values() for h in hs ) ) )
+ALL_FIELD = 'all'
+FILENAME_FIELD = 'filename'
+SIZE_OPERATORS = ( 'larger', 'smaller', 'size' )
+# Operators which can't be evaluated from a message alone
+UNSUPPORTED_OPERATORS = ( 'in', 'is', 'label', 'category', 'after', 'before',
+                          'older', 'newer', 'older_than', 'newer_than',
+                          'rfc822msgid', 'around' )
+OPERATORS = frozenset( list( FIELD_HEADERS ) + [ FILENAME_FIELD, 'has' ] +
+                       list( SIZE_OPERATORS ) + list( UNSUPPORTED_OPERATORS ) )
+
+class UnsupportedQuery( Exception ):
+   pass
+
+def normalized_words( text ):
+   return word_regexp.findall( text.lower() )
+
+def decoded_header( value ):
+   try:
+      return str( make_header( decode_header( value ) ) )
+   except ( ValueError, LookupError, UnicodeError ):
+      return str( value )
+
+def decoded_payload( part ):
+   payload = part.get_payload( decode=True ) or b''
+   try:
+      return payload.decode( part.get_content_charset() or 'utf-8', 'replace' )
+   except LookupError:
+      return payload.decode( 'utf-8', 'replace' )
+
+class Message( object ):
+   '''A message of a corpus, as searched by matchers.
+
+   Only the headers are parsed up front. The body is parsed when a term
+   without an operator first needs it. The words of each field are kept as a
+   set, for single words, and as a space separated string, for phrases.
+   '''
+   __slots__ = ( 'raw', 'key', 'headers', '_words', '_texts', '_body', '_filenames' )
+
+   def __init__( self, raw, key=None ):
+      self.raw = raw
+      self.key = key
+      end = raw.find( b'\n\n' )
+      crlfEnd = raw.find( b'\r\n\r\n' )
+      if crlfEnd != -1 and ( end == -1 or crlfEnd < end ):
+         end = crlfEnd
+      headerBytes = raw if end == -1 else raw[ :end ]
+      self.headers = email.parser.BytesHeaderParser(
+            policy=email.policy.compat32 ).parsebytes( headerBytes )
+      self._words = {}
+      self._texts = {}
+      self._body = None
+      self._filenames = None
+
+   @property
+   def size( self ):
+      return len( self.raw )
+
+   def header( self, name ):
+      return ' '.join( decoded_header( v ) for v in self.headers.get_all( name, [] ) )
+
+   def label( self ):
+      '''Returns a short description of the message, for reports.'''
+      return '%s: %s' % ( self.key or self.header( 'message-id' ),
+                          self.header( 'subject' ) )
+
+   def _parse_body( self ):
+      msg = email.message_from_bytes( self.raw, policy=email.policy.compat32 )
+      texts = []
+      self._filenames = []
+      for part in msg.walk():
+         if part.is_multipart():
+            continue
+         filename = part.get_filename()
+         if filename:
+            self._filenames.append( decoded_header( filename ) )
+         elif part.get_content_type() == 'text/plain':
+            texts.append( decoded_payload( part ) )
+         elif part.get_content_type() == 'text/html':
+            texts.append( tag_regexp.sub( ' ', decoded_payload( part ) ) )
+      self._body = ' '.join( texts )
+
+   def body( self ):
+      if self._body is None:
+         self._parse_body()
+      return self._body
+
+   def filenames( self ):
+      if self._filenames is None:
+         self._parse_body()
+      return self._filenames
+
+   def has_attachment( self ):
+      return bool( self.filenames() )
+
+   def _field_words( self, field ):
+      if field == ALL_FIELD:
+         text = ' '.join( [ self.header( h ) for h in ALL_HEADERS ] +
+                          [ self.body() ] + self.filenames() )
+      elif field == FILENAME_FIELD:
+         text = ' '.join( self.filenames() )
+      else:
+         text = ' '.join( self.header( h ) for h in FIELD_HEADERS[ field ] )
+      return normalized_words( text )
+
+   def words( self, field ):
+      words = self._words.get( field )
+      if words is None:
+         words = frozenset( self.text( field ).split() )
+         self._words[ field ] = words
+      return words
+
+   def text( self, field ):
+      '''Returns the words of field, with a space before and after each.'''
+      text = self._texts.get( field )
+      if text is None:
+         text = ' %s ' % ' '.join( self._field_words( field ) )
+         self._texts[ field ] = text
+      return text
+
+def always( msg ): # pylint: disable=unused-argument
+   return True
+
+def with_required( matcher, required ):
+   '''Records on matcher the set of ( field, word ) of which a message must
+   have one for matcher to match it.
+   '''
+   matcher.required = frozenset( required )
+   return matcher
+
+def required_terms( matcher ):
+   '''Returns the set of ( field, word ) of which a message must have one for
+   matcher to match it, or None if no word is required.
+   '''
+   return getattr( matcher, 'required', None )
+
+def term_matcher( term, field ):
+   '''Returns a matcher of the words of term, in order, in field.'''
+   words = normalized_words( term )
+   if not words:
+      # Gmail ignores terms which are only punctuation
+      return always
+   if len( words ) == 1:
+      word = words[ 0 ]
+      return with_required( lambda msg: word in msg.words( field ),
+                            [ ( field, word ) ] )
+   phrase = ' %s ' % ' '.join( words )
+   # The longest word of a phrase is likely the rarest
+   return with_required( lambda msg: phrase in msg.text( field ),
+                         [ ( field, max( words, key=len ) ) ] )
+
+def size_matcher( operator, value ):
+   m = size_regexp.match( value )
+   if not m:
+      raise UnsupportedQuery( "Bad size: %s:%s" % ( operator, value ) )
+   size = int( m.group( 1 ) ) * { '': 1, 'k': 1024, 'm': 1024 * 1024 }[
+         m.group( 2 ).lower() ]
+   if operator == 'smaller':
+      return lambda msg: msg.size < size
+   return lambda msg: msg.size > size
+
+def operator_matcher( operator, value, elem=None ):
+   '''Returns the matcher of operator:value, or of operator:elem when the
+   operator applies to a group or quoted phrase.
+   '''
+   if operator in FIELD_HEADERS or operator == FILENAME_FIELD:
+      if elem is not None:
+         return elem_matcher( elem, operator )
+      return term_matcher( value, operator )
+   if elem is not None:
+      raise UnsupportedQuery( "%s: cannot apply to a group" % operator )
+   if operator == 'has' and value.lower() == 'attachment':
+      return lambda msg: msg.has_attachment()
+   if operator in SIZE_OPERATORS:
+      return size_matcher( operator, value )
+   raise UnsupportedQuery( "Unsupported operator: %s:%s" % ( operator, value ) )
+
+def all_of( matchers ):
+   if len( matchers ) == 1:
+      return matchers[ 0 ]
+   matchers = tuple( matchers )
+   matcher = lambda msg: all( m( msg ) for m in matchers )
+   # Any one member's requirement will do. Pick the narrowest.
+   requirements = [ r for r in map( required_terms, matchers ) if r is not None ]
+   if requirements:
+      return with_required( matcher, min( requirements, key=lambda r: (
+            len( r ), -max( len( word ) for _, word in r ) ) ) )
+   return matcher
+
+def any_of( matchers ):
+   if len( matchers ) == 1:
+      return matchers[ 0 ]
+   matchers = tuple( matchers )
+   matcher = lambda msg: any( m( msg ) for m in matchers )
+   requirements = [ required_terms( m ) for m in matchers ]
+   if None not in requirements:
+      return with_required( matcher, frozenset().union( *requirements ) )
+   return matcher
+
+def negated( matcher ):
+   return lambda msg: not matcher( msg )
+
+def split_operator( text ):
+   '''Returns ( operator, value ) of text like from:x, or ( None, text ).'''
+   operator, sep, value = text.partition( ':' )
+   if sep and operator.lower() in OPERATORS:
+      return operator.lower(), value
+   return None, text
+
+def sequence_matcher( elems, field, anyOf=False ):
+   '''Returns the matcher of a sequence of sibling elements. Terms are ANDed,
+   or ORed if anyOf, and OR between two terms binds them first.
+   '''
+   terms = []
+   joinNext = False
+   negateNext = False
+   operatorNext = None
+   for elem in elems:
+      if elem.subElems is None and elem.delims is None:
+         text = elem.filterStr
+         if not text:
+            continue
+         if text in ( 'OR', '|' ):
+            joinNext = bool( terms )
+            continue
+         if text == 'AND':
+            continue
+         negate = negateNext
+         if text.startswith( '-' ):
+            negate = not negate
+            text = text[ 1: ]
+         operator, value = split_operator( text )
+         if not text or ( operator is not None and not value ):
+            # A '-' or operator: which applies to the group that follows
+            if elem.postWs:
+               raise UnsupportedQuery( "Nothing follows %r" % elem.filterStr )
+            negateNext = negate
+            operatorNext = operator
+            continue
+         if operator is not None:
+            matcher = operator_matcher( operator, value )
+         else:
+            matcher = term_matcher( text, field )
+      else:
+         negate = negateNext
+         if operatorNext is not None:
+            matcher = operator_matcher( operatorNext, None, elem )
+         else:
+            matcher = elem_matcher( elem, field )
+      negateNext = False
+      operatorNext = None
+
+      if negate:
+         matcher = negated( matcher )
+      if joinNext:
+         terms[ -1 ].append( matcher )
+      else:
+         terms.append( [ matcher ] )
+      joinNext = False
+
+   if negateNext or operatorNext is not None:
+      raise UnsupportedQuery( "Query ends with an operator" )
+   if not terms:
+      return always
+   matchers = [ any_of( t ) for t in terms ]
+   return any_of( matchers ) if anyOf else all_of( matchers )
+
+def elem_matcher( elem, field=ALL_FIELD ):
+   '''Returns a function of a Message which is whether elem matches it, when
+   searching field.
+   '''
+   if elem.delims == '""':
+      return term_matcher( elem.filterStr, field )
+   if elem.subElems is None:
+      return sequence_matcher( [ elem ], field )
+   return sequence_matcher( elem.subElems, field, anyOf=elem.delims == '{}' )
+
+def query_matcher( query, field=ALL_FIELD ):
+   return elem_matcher( parse_filter_element( query ), field )
+
+def filter_matcher( filterObj ):
+   '''Returns a matcher of the messages Gmail would apply filterObj to.'''
+   criteria = filterObj.get( 'criteria', {} )
+   matchers = []
+   for field in ( 'from', 'to', 'subject' ):
+      if criteria.get( field ):
+         matchers.append( query_matcher( criteria[ field ], field ) )
+   if criteria.get( 'query' ):
+      matchers.append( query_matcher( criteria[ 'query' ] ) )
+   if criteria.get( 'negatedQuery' ):
+      matchers.append( negated( query_matcher( criteria[ 'negatedQuery' ] ) ) )
+   if criteria.get( 'hasAttachment' ):
+      matchers.append( lambda msg: msg.has_attachment() )
+   if criteria.get( 'size' ):
+      operator = 'smaller' if criteria.get( 'sizeComparison' ) == 'smaller' \
+                 else 'larger'
+      matchers.append( size_matcher( operator, str( criteria[ 'size' ] ) ) )
+   if not matchers:
+      raise UnsupportedQuery( "Filter has no criteria" )
+   return all_of( matchers )
@@ -0,0 +1,87 @@
+from __future__ import print_function
+
+from GmailFilters import PARENS, BRACES, QUOTES, parse_filter_element
+from GmailFilters.Template import meta_regexp
+
+# Members which make a group's meaning depend on their neighbours
+OPERATOR_MEMBERS = ( 'OR', 'AND', '|' )
+
+def is_ws( elem ):
+   return elem.subElems is None and elem.delims is None and not elem.filterStr
+
+def members( elem ):
+   '''Returns the sub elements of group elem, as lists of the elements with no
+   whitespace between them, like -(x) or subject:(x), which go together.
+   '''
+   result = []
+   ws = True
+   for se in elem.subElems:
+      ws = ws or bool( se.preWs )
+      if not is_ws( se ):
+         if ws:
+            result.append( [ se ] )
+         else:
+            result[ -1 ].append( se )
+         ws = False
+      ws = ws or bool( se.postWs )
+   return result
+
+def is_meta_group( elem ):
+   if elem.delims == QUOTES:
+      return any( meta_regexp.match( w ) for w in elem.filterStr.split() )
+   return elem.delims == PARENS and \
+          any( se.subElems is None and meta_regexp.match( se.filterStr )
+               for se in elem.subElems )
+
+def is_unwrappable( member ):
+   '''Returns whether member is a single group which can take the place of
+   the group holding only it. Meta groups are never unwrapped.
+   '''
+   return len( member ) == 1 and member[ 0 ].delims in ( PARENS, BRACES ) and \
+          not is_meta_group( member[ 0 ] )
+
+def minimized_str( elem ):
+   '''Returns the query of elem, without its outer whitespace, minimized.
+
+   Groups holding only another group, like ((x)), are unwrapped, as are the
+   parentheses around a whole query. Repeated members of OR groups are
+   dropped, and whitespace is collapsed to single spaces between members.
+   Meta groups are never unwrapped, so templates still
+   resolve. Queries which differ only in these ways minimize to the same
+   string.
+   '''
+   if elem.subElems is None:
+      if elem.delims == QUOTES:
+         return '"%s"' % ' '.join( elem.filterStr.split() )
+      return elem.filterStr
+
+   elemMembers = members( elem )
+   memberStrs = [ ''.join( minimized_str( se ) for se in m ) for m in elemMembers ]
+   if elem.delims == BRACES and \
+      not any( s in OPERATOR_MEMBERS for s in memberStrs ):
+      seen = set()
+      unique = []
+      for m, s in zip( elemMembers, memberStrs ):
+         if s not in seen:
+            seen.add( s )
+            unique.append( ( m, s ) )
+      elemMembers = [ m for m, _ in unique ]
+      memberStrs = [ s for _, s in unique ]
+
+   if len( elemMembers ) == 1 and is_unwrappable( elemMembers[ 0 ] ):
+      if elem.delims in ( PARENS, BRACES ):
+         return memberStrs[ 0 ]
+      if memberStrs[ 0 ].startswith( '(' ):
+         # A query wholly in parentheses is the same without them
+         return memberStrs[ 0 ][ 1:-1 ]
+
+   string = ' '.join( memberStrs )
+   if elem.delims is not None:
+      string = elem.delims[ 0 ] + string + elem.delims[ 1 ]
+   return string
+
+def same_query( queryA, queryB ):
+   '''Returns whether two queries are equal once minimized.'''
+   return queryA == queryB or \
+          minimized_str( parse_filter_element( queryA ) ) == \
+          minimized_str( parse_filter_element( queryB ) )
@@ -0,0 +1,93 @@
+from __future__ import print_function
+from array import array
+from collections import OrderedDict
+import hashlib
+import marshal
+import time
+
+from GmailFilters import PARSER_VERSION
+from GmailFilters.Config import atomic_write
+from GmailFilters.Table import FilterElementTable
+
+CACHE_VERSION = 1
+DEFAULT_MAX_ENTRIES = 20000
+
+class ParseCache( object ):
+   '''An on-disk cache of parsed queries, for parse_filter_element.
+
+   Entries map a hash of the parser version and query to the node array of its
+   FilterElementTable, and are kept in least recently used order. The file is
+   a marshalled list of ( key, bytes ) pairs, loaded on first use, and
+   replaced atomically by save(). The order in which entries were hit is only
+   saved once the cache is at least half full, so that runs of only hits don't
+   rewrite the file before any entry is close to being evicted.
+   '''
+   def __init__( self, path, maxEntries=DEFAULT_MAX_ENTRIES ):
+      self.path = path
+      self.maxEntries = maxEntries
+      self.entries = None
+      self.dirty = False
+      self.hits = 0
+      self.misses = 0
+      self.loadTime = 0.0
+
+   @staticmethod
+   def key( filterStr ):
+      return hashlib.sha1( ( '%d:%s' % ( PARSER_VERSION, filterStr ) )
+                           .encode( 'utf-8' ) ).digest()
+
+   def _load( self ):
+      start = time.perf_counter()
+      self.entries = OrderedDict()
+      try:
+         with open( self.path, 'rb' ) as f:
+            version, items = marshal.load( f )
+         if version == CACHE_VERSION:
+            self.entries.update( items )
+      except ( IOError, EOFError, ValueError, TypeError ):
+         # A missing or unreadable cache is just empty
+         pass
+      self.loadTime = time.perf_counter() - start
+
+   def get( self, filterStr ):
+      '''Returns a new FilterElement tree for filterStr, or None.'''
+      if self.entries is None:
+         self._load()
+      key = self.key( filterStr )
+      nodeBytes = self.entries.get( key )
+      if nodeBytes is None:
+         self.misses += 1
+         return None
+      self.hits += 1
+      if next( reversed( self.entries ) ) != key:
+         self.entries.move_to_end( key )
+         if len( self.entries ) * 2 >= self.maxEntries:
+            self.dirty = True
+      nodes = array( 'i' )
+      nodes.frombytes( nodeBytes )
+      return FilterElementTable( filterStr, nodes ).to_element()
+
+   def put( self, filterStr, filterElem ):
+      if self.entries is None:
+         self._load()
+      table = FilterElementTable.from_element( filterElem )
+      self.entries[ self.key( filterStr ) ] = table.nodes.tobytes()
+      self.dirty = True
+      while len( self.entries ) > self.maxEntries:
+         self.entries.popitem( last=False )
+
+   def save( self ):
+      if not self.dirty:
+         return
+      atomic_write( self.path,
+                    marshal.dumps( ( CACHE_VERSION, list( self.entries.items() ) ) ),
+                    mode='wb' )
+      self.dirty = False
+
+   def stats_str( self ):
+      lookups = self.hits + self.misses
+      return "Parse cache: %d hits, %d misses (%.0f%% hit rate), " \
+             "%d entries loaded in %.1f ms" % (
+                   self.hits, self.misses,
+                   100.0 * self.hits / lookups if lookups else 0.0,
+                   len( self.entries or () ), self.loadTime * 1000 )
@@ -0,0 +1,168 @@
+from __future__ import print_function
+import hashlib
+import json
+
+from GmailFilters import parse_filter_element, ParseError
+from GmailFilters.Config import atomic_write
+from GmailFilters.Minimize import minimized_str
+
+PLAN_VERSION = 1
+# Label actions of definitions, by label name, and the Gmail action of each
+LABEL_NAME_ACTIONS = { 'addLabels': 'addLabelIds', 'removeLabels': 'removeLabelIds' }
+
+class DefinitionError( Exception ):
+   pass
+
+def read_json( path ):
+   try:
+      with open( path ) as f:
+         return json.load( f )
+   except ValueError as e:
+      raise DefinitionError( "%s: %s" % ( path, e ) )
+
+def load_definitions( path, obj=None ):
+   '''Returns the filters defined in the JSON file at path, or in obj, when
+   it was already read from there.
+
+   The file holds a list of filters, or an object with the list as
+   "filters", like the output of list --format json. Ids are ignored. Labels
+   can be given by name, as the addLabels and removeLabels actions.
+   '''
+   if obj is None:
+      obj = read_json( path )
+   filters = obj.get( 'filters' ) if isinstance( obj, dict ) else obj
+   if not isinstance( filters, list ):
+      raise DefinitionError( "%s: expected a list of filters" % path )
+   definitions = []
+   for i, filterObj in enumerate( filters ):
+      if not isinstance( filterObj, dict ) or \
+         not isinstance( filterObj.get( 'criteria' ), dict ) or \
+         not isinstance( filterObj.get( 'action', {} ), dict ):
+         raise DefinitionError( "%s: filter %d needs criteria and action objects" %
+                                ( path, i ) )
+      definitions.append( { 'criteria': filterObj[ 'criteria' ],
+                            'action': filterObj.get( 'action', {} ) } )
+   return definitions
+
+def resolve_labels( definitions, labels ):
+   '''Returns definitions with the label names of their actions replaced by
+   the ids of those labels in the LabelCache labels.
+   '''
+   resolved = []
+   for filterObj in definitions:
+      action = {}
+      for k, v in filterObj[ 'action' ].items():
+         if k in LABEL_NAME_ACTIONS:
+            ids = []
+            for name in v:
+               labelId = labels.id_for_name( name )
+               if labelId is None:
+                  raise DefinitionError( "No label called %r" % name )
+               ids.append( labelId )
+            k = LABEL_NAME_ACTIONS[ k ]
+            v = action.get( k, [] ) + ids
+         action[ k ] = v
+      resolved.append( { 'criteria': filterObj[ 'criteria' ], 'action': action } )
+   return resolved
+
+def normalized_filter( filterObj ):
+   '''Returns the criteria and action of filterObj, without empty values, with
+   the query minimized and label ids sorted, so that filters which Gmail would
+   treat the same are equal.
+   '''
+   criteria = { k: v for k, v in filterObj.get( 'criteria', {} ).items() if v }
+   if 'query' in criteria:
+      try:
+         criteria[ 'query' ] = minimized_str( parse_filter_element( criteria[ 'query' ] ) )
+      except ParseError:
+         pass
+   action = {}
+   for k, v in filterObj.get( 'action', {} ).items():
+      if v:
+         action[ k ] = sorted( v ) if isinstance( v, list ) else v
+   return { 'criteria': criteria, 'action': action }
+
+def filter_key( filterObj ):
+   return json.dumps( normalized_filter( filterObj ), sort_keys=True )
+
+def fingerprint( filters ):
+   '''Returns a digest of the ids and contents of filters, in any order.'''
+   keys = sorted( json.dumps( [ f[ 'id' ], filter_key( f ) ] ) for f in filters )
+   return hashlib.sha1( '\n'.join( keys ).encode( 'utf-8' ) ).hexdigest()
+
+class Plan( object ):
+   '''The filters to create and delete to make an account's filters match a
+   set of definitions. Filters which match a definition are left alone.
+
+   basis is the fingerprint of the filters the plan was made from, so that a
+   saved plan is only applied to the filters it was made for.
+   '''
+   def __init__( self, emailAddr, creates, deletes, basis ):
+      self.emailAddr = emailAddr
+      self.creates = creates
+      self.deletes = deletes
+      self.basis = basis
+
+   @classmethod
+   def compute( cls, definitions, filters, emailAddr=None ):
+      '''Returns the plan from filters to definitions, whose labels must be
+      resolved.
+      '''
+      unmatched = {}
+      for filterObj in filters:
+         unmatched.setdefault( filter_key( filterObj ), [] ).append( filterObj )
+      creates = []
+      for filterObj in definitions:
+         matches = unmatched.get( filter_key( filterObj ) )
+         if matches:
+            matches.pop( 0 )
+         else:
+            creates.append( filterObj )
+      deleteIds = set( f[ 'id' ] for fs in unmatched.values() for f in fs )
+      deletes = [ f for f in filters if f[ 'id' ] in deleteIds ]
+      return cls( emailAddr, creates, deletes, fingerprint( filters ) )
+
+   def empty( self ):
+      return not self.creates and not self.deletes
+
+   def matches( self, filters ):
+      return fingerprint( filters ) == self.basis
+
+   def to_json( self ):
+      return { 'version': PLAN_VERSION, 'emailAddr': self.emailAddr,
+               'basis': self.basis, 'creates': self.creates,
+               'deletes': self.deletes }
+
+   def save( self, path ):
+      atomic_write( path, json.dumps( self.to_json(), indent=1, sort_keys=True ) )
+
+   @staticmethod
+   def is_plan( obj ):
+      return isinstance( obj, dict ) and 'basis' in obj and 'creates' in obj
+
+   @classmethod
+   def from_json( cls, obj ):
+      if obj.get( 'version' ) != PLAN_VERSION:
+         raise DefinitionError( "Unsupported plan version: %r" % obj.get( 'version' ) )
+      return cls( obj[ 'emailAddr' ], obj[ 'creates' ], obj[ 'deletes' ],
+                  obj[ 'basis' ] )
+
+   def apply( self, service ):
+      '''Creates, and then deletes, the filters of the plan. The deletes are
+      skipped if any create fails, so that no mail goes unfiltered. Returns
+      [ ( 'create' or 'delete', filter, error ) ] of the failures.
+      '''
+      failures = []
+      for filterObj in self.creates:
+         try:
+            service.create_filter( filterObj )
+         except Exception as e: # pylint: disable=broad-except
+            failures.append( ( 'create', filterObj, e ) )
+      if failures:
+         return failures
+      for filterObj in self.deletes:
+         try:
+            service.delete_filter( filterObj[ 'id' ] )
+         except Exception as e: # pylint: disable=broad-except
+            failures.append( ( 'delete', filterObj, e ) )
+      return failures
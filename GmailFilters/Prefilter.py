@@ -0,0 +1,42 @@
+from __future__ import print_function
+
+from GmailFilters.Match import required_terms
+
+class LiteralIndex( object ):
+   '''Finds the matchers which may match a message, by looking up the words of
+   the message once in an index of the words each matcher requires.
+
+   Matchers are compiled to match whole words, so the index maps each field
+   to { word: [ position of matcher ] }, and a message is scanned once per
+   field. Matchers which require no word are always candidates.
+   '''
+   def __init__( self, matchers ):
+      self.index = {}
+      self.unindexed = []
+      for position, matcher in enumerate( matchers ):
+         self.add( position, matcher )
+
+   def add( self, position, matcher ):
+      required = required_terms( matcher )
+      if required is None:
+         self.unindexed.append( position )
+         return
+      for field, word in required:
+         self.index.setdefault( field, {} ).setdefault( word, [] ).append( position )
+
+   def candidates( self, msg ):
+      '''Returns the set of the positions of the matchers which may match msg.'''
+      found = set( self.unindexed )
+      for field, positionsByWord in self.index.items():
+         msgWords = msg.words( field )
+         # Walk the smaller of the two
+         if len( msgWords ) < len( positionsByWord ):
+            for word in msgWords:
+               positions = positionsByWord.get( word )
+               if positions is not None:
+                  found.update( positions )
+         else:
+            for word, positions in positionsByWord.items():
+               if word in msgWords:
+                  found.update( positions )
+      return found
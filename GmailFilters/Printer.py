@@ -0,0 +1,128 @@
+from __future__ import print_function
+
+import colors
+
+from GmailFilters import ParseError
+from GmailFilters.Diff import TreeDiff, summarize, summary_lines
+
+class Printer( object ):
+   '''Prints filters, and the changes to them.
+
+   With diff 'tree', a changed query is shown once, with only the changed
+   subexpressions marked, rather than as a removed and an added line.
+   '''
+   def __init__( self, service, color, diff='lines' ):
+      self.service = service
+      self.color = color
+      self.diff = diff
+      self.queryElemById = {}
+
+   def maybe_color( self, msg, fg=None, style=None ):
+      if self.color:
+         return colors.color( msg, fg=fg, style=style )
+
+      return msg
+
+   def query_diff( self, filterId, query, newQuery ):
+      '''Returns the TreeDiff of query and newQuery, or None if either does not
+      parse. The parsed new query is used if the caller gave it.
+      '''
+      newElem = self.queryElemById.get( filterId )
+      try:
+         if newElem is not None and newElem.full_filter_str() == newQuery:
+            return TreeDiff( query, newElem )
+         return TreeDiff.from_queries( query, newQuery )
+      except ParseError:
+         return None
+
+   def query_diff_line( self, filterId, query, newQuery ):
+      diff = self.query_diff( filterId, query, newQuery )
+      if diff is None:
+         return None
+      rendered = diff.render( self.maybe_color if self.color else None )
+      if not diff.changed():
+         rendered += ' (whitespace changed)'
+      return '~  query: %s' % rendered
+
+   def print_changes( self, filterPairs, queryElemById=None ):
+      '''Prints the changes of ( filter, new filter ) pairs. In summary mode,
+      filters whose query changed the same way, and nothing else, are
+      described together. queryElemById may hold the parsed new queries, by
+      filter id, so that diffs don't parse them again.
+      '''
+      self.queryElemById = queryElemById or {}
+      if self.diff != 'summary':
+         for filter_, newFilter in filterPairs:
+            self.print_filter( filter_, newFilter=newFilter )
+            print( '' )
+         return
+
+      queryDiffById = {}
+      for filter_, newFilter in filterPairs:
+         criteria = dict( filter_[ 'criteria' ] )
+         newCriteria = dict( newFilter[ 'criteria' ] )
+         query = criteria.pop( 'query', None )
+         newQuery = newCriteria.pop( 'query', None )
+         diff = None
+         if criteria == newCriteria and query is not None and \
+            newQuery is not None and filter_.get( 'action' ) == newFilter.get( 'action' ):
+            diff = self.query_diff( filter_[ 'id' ], query, newQuery )
+         if diff is None:
+            self.print_filter( filter_, newFilter=newFilter )
+            print( '' )
+         else:
+            queryDiffById[ filter_[ 'id' ] ] = diff
+
+      color = self.maybe_color if self.color else None
+      for hunks, filterIds in summarize( queryDiffById ):
+         for line in summary_lines( hunks, filterIds, color=color ):
+            print( line )
+         print( '' )
+
+   def print_filter( self, filter_, newFilter=None ):
+      print( 'Filter %s:' % filter_[ 'id' ] )
+      # Get all criteria keys, so we don't miss any, between the filter and
+      # new filter if it is provided.
+      criteriaKeys = set( filter_[ 'criteria' ].keys() )
+      if newFilter is not None:
+         criteriaKeys.update( newFilter[ 'criteria' ].keys() )
+
+      # Print all criteria
+      for k in criteriaKeys:
+         v = filter_[ 'criteria' ].get( k )
+         newValLine = None
+         oldValStr = v if v is not None else repr( v )
+         oldValLine = "  %s: %s" % ( k, oldValStr )
+
+         if newFilter is not None:
+            newValue = newFilter[ 'criteria' ].get( k )
+            if newValue != v and k == 'query' and self.diff != 'lines' and \
+               v is not None and newValue is not None:
+               diffLine = self.query_diff_line( filter_[ 'id' ], v, newValue )
+               if diffLine is not None:
+                  print( diffLine )
+                  continue
+            if newValue != v:
+               oldValLine = self.maybe_color( '-' + oldValLine, fg='red' )
+               oldValStr = repr( oldValStr )
+               newValStr = newValue if newValue is not None else repr( newValue )
+               newValLine = self.maybe_color( '+  %s: %s' % ( k, newValStr ),
+                                              fg='green' )
+
+         print( oldValLine )
+         if newValLine is not None:
+            print( newValLine )
+
+      labels = self.service.label_cache()
+      # Print all actions to apply to the filter
+      for k, v in filter_[ 'action' ].items():
+         # Labels appear in a list, with the label id, which is not very useful
+         # to read. Show their readable name instead, without changing the
+         # filter.
+         if k in ( 'addLabelIds', 'removeLabelIds' ):
+            v = labels.names( v )
+
+         if isinstance( v, list ):
+            v = ', '.join( str( x ) for x in v )
+
+         print( "  -> %s: %s" % ( k, v ) )
@@ -0,0 +1,213 @@
+from __future__ import print_function
+import random
+import threading
+import time
+
+import GmailFilters.Timings as Timings
+
+# Gmail's quota units per request of each Service method, and the units it
+# allows each user per second, as a moving average allowing short bursts.
+QUOTA_COSTS = {
+   'get_email_addr': 1,
+   'get_labels': 1,
+   'get_filter': 1,
+   'get_filters': 1,
+   'create_filter': 5,
+   'delete_filter': 5,
+}
+QUOTA_RATE = 250
+DEFAULT_RETRIES = 5
+# Statuses of requests which may succeed if sent again later
+RETRY_STATUSES = ( 429, 500, 502, 503, 504 )
+# Reasons of the 403s Gmail throttles some requests with, rather than a 429
+RATE_LIMIT_REASONS = ( 'rateLimitExceeded', 'userRateLimitExceeded' )
+# Methods which may have been carried out when they fail with a 5xx, and so
+# are only sent again once the filters show that they were not
+UNSAFE_METHODS = ( 'create_filter', )
+
+def error_status( error ):
+   '''Returns the HTTP status of error, raised by googleapiclient or AsyncApi,
+   or None, and the seconds its Retry-After header asks to wait, or None.
+   '''
+   resp = getattr( error, 'resp', None )
+   if resp is not None:
+      status = getattr( resp, 'status', None )
+      retryAfter = resp.get( 'retry-after' )
+   else:
+      status = getattr( error, 'status', None )
+      retryAfter = getattr( error, 'retryAfter', None )
+   try:
+      retryAfter = float( retryAfter ) if retryAfter is not None else None
+   except ValueError:
+      # Dates are allowed too, but not sent by Gmail
+      retryAfter = None
+   return ( int( status ) if status is not None else None ), retryAfter
+
+def is_throttled( error ):
+   '''Returns whether error is a 429 or a rate limit 403, which Gmail sends
+   without carrying out the request.
+   '''
+   status, _ = error_status( error )
+   if status == 403:
+      content = getattr( error, 'content', b'' ) or getattr( error, 'message', '' )
+      if isinstance( content, bytes ):
+         content = content.decode( 'utf-8', 'replace' )
+      return any( reason in content for reason in RATE_LIMIT_REASONS )
+   return status == 429
+
+def is_retryable( error ):
+   return is_throttled( error ) or error_status( error )[ 0 ] in RETRY_STATUSES
+
+def is_unsafe_retry( method, error ):
+   '''Returns whether the request of method which failed with error may have
+   been carried out anyway.
+   '''
+   return method in UNSAFE_METHODS and not is_throttled( error )
+
+class AdaptiveLimit( object ):
+   '''A limit on how much is sent at once, like a batch size or concurrency,
+   which is halved when requests are throttled, and grows by one again after
+   as many successes as the limit in a row.
+
+   Requests in flight when the limit is lowered may be throttled too, so it
+   is lowered at most once per cooldown seconds.
+   '''
+   def __init__( self, maximum, minimum=1, cooldown=1.0, clock=time.monotonic ):
+      self.maximum = maximum
+      self.minimum = min( minimum, maximum )
+      self.value = maximum
+      self.cooldown = cooldown
+      self.clock = clock
+      self._successes = 0
+      self._lastDecrease = None
+      self._lock = threading.Lock()
+
+   def throttled( self ):
+      with self._lock:
+         now = self.clock()
+         self._successes = 0
+         if self._lastDecrease is None or now - self._lastDecrease >= self.cooldown:
+            self.value = max( self.minimum, self.value // 2 )
+            self._lastDecrease = now
+
+   def succeeded( self ):
+      with self._lock:
+         self._successes += 1
+         if self._successes >= self.value and self.value < self.maximum:
+            self.value += 1
+            self._successes = 0
+
+class Scheduler( object ):
+   '''Paces the requests of an account to stay within its quota, and decides
+   when failed ones are retried.
+
+   A token bucket holds up to burst units, refilled at rate units a second.
+   Each request first reserves its cost, and waits as long as the bucket
+   takes to cover it. Requests failing with 429, 5xx or a rate limit 403 are
+   retried up to maxRetries times, after exponential backoff with full
+   jitter, and no sooner than any Retry-After, which pauses every request.
+   Creates failing with a 5xx may have been made, so they are only sent again
+   if reconciling finds no filter they made. The AdaptiveLimits in limits are
+   told of throttled and successful requests.
+
+   Requests may be scheduled from any thread, and from coroutines, which
+   sleep for the waits themselves.
+   '''
+   def __init__( self, rate=QUOTA_RATE, burst=None, maxRetries=DEFAULT_RETRIES,
+                 baseDelay=0.5, maxDelay=32.0, seed=None, clock=time.monotonic,
+                 sleep=time.sleep ):
+      self.rate = float( rate )
+      self.burst = float( burst if burst is not None else rate )
+      self.maxRetries = maxRetries
+      self.baseDelay = baseDelay
+      self.maxDelay = maxDelay
+      self.clock = clock
+      self.sleep = sleep
+      self.limits = []
+      self.tokens = self.burst
+      self.updated = clock()
+      self.pausedUntil = 0.0
+      self.requests = 0
+      self.retries = 0
+      self.throttles = 0
+      self.waited = 0.0
+      self._rng = random.Random( seed )
+      self._lock = threading.Lock()
+
+   def reserve( self, cost ):
+      '''Takes cost units from the bucket, and returns how many seconds to
+      wait before sending the request.
+      '''
+      with self._lock:
+         now = self.clock()
+         self.tokens = min( self.burst, self.tokens + ( now - self.updated ) * self.rate )
+         self.updated = now
+         self.tokens -= cost
+         self.requests += 1
+         wait = max( -self.tokens / self.rate, self.pausedUntil - now, 0.0 )
+         self.waited += wait
+      return wait
+
+   def wait( self, cost ):
+      wait = self.reserve( cost )
+      if wait > 0:
+         with Timings.phase( 'quota wait' ):
+            self.sleep( wait )
+
+   def retry_delay( self, error, attempt ):
+      '''Returns how many seconds to wait before retrying a request which
+      failed with error after attempt retries, or None if it should not be.
+      '''
+      if attempt >= self.maxRetries or not is_retryable( error ):
+         return None
+      status, retryAfter = error_status( error )
+      with self._lock:
+         self.retries += 1
+         delay = self._rng.uniform( 0, min( self.maxDelay,
+                                            self.baseDelay * 2 ** attempt ) )
+         if retryAfter is not None:
+            delay = max( delay, retryAfter )
+            self.pausedUntil = max( self.pausedUntil, self.clock() + retryAfter )
+         if status in ( 403, 429 ):
+            self.throttles += 1
+      for limit in self.limits:
+         limit.throttled()
+      return delay
+
+   def succeeded( self ):
+      for limit in self.limits:
+         limit.succeeded()
+
+   def call( self, method, func, reconcile=None ):
+      '''Returns func(), called once the quota allows a request of method,
+      and again while it fails in a way worth retrying.
+
+      Before an unsafe method is sent again after a 5xx, reconcile() is
+      called, and returns what the failed request made, or None if it made
+      nothing. Without reconcile, such failures are raised.
+      '''
+      attempt = 0
+      while True:
+         self.wait( QUOTA_COSTS[ method ] )
+         try:
+            result = func()
+         except Exception as e: # pylint: disable=broad-except
+            unsafe = is_unsafe_retry( method, e )
+            delay = None if unsafe and reconcile is None else \
+                    self.retry_delay( e, attempt )
+            if delay is None:
+               raise
+            attempt += 1
+            with Timings.phase( 'backoff' ):
+               self.sleep( delay )
+            if unsafe:
+               result = reconcile()
+               if result is not None:
+                  return result
+            continue
+         self.succeeded()
+         return result
+
+   def stats_str( self ):
+      return ( "Quota: %d requests, %d retried, %d throttled, %.1f s waiting" %
+               ( self.requests, self.retries, self.throttles, self.waited ) )
@@ -0,0 +1,98 @@
+from __future__ import print_function
+import time
+
+from GmailFilters import ParseError
+from GmailFilters.Match import filter_matcher, UnsupportedQuery
+from GmailFilters.Prefilter import LiteralIndex
+
+DEFAULT_MAX_EXAMPLES = 5
+
+class FilterMatches( object ):
+   '''The messages one filter matched, or, when simulating an update, the
+   messages its new version matches and the old one doesn't ( added ), and
+   the other way around ( removed ). Only the first few of each are kept.
+   '''
+   def __init__( self, filterId, maxExamples ):
+      self.filterId = filterId
+      self.maxExamples = maxExamples
+      self.count = 0
+      self.examples = []
+      self.added = 0
+      self.addedExamples = []
+      self.removed = 0
+      self.removedExamples = []
+
+   def _example( self, examples, msg ):
+      if len( examples ) < self.maxExamples:
+         examples.append( msg.label() )
+
+   def matched( self, msg ):
+      self.count += 1
+      self._example( self.examples, msg )
+
+   def changed( self, msg, added ):
+      if added:
+         self.added += 1
+         self._example( self.addedExamples, msg )
+      else:
+         self.removed += 1
+         self._example( self.removedExamples, msg )
+
+class Simulation( object ):
+   '''Runs the matchers of filters over messages.
+
+   newFilters maps the ids of filters which a pending update changes to their
+   new version. Filters whose criteria can't be evaluated are left out, with
+   the reason in errors. With prefilter, only the filters which a LiteralIndex
+   finds may match a message are evaluated on it.
+   '''
+   def __init__( self, filters, newFilters=None, maxExamples=DEFAULT_MAX_EXAMPLES,
+                 prefilter=True ):
+      newFilters = newFilters or {}
+      self.matchers = []
+      self.errors = {}
+      self.results = {}
+      for filter_ in filters:
+         id_ = filter_[ 'id' ]
+         try:
+            oldMatcher = filter_matcher( filter_ )
+            newMatcher = None
+            if id_ in newFilters:
+               newMatcher = filter_matcher( newFilters[ id_ ] )
+         except ( UnsupportedQuery, ParseError ) as e:
+            self.errors[ id_ ] = str( e )
+            continue
+         self.matchers.append( ( id_, oldMatcher, newMatcher ) )
+         self.results[ id_ ] = FilterMatches( id_, maxExamples )
+      self.index = None
+      if prefilter:
+         self.index = LiteralIndex( [] )
+         for position, ( _, oldMatcher, newMatcher ) in enumerate( self.matchers ):
+            self.index.add( position, oldMatcher )
+            if newMatcher is not None:
+               self.index.add( position, newMatcher )
+      self.messages = 0
+      self.elapsed = 0.0
+
+   def run( self, messages ):
+      start = time.perf_counter()
+      results = self.results
+      matchers = self.matchers
+      for msg in messages:
+         self.messages += 1
+         if self.index is not None:
+            candidates = [ matchers[ i ] for i in self.index.candidates( msg ) ]
+         else:
+            candidates = matchers
+         for id_, oldMatcher, newMatcher in candidates:
+            oldMatch = oldMatcher( msg )
+            if oldMatch:
+               results[ id_ ].matched( msg )
+            if newMatcher is not None:
+               newMatch = newMatcher( msg )
+               if newMatch != oldMatch:
+                  results[ id_ ].changed( msg, newMatch )
+      self.elapsed += time.perf_counter() - start
+
+   def rate( self ):
+      return self.messages / self.elapsed if self.elapsed else 0.0
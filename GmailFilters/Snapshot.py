@@ -0,0 +1,189 @@
+from __future__ import print_function
+import copy
+import json
+import time
+
+from GmailFilters.Config import config_file, account_file, atomic_write
+from GmailFilters.Labels import LabelCache
+from GmailFilters.Write import FilterWriteResult
+
+SNAPSHOT_VERSION = 1
+DEFAULT_TTL = 300
+
+def last_account_path():
+   return config_file( 'last_account' )
+
+class OfflineError( Exception ):
+   pass
+
+def last_account():
+   '''Returns the email of the account last fetched from, or None.'''
+   try:
+      with open( last_account_path() ) as f:
+         return f.read().strip() or None
+   except IOError:
+      return None
+
+class Snapshot( object ):
+   '''The filters and labels of an account, as last fetched from Gmail, and kept
+   up to date with the writes made since.
+
+   Writes are applied in memory, and only saved by save_changes(), once per
+   command rather than once per write.
+   '''
+   def __init__( self, emailAddr, filters, labels, fetchedAt=None ):
+      self.emailAddr = emailAddr
+      self.filters = filters
+      self.labels = labels
+      self.fetchedAt = fetchedAt if fetchedAt is not None else time.time()
+      self.dirty = False
+
+   @staticmethod
+   def path( emailAddr ):
+      return account_file( emailAddr, 'snapshot.json' )
+
+   @classmethod
+   def fetch( cls, service, emailAddr ):
+      snapshot = cls( emailAddr, service.get_filters(), service.get_labels() )
+      snapshot.save()
+      atomic_write( last_account_path(), emailAddr )
+      return snapshot
+
+   @classmethod
+   def load( cls, emailAddr ):
+      '''Returns the saved snapshot of emailAddr, or None.'''
+      try:
+         with open( cls.path( emailAddr ) ) as f:
+            obj = json.load( f )
+      except ( IOError, ValueError ):
+         return None
+      if obj.get( 'version' ) != SNAPSHOT_VERSION:
+         return None
+      return cls( emailAddr, obj[ 'filters' ], obj[ 'labels' ], obj[ 'fetchedAt' ] )
+
+   def save( self ):
+      atomic_write( self.path( self.emailAddr ), json.dumps( {
+         'version': SNAPSHOT_VERSION,
+         'fetchedAt': self.fetchedAt,
+         'filters': self.filters,
+         'labels': self.labels,
+      } ) )
+      self.dirty = False
+
+   def save_changes( self ):
+      '''Saves the snapshot, if writes were applied to it since it was saved.'''
+      if self.dirty:
+         self.save()
+
+   def age( self ):
+      return time.time() - self.fetchedAt
+
+   def get_filter( self, filterId ):
+      for filter_ in self.filters:
+         if filter_[ 'id' ] == filterId:
+            return filter_
+      return None
+
+   def add_filter( self, filterObj ):
+      self.filters.append( copy.deepcopy( filterObj ) )
+      self.dirty = True
+
+   def remove_filter( self, filterId ):
+      self.filters = [ f for f in self.filters if f[ 'id' ] != filterId ]
+      self.dirty = True
+
+   def apply_write_results( self, results ):
+      '''Applies the FilterWriteResults of Service.replace_filters.'''
+      deletedIds = set( r.oldId for r in results if r.deleted )
+      self.filters = [ f for f in self.filters if f[ 'id' ] not in deletedIds ]
+      self.filters.extend( copy.deepcopy( r.created ) for r in results
+                           if r.created is not None )
+      self.dirty = True
+
+class SnapshotService( object ):
+   '''Serves the reads of a Service from a Snapshot.
+
+   connect returns the Service to write with, and is only called on the first
+   write. Successful writes are applied to the snapshot too. When offline,
+   connect is None and only dry writes can be made.
+   '''
+   def __init__( self, snapshot, connect=None, dryWrites=False ):
+      self.snapshot = snapshot
+      self.connect = connect
+      self.dryWrites = dryWrites
+      self.emailAddr = snapshot.emailAddr
+      self._service = None
+      self._labelCache = None
+
+   def service( self ):
+      if self._service is None:
+         if self.connect is None:
+            raise OfflineError( "Cannot make changes to Gmail while offline" )
+         self._service = self.connect()
+      return self._service
+
+   def get_email_addr( self ):
+      return self.snapshot.emailAddr
+
+   def get_labels( self ):
+      return copy.deepcopy( self.snapshot.labels )
+
+   def label_cache( self ):
+      # The labels are as fresh as the snapshot, and are refetched with it
+      if self._labelCache is None:
+         self._labelCache = LabelCache.from_labels( self.snapshot.labels,
+                                                    self.snapshot.fetchedAt )
+      return self._labelCache
+
+   def get_filter( self, filterId ):
+      return copy.deepcopy( self.snapshot.get_filter( filterId ) )
+
+   def get_filters( self ):
+      return copy.deepcopy( self.snapshot.filters )
+
+   def create_filter( self, filterObj ):
+      if self.dryWrites and self.connect is None:
+         results = copy.deepcopy( filterObj )
+         # The id is not the same, when returned from the server
+         results[ 'id' ] = results.get( 'id', 'new' ) + '_FAKE_NEW_ID'
+         print( "DRY create: %r" % ( results, ) )
+         return results
+
+      results = self.service().create_filter( filterObj )
+      if not self.dryWrites:
+         self.snapshot.add_filter( results )
+      return results
+
+   def delete_filter( self, filterId ):
+      if self.dryWrites and self.connect is None:
+         results = self.get_filter( filterId )
+         print( "DRY delete %r: %r" % ( filterId, results, ) )
+         return results
+
+      results = self.service().delete_filter( filterId )
+      if not self.dryWrites:
+         self.snapshot.remove_filter( filterId )
+      return results
+
+   def replace_filters( self, filterObjs, batchSize=None, writer=None, journal=None ):
+      '''Replaces the filters with writer, which defaults to the connected
+      Service, recording each change in journal, if given, and applies the
+      changes that succeeded to the snapshot.
+      '''
+      if self.dryWrites and self.connect is None:
+         results = [ FilterWriteResult( f ) for f in filterObjs ]
+         for result in results:
+            result.created = self.create_filter( result.filter )
+            self.delete_filter( result.oldId )
+            result.deleted = True
+         return results
+
+      kwargs = {} if batchSize is None else { 'batchSize': batchSize }
+      if journal is not None:
+         kwargs[ 'journal' ] = journal
+      if writer is None:
+         writer = self.service()
+      results = writer.replace_filters( filterObjs, **kwargs )
+      if not self.dryWrites:
+         self.snapshot.apply_write_results( results )
+      return results
@@ -0,0 +1,176 @@
+from __future__ import print_function
+from array import array
+
+from GmailFilters import FilterElement, PARENS, BRACES, QUOTES, intern_ws, \
+                         parse_filter_element
+
+DELIMS_CODES = ( None, PARENS, BRACES, QUOTES )
+
+# Fields of each node in FilterElementTable.nodes
+START, END, PRE_WS, POST_WS, DELIMS, SUBTREE_END, PARENT = range( 7 )
+NODE_FIELDS = 7
+
+class FilterElementTable( object ):
+   '''A parsed query held as a flat node table over the query string.
+
+   Nodes are stored in pre-order, NODE_FIELDS ints each, in a single array.
+   Every node covers a contiguous span of source ( from its preWs to its
+   postWs ), so its strings are slices of source, and the nodes of its subtree
+   are the indexes up to its SUBTREE_END.
+   '''
+   __slots__ = ( 'source', 'nodes' )
+
+   def __init__( self, source, nodes ):
+      self.source = source
+      self.nodes = nodes
+
+   @classmethod
+   def from_element( cls, elem ):
+      nodes = array( 'i' )
+      offset = 0
+
+      def add( elem, parent ):
+         nonlocal offset
+         idx = len( nodes ) // NODE_FIELDS
+         base = len( nodes )
+         delimLen = 1 if elem.delims is not None else 0
+         nodes.extend( ( offset, 0, len( elem.preWs ), len( elem.postWs ),
+                         DELIMS_CODES.index( elem.delims ), 0, parent ) )
+         offset += len( elem.preWs ) + delimLen
+         if elem.has_sub_elems():
+            for se in elem.subElems:
+               add( se, idx )
+         else:
+            offset += len( elem.filterStr )
+         offset += delimLen + len( elem.postWs )
+         nodes[ base + END ] = offset
+         nodes[ base + SUBTREE_END ] = len( nodes ) // NODE_FIELDS
+
+      add( elem, -1 )
+      return cls( elem.full_filter_str(), nodes )
+
+   @classmethod
+   def parse( cls, filterStr ):
+      table = cls.from_element( parse_filter_element( filterStr ) )
+      # Share the caller's string rather than holding a second copy
+      table.source = filterStr
+      return table
+
+   def __len__( self ):
+      return len( self.nodes ) // NODE_FIELDS
+
+   def field( self, idx, fieldIdx ):
+      return self.nodes[ idx * NODE_FIELDS + fieldIdx ]
+
+   def is_group( self, idx ):
+      # Groups always have at least one sub element
+      return self.field( idx, SUBTREE_END ) > idx + 1
+
+   def children( self, idx ):
+      end = self.field( idx, SUBTREE_END )
+      child = idx + 1
+      while child < end:
+         yield child
+         child = self.field( child, SUBTREE_END )
+
+   def text_span( self, idx ):
+      '''Returns the ( start, end ) of the node's filterStr, or of the contents
+      of its delims for groups.
+      '''
+      base = idx * NODE_FIELDS
+      delimLen = 1 if self.nodes[ base + DELIMS ] else 0
+      return ( self.nodes[ base + START ] + self.nodes[ base + PRE_WS ] + delimLen,
+               self.nodes[ base + END ] - self.nodes[ base + POST_WS ] - delimLen )
+
+   def root( self ):
+      return FilterElementView( self, 0 )
+
+   def to_element( self, idx=0 ):
+      '''Returns a new, mutable FilterElement tree for the node at idx.'''
+      nodes = self.nodes[ idx * NODE_FIELDS:
+                          self.field( idx, SUBTREE_END ) * NODE_FIELDS ].tolist()
+      source = self.source
+      # Build bottom up, from the last node, so each group's sub elements are
+      # all built by the time it is reached.
+      built = [ None ] * ( len( nodes ) // NODE_FIELDS )
+      for i in range( len( built ) - 1, -1, -1 ):
+         base = i * NODE_FIELDS
+         start, end, preLen, postLen, delimsCode, subtreeEnd = nodes[ base:base + 6 ]
+         delims = DELIMS_CODES[ delimsCode ]
+         if subtreeEnd - idx > i + 1:
+            subElems = []
+            child = i + 1
+            while child < len( built ) and child + idx < subtreeEnd:
+               subElems.append( built[ child ] )
+               child = nodes[ child * NODE_FIELDS + SUBTREE_END ] - idx
+            elem = FilterElement( subElems=subElems, delims=delims,
+                                  preWs=source[ start:start + preLen ],
+                                  postWs=source[ end - postLen:end ] )
+         else:
+            delimLen = 1 if delimsCode else 0
+            elem = FilterElement( source[ start + preLen + delimLen:
+                                          end - postLen - delimLen ],
+                                  delims=delims,
+                                  preWs=source[ start:start + preLen ],
+                                  postWs=source[ end - postLen:end ] )
+         built[ i ] = elem
+      return built[ 0 ]
+
+class FilterElementView( object ):
+   '''A read-only FilterElement over one node of a FilterElementTable.'''
+   __slots__ = ( 'table', 'idx' )
+
+   def __init__( self, table, idx ):
+      self.table = table
+      self.idx = idx
+
+   @property
+   def delims( self ):
+      return DELIMS_CODES[ self.table.field( self.idx, DELIMS ) ]
+
+   @property
+   def preWs( self ):
+      start = self.table.field( self.idx, START )
+      return intern_ws( self.table.source[
+            start:start + self.table.field( self.idx, PRE_WS ) ] )
+
+   @property
+   def postWs( self ):
+      end = self.table.field( self.idx, END )
+      return intern_ws( self.table.source[
+            end - self.table.field( self.idx, POST_WS ):end ] )
+
+   @property
+   def filterStr( self ):
+      if self.table.is_group( self.idx ):
+         return None
+      start, end = self.table.text_span( self.idx )
+      return self.table.source[ start:end ]
+
+   @property
+   def subElems( self ):
+      if not self.table.is_group( self.idx ):
+         return None
+      return [ FilterElementView( self.table, c )
+               for c in self.table.children( self.idx ) ]
+
+   @property
+   def parent( self ):
+      parentIdx = self.table.field( self.idx, PARENT )
+      return FilterElementView( self.table, parentIdx ) if parentIdx >= 0 else None
+
+   def has_sub_elems( self ):
+      return self.table.is_group( self.idx )
+
+   def full_filter_str( self ):
+      return self.table.source[ self.table.field( self.idx, START ):
+                                self.table.field( self.idx, END ) ]
+
+   def to_element( self ):
+      return self.table.to_element( self.idx )
+
+   def __str__( self ):
+      return self.full_filter_str()
+
+   def __repr__( self ):
+      return 'FilterElementView(%d, %r)' % ( self.idx, self.full_filter_str() )
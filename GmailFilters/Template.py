@@ -2,7 +2,7 @@ from __future__ import print_function
 import re
 import sys
 
-from GmailFilters import FilterElement, ElementParser, ParseError, \
+from GmailFilters import FilterElement, ParseError, \
                          parse_filter_element
 
 META_LABEL = 'M3TA'
@@ -116,10 +116,9 @@ def sub_meta_groups( filterElem, primaryElem ):
       else:
          sub_meta_groups( filterElem.subElems[ i ], primaryElem )
 
-def update_all_meta_groups( filterElemById ):
-   primaryKeyToId = {}
-   primaryKeyToGroup = {}
-
+def find_primary_groups( filterElemById ):
+   '''Returns { primary key: ( filter id, primary group ) }.'''
+   primaries = {}
    for id_, filterElem in filterElemById.items():
       primaryGroup = find_primary_template_group( filterElem )
       if primaryGroup is None:
@@ -127,25 +126,108 @@ def update_all_meta_groups( filterElemById ):
       key = get_template_group_key( primaryGroup, primaryOnly=True )
       assert key is not None
 
-      if key in primaryKeyToId:
+      if key in primaries:
          raise TemplateError( "Primary key collision for %r between filters %s, %s" %
-                              ( key, primaryKeyToId[ key ], id_ ) )
-      primaryKeyToId[ key ] = id_
-      primaryKeyToGroup[ key ] = primaryGroup
+                              ( key, primaries[ key ][ 0 ], id_ ) )
+      primaries[ key ] = ( id_, primaryGroup )
+   return primaries
 
-   for pKey, id_ in primaryKeyToId.items():
-      for id2, filterElem in filterElemById.items():
-         if id_ == id2:
-            # Don't want to try to update the same filter
+class TemplateIndex( object ):
+   '''Where the template groups and meta groups are in a set of filter trees.
+
+   sites maps each meta key to the ( filter id, parent, index ) of every
+   template group with that key, in the order sub_meta_groups would visit
+   them. metaSites holds the ( key, filter id, group ) of every meta group.
+   '''
+   def __init__( self, filterElemById ):
+      self.filterElemById = filterElemById
+      self.sites = {}
+      self.metaSites = []
+      for id_, filterElem in filterElemById.items():
+         self.add_subtree( id_, filterElem )
+
+   def add_subtree( self, id_, elem, parent=None, index=None, skipKeys=() ):
+      '''Indexes elem ( at index of parent ), and everything under it, from
+      filter id_. Template groups with keys in skipKeys are not added to sites.
+      '''
+      if not elem.has_sub_elems():
+         return
+
+      isOrGroup = elem.delims == '{}'
+      templateKey = None
+      subGroups = []
+      for i, se in enumerate( elem.subElems ):
+         if se.has_sub_elems():
+            k = get_meta_group_key( se )
+            if k is None:
+               subGroups.append( ( i, se ) )
+               continue
+            self.metaSites.append( ( k, id_, se ) )
+         elif isOrGroup and se.delims == '""':
+            k = get_meta_group_key( se )
+         else:
             continue
 
-         sub_meta_groups( filterElem, primaryKeyToGroup[ pKey ] )
+         if isOrGroup and k is not None:
+            if templateKey is not None:
+               raise TemplateError( "Multiple sibling meta keys found in '%s'" %
+                                    str( elem ) )
+            templateKey = k
+
+      if templateKey is not None and parent is not None and \
+         templateKey not in skipKeys:
+         self.sites.setdefault( templateKey, [] ).append( ( id_, parent, index ) )
+
+      for i, se in subGroups:
+         self.add_subtree( id_, se, elem, i, skipKeys=skipKeys )
+
+   def is_attached( self, id_, elem ):
+      '''Returns whether elem is still in the tree of filter id_, ie. it was
+      not within a substituted group.
+      '''
+      root = self.filterElemById[ id_ ]
+      while elem is not root:
+         elem = elem._parent # pylint: disable=protected-access
+         if elem is None:
+            return False
+      return True
 
-   allKeys = set()
-   for id_, filterElem in filterElemById.items():
-      allKeys |= find_all_meta_group_keys( filterElem )
+def update_all_meta_groups( filterElemById ):
+   '''Substitutes every template group with the primary group of its key.
+
+   The trees are indexed once, and each primary is then only copied into the
+   template groups that reference it, rather than walking every tree for
+   every primary.
+   '''
+   primaries = find_primary_groups( filterElemById )
+   index = TemplateIndex( filterElemById )
+
+   substitutedKeys = set()
+   for pKey, ( id_, primaryGroup ) in primaries.items():
+      # Template groups copied in below may hold pKey again. Like
+      # sub_meta_groups, those are not substituted.
+      substitutedKeys.add( pKey )
+      sites = index.sites.pop( pKey, [] )
+      pStr = None
+      for siteId, parent, i in sites:
+         if siteId == id_:
+            # Don't want to try to update the same filter
+            continue
+         elem = parent.subElems[ i ]
+         if not index.is_attached( siteId, elem ):
+            continue
 
-   undefinedKeys = allKeys - set( primaryKeyToId.keys() )
+         if pStr is None:
+            pStr = normalized_primary_elem( primaryGroup ).full_filter_str()
+         pCopy = parse_filter_element( pStr ).subElems[ 0 ]
+         pCopy.preWs = elem.preWs
+         pCopy.postWs = elem.postWs
+         parent.subElems[ i ] = pCopy
+         index.add_subtree( siteId, pCopy, parent, i, skipKeys=substitutedKeys )
+
+   allKeys = set( k for k, siteId, elem in index.metaSites
+                  if index.is_attached( siteId, elem ) )
+   undefinedKeys = allKeys - set( primaries.keys() )
    if undefinedKeys:
       raise TemplateError( "Could not find definition for keys: %s" %
                            ', '.join( str( k ) for k in undefinedKeys ) )
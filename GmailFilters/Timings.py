@@ -0,0 +1,175 @@
+from __future__ import print_function
+import contextlib
+import json
+import threading
+import time
+from urllib.parse import urlparse
+
+# Service methods, by the HTTP method and last parts of the path of their
+# requests. Single filters are matched by their parent path.
+REQUEST_NAMES = {
+   ( 'GET', 'profile' ): 'get_email_addr',
+   ( 'GET', 'labels' ): 'get_labels',
+   ( 'GET', 'settings/filters' ): 'get_filters',
+   ( 'POST', 'settings/filters' ): 'create_filter',
+   ( 'GET', 'settings/filters/' ): 'get_filter',
+   ( 'DELETE', 'settings/filters/' ): 'delete_filter',
+}
+PERCENTILES = ( 50, 90, 99 )
+
+_timings = None
+_noPhase = contextlib.nullcontext()
+
+def enable():
+   '''Starts recording timings, and returns the Timings they are recorded in.'''
+   global _timings
+   _timings = Timings()
+   return _timings
+
+def disable():
+   global _timings
+   _timings = None
+
+def current():
+   '''Returns the Timings being recorded, or None.'''
+   return _timings
+
+def phase( name ):
+   '''Returns a context manager timing the phase name, if timings are being
+   recorded. Otherwise it does nothing.
+   '''
+   if _timings is None:
+      return _noPhase
+   return _timings.phase( name )
+
+def instrument_http( http ):
+   '''Makes the requests of the httplib2.Http http record their timings, if
+   timings are being recorded. Returns http.
+   '''
+   if _timings is not None:
+      _timings.instrument_http( http )
+   return http
+
+def request_name( method, uri ):
+   '''Returns the name of the Service method making a request to uri.'''
+   path = urlparse( uri ).path
+   if path.startswith( '/batch' ):
+      return 'batch'
+   if 'oauth2' in path or path.endswith( '/token' ):
+      return 'oauth token refresh'
+   parts = path.split( '/users/', 1 )[ -1 ].split( '/' )[ 1: ]
+   name = REQUEST_NAMES.get( ( method, '/'.join( parts ) ) )
+   if name is None and len( parts ) > 1:
+      name = REQUEST_NAMES.get( ( method, '/'.join( parts[ :-1 ] ) + '/' ) )
+   return name or '%s %s' % ( method, path )
+
+def percentile( sortedValues, p ):
+   '''Returns the value below which p percent of sortedValues are, by the
+   nearest rank.
+   '''
+   rank = max( 1, -( -len( sortedValues ) * p // 100 ) )
+   return sortedValues[ min( rank, len( sortedValues ) ) - 1 ]
+
+class RequestStats( object ):
+   def __init__( self ):
+      self.latencies = []
+      self.sentBytes = 0
+      self.receivedBytes = 0
+      self.errors = 0
+
+   def to_json( self ):
+      latencies = sorted( self.latencies )
+      obj = { 'calls': len( latencies ), 'sentBytes': self.sentBytes,
+              'receivedBytes': self.receivedBytes, 'errors': self.errors,
+              'totalSeconds': sum( latencies ) }
+      for p in PERCENTILES:
+         obj[ 'p%d' % p ] = percentile( latencies, p )
+      obj[ 'max' ] = latencies[ -1 ]
+      return obj
+
+class Timings( object ):
+   '''How long each phase of a command took, and the number, size and latency
+   of its requests to Gmail, by the Service method making them.
+
+   Phases which run more than once are added up. Requests may be recorded
+   from any thread.
+   '''
+   def __init__( self ):
+      self.start = time.perf_counter()
+      self.phases = {}
+      self.requests = {}
+      self._lock = threading.Lock()
+
+   @contextlib.contextmanager
+   def phase( self, name ):
+      start = time.perf_counter()
+      try:
+         yield
+      finally:
+         self.add_phase( name, time.perf_counter() - start )
+
+   def add_phase( self, name, seconds ):
+      with self._lock:
+         self.phases[ name ] = self.phases.get( name, 0.0 ) + seconds
+
+   def record_request( self, name, seconds, sentBytes, receivedBytes, error=False ):
+      with self._lock:
+         stats = self.requests.get( name )
+         if stats is None:
+            stats = self.requests[ name ] = RequestStats()
+         stats.latencies.append( seconds )
+         stats.sentBytes += sentBytes
+         stats.receivedBytes += receivedBytes
+         stats.errors += bool( error )
+
+   def instrument_http( self, http ):
+      request = http.request
+
+      def timed_request( uri, method='GET', body=None, *reqArgs, **reqKwargs ):
+         start = time.perf_counter()
+         response = content = None
+         try:
+            response, content = request( uri, method, body, *reqArgs, **reqKwargs )
+            return response, content
+         finally:
+            status = getattr( response, 'status', 0 )
+            self.record_request( request_name( method, uri ),
+                                 time.perf_counter() - start,
+                                 len( body or '' ), len( content or b'' ),
+                                 error=not 200 <= int( status ) < 300 )
+      http.request = timed_request
+
+   def total( self ):
+      return time.perf_counter() - self.start
+
+   def to_json( self ):
+      return { 'totalSeconds': self.total(), 'phases': dict( self.phases ),
+               'requests': { name: stats.to_json()
+                             for name, stats in self.requests.items() } }
+
+   def summary_lines( self ):
+      lines = [ 'Total: %.1f ms' % ( self.total() * 1000 ) ]
+      for name, seconds in sorted( self.phases.items(), key=lambda item: -item[ 1 ] ):
+         lines.append( '  %-24s %10.1f ms' % ( name, seconds * 1000 ) )
+      if self.requests:
+         lines.append( '%-26s %6s %10s %10s %8s %8s %8s %8s' %
+                       ( 'Requests', 'calls', 'sent', 'received', 'p50 ms',
+                         'p90 ms', 'p99 ms', 'max ms' ) )
+      for name, obj in sorted( ( ( n, s.to_json() ) for n, s in self.requests.items() ),
+                               key=lambda item: -item[ 1 ][ 'totalSeconds' ] ):
+         lines.append( '  %-24s %6d %10d %10d %8.1f %8.1f %8.1f %8.1f' %
+                       ( name, obj[ 'calls' ], obj[ 'sentBytes' ],
+                         obj[ 'receivedBytes' ], obj[ 'p50' ] * 1000,
+                         obj[ 'p90' ] * 1000, obj[ 'p99' ] * 1000,
+                         obj[ 'max' ] * 1000 ) )
+         if obj[ 'errors' ]:
+            lines[ -1 ] += '  (%d failed)' % obj[ 'errors' ]
+      return lines
+
+   def report( self, fmt, out ):
+      if fmt == 'json':
+         json.dump( self.to_json(), out, indent=1, sort_keys=True )
+         out.write( '\n' )
+      else:
+         for line in self.summary_lines():
+            print( line, file=out )
@@ -0,0 +1,31 @@
+# Gmail takes up to 100 requests per batch, but recommends no more than 50
+DEFAULT_BATCH_SIZE = 50
+MAX_BATCH_SIZE = 100
+
+class FilterWriteResult( object ):
+   '''The outcome of replacing one filter: creating its new version, and then
+   deleting the old filter, whose id the new version still has.
+   '''
+   def __init__( self, filterObj ):
+      self.filter = filterObj
+      self.created = None
+      self.deleted = False
+      self.error = None
+
+   @property
+   def oldId( self ):
+      return self.filter[ 'id' ]
+
+   def ok( self ):
+      return self.error is None
+
+def find_created( filters, filterObj ):
+   '''Returns the filter of filters that a failed create of filterObj made, or
+   None. The filter it replaces, which has its id, is not one.
+   '''
+   for f in filters:
+      if f[ 'id' ] != filterObj.get( 'id' ) and \
+         f.get( 'criteria' ) == filterObj.get( 'criteria' ) and \
+         f.get( 'action' ) == filterObj.get( 'action' ):
+         return f
+   return None
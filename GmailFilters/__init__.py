@@ -1,4 +1,5 @@
 from __future__ import print_function
+import re
 import sys
 
 class GmailFilter( object ):
@@ -8,22 +9,161 @@ class GmailFilter( object ):
 PARENS = '()'
 BRACES = '{}'
 
+QUOTES = '""'
+
 DELIM_PAIRS = [ PARENS, BRACES ]
 OPEN_DELIMS = '({'
 CLOSE_DELIMS = ')}'
 
+DELIMS_BY_OPEN = { PARENS[ 0 ]: PARENS, BRACES[ 0 ]: BRACES }
+# Maps equal delims strings to a single shared instance
+_internedDelims = { d: d for d in ( PARENS, BRACES, QUOTES ) }
+
+def intern_ws( ws ):
+   '''Returns a shared instance of the whitespace string ws. Most elements are
+   padded with zero or one space, so this keeps large trees from holding many
+   copies of the same few strings.
+   '''
+   return sys.intern( ws ) if ws else ''
+
 class ParseError( Exception ):
    pass
 
+class ElementList( list ):
+   """The subElems list of a FilterElement.
+
+   Any change to the list invalidates the serialization cached by its owner
+   ( and the owner's ancestors ), and keeps the parent links of the added and
+   removed elements up to date.
+   """
+   __slots__ = ( 'owner', )
+
+   def __init__( self, owner, elems=() ):
+      super( ElementList, self ).__init__( elems )
+      self.owner = owner
+      for elem in self:
+         _set_parent( elem, owner )
+
+   def _changed( self, added=(), removed=() ):
+      # The owner is not set on lists made by copy/deepcopy until they are
+      # assigned to an element.
+      owner = getattr( self, 'owner', None )
+      for elem in removed:
+         if elem._parent is owner: # pylint: disable=protected-access
+            _set_parent( elem, None )
+      for elem in added:
+         _set_parent( elem, owner )
+      if owner is not None:
+         owner._invalidate()
+
+   def __setitem__( self, key, value ):
+      removed = self[ key ] if isinstance( key, slice ) else [ self[ key ] ]
+      super( ElementList, self ).__setitem__( key, value )
+      added = self[ key ] if isinstance( key, slice ) else [ value ]
+      self._changed( added, removed )
+
+   def __delitem__( self, key ):
+      removed = self[ key ] if isinstance( key, slice ) else [ self[ key ] ]
+      super( ElementList, self ).__delitem__( key )
+      self._changed( removed=removed )
+
+   def __reduce__( self ):
+      # Copies are plain lists, which become ElementLists once assigned
+      return ( list, ( list( self ), ) )
+
+   def __iadd__( self, elems ):
+      self.extend( elems )
+      return self
+
+   def __imul__( self, n ):
+      raise TypeError( "An element can only be in one subElems list" )
+
+   def append( self, elem ):
+      super( ElementList, self ).append( elem )
+      self._changed( [ elem ] )
+
+   def extend( self, elems ):
+      elems = list( elems )
+      super( ElementList, self ).extend( elems )
+      self._changed( elems )
+
+   def insert( self, index, elem ):
+      super( ElementList, self ).insert( index, elem )
+      self._changed( [ elem ] )
+
+   def pop( self, index=-1 ):
+      elem = super( ElementList, self ).pop( index )
+      self._changed( removed=[ elem ] )
+      return elem
+
+   def remove( self, elem ):
+      super( ElementList, self ).remove( elem )
+      self._changed( removed=[ elem ] )
+
+   def clear( self ):
+      removed = list( self )
+      super( ElementList, self ).clear()
+      self._changed( removed=removed )
+
+   def sort( self, *args, **kwargs ):
+      super( ElementList, self ).sort( *args, **kwargs )
+      self._changed()
+
+   def reverse( self ):
+      super( ElementList, self ).reverse()
+      self._changed()
+
 class FilterElement( object ):
+   """A text element, or a group of sub elements, of a filter query.
+
+   Groups memoize their full_filter_str(). Setting an attribute of an element,
+   or changing a subElems list, drops the memoized strings of only the
+   element's ancestors, so reserializing a tree after a change only rebuilds
+   the strings along the changed paths. An element may only be in one tree
+   at a time for this to hold.
+   """
+   __slots__ = ( 'filterStr', 'subElems', 'delims', 'preWs', 'postWs',
+                 '_parent', '_strCache' )
+   # The slots are only set through their descriptors, which pylint can't see
+   # pylint: disable=no-member
+
    def __init__( self, filterStr=None, subElems=None, delims=None,
                  preWs='', postWs='' ):
-      self.filterStr = filterStr
-      self.subElems = subElems
-      self.delims = delims
-      self.preWs = preWs
-      self.postWs = postWs
-      self._check_consistency()
+      # The slots are set directly, as there is nothing to invalidate yet
+      _set_parent( self, None )
+      _set_str_cache( self, None )
+      _set_filter_str( self, filterStr )
+      _set_sub_elems( self,
+                      ElementList( self, subElems ) if subElems is not None else None )
+      _set_delims( self, _internedDelims.get( delims, delims ) )
+      _set_pre_ws( self, sys.intern( preWs ) if preWs else '' )
+      _set_post_ws( self, sys.intern( postWs ) if postWs else '' )
+      assert ( filterStr is None and subElems ) or \
+             ( filterStr is not None and subElems is None )
+
+   def __setattr__( self, name, value ):
+      if name == 'subElems':
+         if value is not None:
+            value = ElementList( self, value )
+      elif name == 'delims':
+         value = _internedDelims.get( value, value )
+      elif name in ( 'preWs', 'postWs' ):
+         value = intern_ws( value )
+      object.__setattr__( self, name, value )
+      self._invalidate()
+
+   def __reduce__( self ):
+      return ( FilterElement, ( self.filterStr, self.subElems, self.delims,
+                                self.preWs, self.postWs ) )
+
+   def _invalidate( self ):
+      # Only groups cache their string. A group's cache is only ever set
+      # while its ancestors' are unset or hold it, so the walk can stop at the
+      # first unset cache.
+      elem = self if self.subElems is not None else self._parent
+      while elem is not None and elem._strCache is not None:
+         _set_str_cache( elem, None )
+         elem = elem._parent
 
    def __eq__( self, other ):
       return type( self ) is type( other ) and \
@@ -52,12 +192,15 @@ class FilterElement( object ):
       return self.preWs + string + self.postWs
 
    def full_filter_str( self ):
-      self._check_consistency()
-      if self.has_sub_elems():
-         return self._maybe_wrap_in_delims_and_pad(
-               ''.join( sg.full_filter_str() for sg in self.subElems ) )
+      if self.subElems is None:
+         return self._maybe_wrap_in_delims_and_pad( self.filterStr )
 
-      return self._maybe_wrap_in_delims_and_pad( self.filterStr )
+      string = self._strCache
+      if string is None:
+         string = self._maybe_wrap_in_delims_and_pad(
+               ''.join( sg.full_filter_str() for sg in self.subElems ) )
+         _set_str_cache( self, string )
+      return string
 
    @staticmethod
    def full_filter_list_str( filterElementList ):
@@ -121,171 +264,148 @@ class FilterElement( object ):
    def __repr__( self ):
       return self.repr( singleLine=True )
 
-PRE_TEXT_MODE = 'pre'
-TEXT_MODE = 'text'
-POST_TEXT_MODE = 'post'
-QUOTED_TEXT_MODE = 'quoted'
-
-class ElementParser( object ):
-   def __init__( self, filterStr, startIdx=0, lastIdx=None ):
+# Setters of the FilterElement slots, which bypass its __setattr__
+# pylint: disable=no-member
+_set_parent = FilterElement._parent.__set__ # pylint: disable=protected-access
+_set_str_cache = FilterElement._strCache.__set__ # pylint: disable=protected-access
+_set_filter_str = FilterElement.filterStr.__set__
+_set_sub_elems = FilterElement.subElems.__set__
+_set_delims = FilterElement.delims.__set__
+_set_pre_ws = FilterElement.preWs.__set__
+_set_post_ws = FilterElement.postWs.__set__
+# pylint: enable=no-member
+
+# Token kinds produced by tokenize_filter_str
+WS_TOKEN = 'ws'
+TEXT_TOKEN = 'text'
+QUOTED_TOKEN = 'quoted'
+OPEN_TOKEN = 'open'
+CLOSE_TOKEN = 'close'
+
+# Every character of a filter string belongs to exactly one of these
+# alternatives, so consecutive matches tile the whole string. An unterminated
+# quote swallows the rest of the string, and is reported by the parser.
+token_regexp = re.compile( r'(?P<ws> +)|(?P<quoted>"[^"]*"?)|(?P<open>[({])|'
+                           r'(?P<close>[)}])|(?P<text>[^ (){}"]+)' )
+delim_regexp = re.compile( '[(){}]' )
+
+def tokenize_filter_str( filterStr ):
+   """Yields ( kind, start, end ) spans covering filterStr, in order."""
+   for m in token_regexp.finditer( filterStr ):
+      yield m.lastgroup, m.start(), m.end()
+
+class SpanParser( object ):
+   """Builds the FilterElement tree of filterStr, in one linear scan.
+
+   Tokens are consumed left to right, with an explicit stack of open groups,
+   so no part of the string is rescanned, and substrings are only sliced out
+   of filterStr once each, from their token spans.
+   """
+   def __init__( self, filterStr ):
       self.filterStr = filterStr
-      if lastIdx is None:
-         lastIdx = len( filterStr ) - 1
-      self.startIdx = startIdx
-      self.currIdx = startIdx
-      self.lastIdx = lastIdx
-
-   def last_group_idx( self, groupStart ):
-      delimStack = []
-      i = groupStart
-      assert self.filterStr[ i ] in OPEN_DELIMS
-      while True:
-         c = self.filterStr[ i ]
-         if c in OPEN_DELIMS:
-            di = OPEN_DELIMS.index( c )
-            delimStack.append( c )
-         elif c in CLOSE_DELIMS:
-            di = CLOSE_DELIMS.index( c )
-            if not delimStack or delimStack[ -1 ] != OPEN_DELIMS[ di ]:
-               raise ParseError( "Mismatched closing delim at index " + i )
-            else:
-               delimStack.pop()
-
-         if not delimStack:
-            break
-         i += 1
-
-      return i
-
-   def parse_delimited_group( self, startIdx ):
-      '''Return ( group, lastIdx )'''
-      lastDelimIdx = self.last_group_idx( startIdx )
-      assert lastDelimIdx
-
-      subElmParser = ElementParser( self.filterStr, startIdx + 1, lastDelimIdx - 1 )
-      groupElem = subElmParser.parse()
-      groupElem.delims = '()' if self.filterStr[ startIdx ] == '(' else '{}'
-
-      return groupElem, lastDelimIdx
-
-   def parse_next( self ):
-      # pylint: disable=too-many-branches,too-many-statements
-      mode = PRE_TEXT_MODE
-      delims = None
-      substr = None
-      groupElem = None
-      preWs = ''
-      postWs = ''
-      isFirstParse = self.startIdx == self.currIdx
-      i = self.currIdx
-      while i <= self.lastIdx:
-         if mode == PRE_TEXT_MODE:
-            if self.filterStr[ i ] == ' ':
-               preWs += ' '
-            elif self.filterStr[ i ] in OPEN_DELIMS:
-               groupElem, i = self.parse_delimited_group( i )
-               mode = POST_TEXT_MODE
-            elif self.filterStr[ i ] in CLOSE_DELIMS:
-               assert 0, "Found unmatched close delim while parsing: idx %d" % i
-            elif self.filterStr[ i ] == '"':
-               mode = QUOTED_TEXT_MODE
-               delims = '""'
-               substr = ''
-            else:
-               mode = TEXT_MODE
-               substr = self.filterStr[ i ]
-
-         elif mode == TEXT_MODE:
-            if self.filterStr[ i ] == ' ':
-               mode = POST_TEXT_MODE
-               postWs += ' '
-            elif self.filterStr[ i ] in OPEN_DELIMS:
-               break
-            elif self.filterStr[ i ] in CLOSE_DELIMS:
-               assert 0, "Found unmatched close delim while parsing: idx %d" % i
-            elif self.filterStr[ i ] == '"':
-               # This quoted element will be next
-               break
-            else:
-               substr += self.filterStr[ i ]
 
-         elif mode == POST_TEXT_MODE:
-            if self.filterStr[ i ] == ' ':
-               postWs += ' '
-            else:
-               break
-
-         elif mode == QUOTED_TEXT_MODE:
-            if self.filterStr[ i ] == '"':
-               i += 1
-               break
-            else:
-               substr += self.filterStr[ i ]
-         else:
-            assert 0, mode
-         i += 1
-
-      self.currIdx = i
-      if substr is None and groupElem is None:
-         if isFirstParse:
-            substr = ''
-            if self.currIdx == self.startIdx:
-               self.currIdx = self.startIdx + 1
-         else:
-            assert not preWs and not postWs
-            return None
+   def parse_error( self, index ):
+      return self.filterStr + '\n' + ( ( ' ' * index ) + '^' )
 
-      if groupElem is not None:
-         elm = groupElem
-         elm.preWs = preWs
-         elm.postWs = postWs
+   def _raw_delim_error( self, rawStack, c, i ):
+      # Delims are balanced as the original parser did it, ie. also counting
+      # those within quotes.
+      if c in OPEN_DELIMS:
+         rawStack.append( c )
+      elif not rawStack or rawStack[ -1 ] != OPEN_DELIMS[ CLOSE_DELIMS.index( c ) ]:
+         return "Mismatched closing delim:\n" + self.parse_error( i )
       else:
-         elm = FilterElement( substr,
-                              delims=delims,
-                              preWs=preWs,
-                              postWs=postWs )
-      return elm
+         rawStack.pop()
+      return None
 
    def parse( self ):
-      delimsError = self.check_delims()
-      if delimsError is not None:
-         raise ParseError( delimsError )
-
-      filterElements = []
-      done = False
-      while not done:
-         nextElem = self.parse_next()
-         if nextElem is None:
-            done = True
+      # pylint: disable=too-many-branches
+      filterStr = self.filterStr
+      rawStack = []
+      groupStack = []
+      elems = []
+      pendingWs = ''
+      postWsElem = None
+      for kind, start, end in tokenize_filter_str( filterStr ):
+         if kind == WS_TOKEN:
+            if postWsElem is not None:
+               postWsElem.postWs = intern_ws( filterStr[ start:end ] )
+               postWsElem = None
+            else:
+               pendingWs = filterStr[ start:end ]
+            continue
+
+         if kind == TEXT_TOKEN:
+            postWsElem = FilterElement( filterStr[ start:end ], preWs=pendingWs )
+            elems.append( postWsElem )
+         elif kind == QUOTED_TOKEN:
+            if end - start < 2 or filterStr[ end - 1 ] != '"':
+               raise ParseError( "Unmatched quote" )
+            for m in delim_regexp.finditer( filterStr, start, end ):
+               err = self._raw_delim_error( rawStack, m.group(), m.start() )
+               if err is not None:
+                  raise ParseError( err )
+            # Quoted elements never take trailing whitespace
+            postWsElem = None
+            elems.append( FilterElement( filterStr[ start + 1:end - 1 ],
+                                         delims=QUOTES, preWs=pendingWs ) )
+         elif kind == OPEN_TOKEN:
+            self._raw_delim_error( rawStack, filterStr[ start ], start )
+            groupStack.append( ( elems, start, pendingWs ) )
+            elems = []
+            postWsElem = None
          else:
-            filterElements.append( nextElem )
-
-      return FilterElement( subElems=filterElements )
+            assert kind == CLOSE_TOKEN, kind
+            err = self._raw_delim_error( rawStack, filterStr[ start ], start )
+            if err is not None:
+               raise ParseError( err )
+            if not groupStack or \
+               filterStr[ groupStack[ -1 ][ 1 ] ] != \
+               OPEN_DELIMS[ CLOSE_DELIMS.index( filterStr[ start ] ) ]:
+               raise ParseError( "Mismatched closing delim:\n" +
+                                 self.parse_error( start ) )
+            groupElems = self._close_elems( elems, pendingWs )
+            elems, openIdx, groupPreWs = groupStack.pop()
+            postWsElem = FilterElement( subElems=groupElems,
+                                        delims=DELIMS_BY_OPEN[ filterStr[ openIdx ] ],
+                                        preWs=groupPreWs )
+            elems.append( postWsElem )
+         pendingWs = ''
+
+      if rawStack or groupStack:
+         raise ParseError( "Unmatched delim:\n" +
+                           self.parse_error( len( filterStr ) - 1 ) )
+
+      return FilterElement( subElems=self._close_elems( elems, pendingWs ) )
 
-   def parse_error( self, index ):
-      return self.filterStr + '\n' + ( ( ' ' * index ) + '^' )
+   @staticmethod
+   def _close_elems( elems, pendingWs ):
+      # An empty group, or whitespace with nothing after it, is held by an
+      # empty text element.
+      if not elems or pendingWs:
+         elems.append( FilterElement( '', preWs=pendingWs ) )
+      return elems
 
-   def check_delims( self ):
-      delimStack = []
-      for i, c in enumerate( self.filterStr ):
-         if c in OPEN_DELIMS:
-            di = OPEN_DELIMS.index( c )
-            delimStack.append( c )
-         elif c in CLOSE_DELIMS:
-            di = CLOSE_DELIMS.index( c )
-            if not delimStack or delimStack[ -1 ] != OPEN_DELIMS[ di ]:
-               return "Mismatched closing delim:\n" + self.parse_error( i )
-            else:
-               delimStack.pop()
-      if delimStack:
-         return "Unmatched delim:\n" + \
-                self.parse_error( len( self.filterStr ) - 1 )
+# Bump when the trees the parser builds change, to invalidate cached parses
+PARSER_VERSION = 1
 
-      if self.filterStr.count( '"' ) % 2:
-         return "Unmatched quote"
+_parseCache = None
 
-      return None
+def set_parse_cache( cache ):
+   '''Has parse_filter_element consult cache ( a ParseCache, or None ) before
+   parsing.
+   '''
+   global _parseCache
+   _parseCache = cache
 
 def parse_filter_element( filterStr ):
-   p = ElementParser( filterStr )
-   return p.parse()
+   if _parseCache is not None:
+      elem = _parseCache.get( filterStr )
+      if elem is not None:
+         return elem
+
+   p = SpanParser( filterStr )
+   elem = p.parse()
+   if _parseCache is not None:
+      _parseCache.put( filterStr, elem )
+   return elem
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+import json
+import unittest
+
+import GmailFiltersTestLib # pylint: disable=unused-import
+
+from GmailFilters.Scheduler import Scheduler
+
+try:
+   from googleapiclient.http import HttpMockSequence
+   import GmailFilters.Api as Api
+except ImportError:
+   Api = None
+
+def batch_response( parts ):
+   '''Returns a multipart batch response, from ( status, body ) per request.'''
+   boundary = 'batch_BOUNDARY'
+   lines = []
+   for i, ( status, body ) in enumerate( parts ):
+      body = json.dumps( body ) if body is not None else ''
+      lines += [ '--' + boundary,
+                 'Content-Type: application/http',
+                 'Content-ID: <response-base + %d>' % i,
+                 '',
+                 'HTTP/1.1 %d %s' % ( status, 'OK' if status == 200 else 'Error' ),
+                 'Content-Type: application/json',
+                 'Content-Length: %d' % len( body ),
+                 '',
+                 body ]
+   lines.append( '--' + boundary + '--' )
+   headers = { 'status': '200',
+               'content-type': 'multipart/mixed; boundary=' + boundary }
+   return ( headers, '\r\n'.join( lines ) )
+
+def filter_obj( id_, query ):
+   return { 'id': id_, 'criteria': { 'query': query }, 'action': {} }
+
+def error_body( code, message ):
+   return { 'error': { 'code': code, 'message': message } }
+
+@unittest.skipIf( Api is None, "Google API client is not installed" )
+class ReplaceFiltersTest( unittest.TestCase ):
+   def service( self, responses, **schedulerArgs ):
+      self.http = HttpMockSequence( responses )
+      self.now = 0.0
+      self.sleeps = []
+      def sleep( seconds ):
+         self.sleeps.append( seconds )
+         self.now += seconds
+      return Api.Service( self.http,
+                          scheduler=Scheduler( clock=lambda: self.now, sleep=sleep,
+                                               seed=1, **schedulerArgs ) )
+
+   def testBatches( self ):
+      filters = [ filter_obj( 'f%d' % i, 'q%d' % i ) for i in range( 3 ) ]
+      service = self.service( [
+         # Creates and deletes of the first two filters
+         batch_response( [ ( 200, filter_obj( 'n0', 'q0' ) ),
+                           ( 200, filter_obj( 'n1', 'q1' ) ) ] ),
+         batch_response( [ ( 204, None ), ( 204, None ) ] ),
+         # Then of the last one
+         batch_response( [ ( 200, filter_obj( 'n2', 'q2' ) ) ] ),
+         batch_response( [ ( 204, None ) ] ),
+      ] )
+      results = service.replace_filters( filters, batchSize=2 )
+      self.assertEqual( [ r.created[ 'id' ] for r in results ], [ 'n0', 'n1', 'n2' ] )
+      self.assertTrue( all( r.ok() and r.deleted for r in results ) )
+      self.assertEqual( [ r.oldId for r in results ], [ 'f0', 'f1', 'f2' ] )
+      self.assertEqual( len( self.http._iterable ), 0 )
+
+   def testFailedCreateKeepsOldFilter( self ):
+      filters = [ filter_obj( 'f%d' % i, 'q%d' % i ) for i in range( 3 ) ]
+      service = self.service( [
+         batch_response( [ ( 200, filter_obj( 'n0', 'q0' ) ),
+                           ( 400, error_body( 400, 'Bad query' ) ),
+                           ( 200, filter_obj( 'n2', 'q2' ) ) ] ),
+         # Only the created filters are deleted, and one of those fails
+         batch_response( [ ( 204, None ),
+                           ( 404, error_body( 404, 'Not Found' ) ) ] ),
+      ] )
+      results = service.replace_filters( filters, batchSize=3 )
+      self.assertEqual( [ r.ok() for r in results ], [ True, False, False ] )
+      self.assertEqual( [ r.deleted for r in results ], [ True, False, False ] )
+      self.assertIsNone( results[ 1 ].created )
+      self.assertIn( 'Bad query', str( results[ 1 ].error ) )
+      # Created, but the old version could not be deleted
+      self.assertEqual( results[ 2 ].created[ 'id' ], 'n2' )
+      self.assertIn( 'Not Found', str( results[ 2 ].error ) )
+
+   def testFailedBatch( self ):
+      filters = [ filter_obj( 'f0', 'q0' ) ]
+      service = self.service( [ ( { 'status': '503' }, 'Unavailable' ) ], maxRetries=0 )
+      results = service.replace_filters( filters )
+      self.assertFalse( results[ 0 ].ok() )
+      self.assertIsNone( results[ 0 ].created )
+      self.assertFalse( results[ 0 ].deleted )
+
+   def testRetries( self ):
+      filters = [ filter_obj( 'f%d' % i, 'q%d' % i ) for i in range( 3 ) ]
+      service = self.service( [
+         batch_response( [ ( 200, filter_obj( 'n0', 'q0' ) ),
+                           ( 429, error_body( 429, 'Rate Limit Exceeded' ) ),
+                           ( 200, filter_obj( 'n2', 'q2' ) ) ] ),
+         batch_response( [ ( 204, None ),
+                           ( 500, error_body( 500, 'Backend Error' ) ) ] ),
+         # The throttled create and failed delete are retried, in batches
+         # shrunk to one request
+         batch_response( [ ( 200, filter_obj( 'n1', 'q1' ) ) ] ),
+         batch_response( [ ( 204, None ) ] ),
+         batch_response( [ ( 204, None ) ] ),
+      ], baseDelay=1.0 )
+      results = service.replace_filters( filters, batchSize=3 )
+      self.assertTrue( all( r.ok() and r.deleted for r in results ) )
+      self.assertEqual( [ r.created[ 'id' ] for r in results ], [ 'n0', 'n1', 'n2' ] )
+      self.assertEqual( len( self.http._iterable ), 0 )
+      self.assertEqual( ( service.scheduler.retries, service.scheduler.throttles ),
+                        ( 2, 1 ) )
+      self.assertEqual( len( self.sleeps ), 1 )
+      self.assertTrue( 0 <= self.sleeps[ 0 ] <= 1.0 )
+
+   def testRetriedBatch( self ):
+      service = self.service( [
+         ( { 'status': '503' }, 'Unavailable' ),
+         # The creates may have been made, so the filters are listed first
+         ( { 'status': '200' }, json.dumps( { 'filter': [ filter_obj( 'f0', 'q0' ) ] } ) ),
+         batch_response( [ ( 200, filter_obj( 'n0', 'q1' ) ) ] ),
+         batch_response( [ ( 204, None ) ] ),
+      ] )
+      results = service.replace_filters( [ filter_obj( 'f0', 'q1' ) ] )
+      self.assertTrue( results[ 0 ].ok() and results[ 0 ].deleted )
+      self.assertEqual( results[ 0 ].created[ 'id' ], 'n0' )
+      self.assertEqual( len( self.http._iterable ), 0 )
+
+   def testFailedCreateWasMade( self ):
+      filters = [ filter_obj( 'f0', 'q0' ), filter_obj( 'f1', 'q1' ) ]
+      service = self.service( [
+         batch_response( [ ( 200, filter_obj( 'n0', 'q0' ) ),
+                           ( 500, error_body( 500, 'Backend Error' ) ) ] ),
+         batch_response( [ ( 204, None ) ] ),
+         ( { 'status': '200' },
+           json.dumps( { 'filter': [ filter_obj( 'n0', 'q0' ), filter_obj( 'f1', 'q1' ),
+                                     filter_obj( 'n1', 'q1' ) ] } ) ),
+         # The filter the failed create made is not made again
+         batch_response( [ ( 204, None ) ] ),
+      ] )
+      results = service.replace_filters( filters )
+      self.assertTrue( all( r.ok() and r.deleted for r in results ) )
+      self.assertEqual( [ r.created[ 'id' ] for r in results ], [ 'n0', 'n1' ] )
+      self.assertEqual( len( self.http._iterable ), 0 )
+
+   def testRetriesRunOut( self ):
+      service = self.service( [ ( { 'status': '429', 'retry-after': '7' }, '' ) ] * 3,
+                              maxRetries=2 )
+      with self.assertRaises( Exception ) as cm:
+         service.get_filters()
+      self.assertEqual( cm.exception.resp.status, 429 )
+      # Retry-After is waited for before each retry
+      self.assertEqual( self.sleeps, [ 7.0, 7.0 ] )
+
+   def testQuota( self ):
+      service = self.service( [ ( { 'status': '200' }, '{}' ) ] * 4, rate=10, burst=2 )
+      for _ in range( 4 ):
+         service.get_filters()
+      # Each read costs a unit, so after the burst they are 0.1 s apart
+      self.assertEqual( [ round( s, 6 ) for s in self.sleeps ], [ 0.1, 0.1 ] )
+
+   def testDryWrites( self ):
+      service = self.service( [ ( { 'status': '200' },
+                                  json.dumps( filter_obj( 'f0', 'q0' ) ) ) ] )
+      service.dryWrites = True
+      results = service.replace_filters( [ filter_obj( 'f0', 'q1' ) ] )
+      self.assertEqual( results[ 0 ].created[ 'id' ], 'f0_FAKE_NEW_ID' )
+      self.assertTrue( results[ 0 ].ok() )
+
+@unittest.skipIf( Api is None, "Google API client is not installed" )
+class ServiceTest( unittest.TestCase ):
+   def testBundledDiscoveryDoc( self ):
+      doc = json.loads( Api.bundled_discovery_doc() )
+      self.assertEqual( ( doc[ 'name' ], doc[ 'version' ] ), ( 'gmail', 'v1' ) )
+      http = HttpMockSequence( [
+         ( { 'status': '200' }, json.dumps( { 'emailAddress': 'me@x.com' } ) ),
+         ( { 'status': '200' }, json.dumps( { 'labels': [ { 'id': 'L1' } ] } ) ),
+         ( { 'status': '200' }, json.dumps( { 'filter': [ filter_obj( 'f0', 'q' ) ] } ) ),
+      ] )
+      service = Api.Service( http )
+      self.assertEqual( service.get_email_addr(), 'me@x.com' )
+      self.assertEqual( service.get_labels(), [ { 'id': 'L1' } ] )
+      self.assertEqual( service.get_filters(), [ filter_obj( 'f0', 'q' ) ] )
+      self.assertLess( service.buildTime, 1.0 )
+
+if __name__ == '__main__':
+   unittest.main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+import asyncio
+import contextlib
+import io
+import unittest
+
+import GmailFiltersTestLib # pylint: disable=unused-import
+from GmailFilters.AsyncApi import AsyncService, BlockingService, FakeTransport, \
+                                  ApiError
+
+def filter_obj( id_, query ):
+   return { 'id': id_, 'criteria': { 'query': query }, 'action': {} }
+
+def run( coroutine ):
+   with contextlib.redirect_stdout( io.StringIO() ):
+      return asyncio.run( coroutine )
+
+class AsyncServiceTest( unittest.TestCase ):
+   def testReads( self ):
+      transport = FakeTransport( 'me@x.com', filters=[ filter_obj( 'f1', 'x' ) ],
+                                 labels=[ { 'id': 'L1', 'name': 'One' } ] )
+      service = AsyncService( transport )
+
+      async def reads():
+         return await asyncio.gather( service.get_email_addr(),
+                                      service.get_labels(),
+                                      service.get_filters(),
+                                      service.get_filter( 'f1' ) )
+      emailAddr, labels, filters, filter_ = run( reads() )
+      self.assertEqual( emailAddr, 'me@x.com' )
+      self.assertEqual( labels, [ { 'id': 'L1', 'name': 'One' } ] )
+      self.assertEqual( filters, [ filter_obj( 'f1', 'x' ) ] )
+      self.assertEqual( filter_, filter_obj( 'f1', 'x' ) )
+
+      with self.assertRaises( ApiError ) as cm:
+         run( service.get_filter( 'missing' ) )
+      self.assertEqual( cm.exception.status, 404 )
+
+   def testReplaceFilters( self ):
+      filters = [ filter_obj( 'f%d' % i, 'q%d' % i ) for i in range( 20 ) ]
+      transport = FakeTransport( filters=filters, latency=0.001 )
+      service = AsyncService( transport )
+      newFilters = [ filter_obj( f[ 'id' ], f[ 'criteria' ][ 'query' ] + '!' )
+                     for f in filters ]
+      # Filters without criteria are rejected
+      newFilters[ 3 ][ 'criteria' ] = {}
+
+      results = run( service.replace_filters( newFilters, concurrency=5 ) )
+      self.assertEqual( [ r.oldId for r in results ], [ f[ 'id' ] for f in filters ] )
+      self.assertEqual( [ r.ok() for r in results ],
+                        [ i != 3 for i in range( 20 ) ] )
+      self.assertEqual( transport.maxInFlight, 5 )
+      # The old version of the failed filter is kept
+      self.assertEqual( sorted( f[ 'criteria' ][ 'query' ]
+                                for f in transport.filters.values() ),
+                        sorted( [ 'q%d!' % i for i in range( 20 ) if i != 3 ] +
+                                [ 'q3' ] ) )
+
+   def testManyAccounts( self ):
+      transports = [ FakeTransport( 'u%d@x.com' % i, latency=0.01 )
+                     for i in range( 50 ) ]
+      services = [ AsyncService( t ) for t in transports ]
+
+      async def fetch():
+         return await asyncio.gather( *[ s.get_email_addr() for s in services ] )
+      self.assertEqual( run( fetch() ), [ 'u%d@x.com' % i for i in range( 50 ) ] )
+
+   def testBlockingService( self ):
+      transport = FakeTransport( filters=[ filter_obj( 'f1', 'x' ) ] )
+      service = BlockingService( AsyncService( transport, dryWrites=True ) )
+      with contextlib.redirect_stdout( io.StringIO() ):
+         results = service.replace_filters( service.get_filters() )
+      self.assertEqual( results[ 0 ].created[ 'id' ], 'f1_FAKE_NEW_ID' )
+      self.assertEqual( list( transport.filters ), [ 'f1' ] )
+      service.close()
+
+if __name__ == '__main__':
+   unittest.main()
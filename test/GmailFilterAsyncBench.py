@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+import asyncio
+import contextlib
+import io
+import time
+
+from GmailFiltersBenchLib import gen_queries, print_row
+from GmailFilters.AsyncApi import AsyncService, FakeTransport
+
+LATENCY = 0.02
+
+def accounts( numAccounts, numFilters ):
+   queries = gen_queries( numFilters, depth=2 )
+   return [ AsyncService( FakeTransport( 'user%d@example.com' % i,
+                                         filters=[ { 'id': 'f%d' % j,
+                                                     'criteria': { 'query': q } }
+                                                   for j, q in enumerate( queries ) ],
+                                         latency=LATENCY ) )
+            for i in range( numAccounts ) ]
+
+async def replace_all( services, concurrency ):
+   async def replace( service ):
+      filters = await service.get_filters()
+      return await service.replace_filters( filters, concurrency=concurrency )
+   return await asyncio.gather( *[ replace( s ) for s in services ] )
+
+def main():
+   print( "Replacing every filter, with %d ms per request" % ( LATENCY * 1000 ) )
+   print_row( 'accounts x filters', 'concurrency', 'requests', 'seconds', 'req/s' )
+   for numAccounts, numFilters, concurrency in [ ( 1, 100, 1 ), ( 1, 100, 10 ),
+                                                 ( 1, 100, 50 ), ( 20, 100, 10 ),
+                                                 ( 100, 50, 10 ) ]:
+      services = accounts( numAccounts, numFilters )
+      start = time.perf_counter()
+      with contextlib.redirect_stdout( io.StringIO() ):
+         asyncio.run( replace_all( services, concurrency ) )
+      elapsed = time.perf_counter() - start
+      requests = sum( s.transport.requests for s in services )
+      print_row( '%d x %d' % ( numAccounts, numFilters ), str( concurrency ),
+                 str( requests ), '%.2f' % elapsed, '%.0f' % ( requests / elapsed ) )
+
+if __name__ == '__main__':
+   main()
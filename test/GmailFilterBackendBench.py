@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from GmailFiltersBenchLib import gen_filter_set, scriptPath, print_row
+
+MODES = [
+   ( 'one by one', [ '--batch-size', '1' ] ),
+   ( 'batches of 50', [] ),
+   ( '4 jobs', [ '-j', '4' ] ),
+   ( 'async, 10 jobs', [ '--async', '-j', '10' ] ),
+]
+
+def update_time( storePath, options, modeArgs, env ):
+   '''Returns the wall time of updating every filter of a fresh copy of the
+   store at storePath, through a fake backend with options. Failed updates
+   are included.
+   '''
+   runPath = storePath + '.run'
+   shutil.copy( storePath, runPath )
+   shutil.rmtree( runPath + '.d', ignore_errors=True )
+   start = time.perf_counter()
+   subprocess.run( [ sys.executable, scriptPath, 'update', '-y', '--full',
+                     '--no-color', '--backend', 'fake:%s,%s' % ( runPath, options ) ] +
+                   modeArgs, stdout=subprocess.DEVNULL, env=env, check=False )
+   return time.perf_counter() - start
+
+def main():
+   print( "Updating every filter through a fake backend" )
+   with tempfile.TemporaryDirectory() as homeDir:
+      env = dict( os.environ, HOME=homeDir )
+      for numFilters in [ 100, 500 ]:
+         storePath = os.path.join( homeDir, 'store%d.json' % numFilters )
+         filters, labels = gen_filter_set( numFilters=numFilters, numTemplates=20 )
+         with open( storePath, 'w' ) as f:
+            json.dump( { 'filters': filters, 'labels': labels }, f )
+         print_row( '%d filters' % numFilters, 'no delay s', '20ms s',
+                    '20ms, 5xx s' )
+         for name, modeArgs in MODES:
+            times = [ update_time( storePath, options, modeArgs, env )
+                      for options in ( 'seed=1', 'latency=0.02,jitter=0.01,seed=1',
+                                       'latency=0.02,jitter=0.01,errorRate=0.05,'
+                                       'seed=1' ) ]
+            print_row( name, *[ '%.2f' % t for t in times ] )
+
+if __name__ == '__main__':
+   main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+import random
+import unittest
+
+import GmailFiltersTestLib # pylint: disable=unused-import
+from GmailFilters import parse_filter_element
+from GmailFilters.Dedup import subtree_table, repeated_subexpressions, \
+                               extract_templates
+from GmailFilters.Template import update_all_meta_groups, TemplateError
+from GmailFiltersBenchLib import gen_query
+
+def parse_all( queryById ):
+   return { id_: parse_filter_element( q ) for id_, q in queryById.items() }
+
+class SubtreeTableTest( unittest.TestCase ):
+   def testWhitespaceIgnored( self ):
+      table = subtree_table( parse_all( {
+         'a': '{from:x  subject:y}',
+         'b': ' { from:x subject:y } ',
+         'c': '{subject:y from:x}',
+      } ) )
+      self.assertEqual( table.roots[ 'a' ], table.roots[ 'b' ] )
+      self.assertNotEqual( table.roots[ 'a' ], table.roots[ 'c' ] )
+      self.assertEqual( table.text( table.roots[ 'b' ] ), '{from:x subject:y}' )
+
+   def testShared( self ):
+      table = subtree_table( parse_all( {
+         'a': '(x {y z}) w',
+         'b': 'v (x {y z})',
+      } ) )
+      group = table.lookup( parse_filter_element( '(x {y z})' ).subElems[ 0 ] )
+      self.assertEqual( table.counts[ group ], 2 )
+      self.assertEqual( table.sizes[ group ], len( '(x {y z})' ) )
+      # x, y, z, {y z} and (x {y z}) are stored once
+      self.assertEqual( len( table.nodes ), 9 )
+      self.assertEqual( table.total_nodes(), 14 )
+
+   def testRandomTexts( self ):
+      rng = random.Random( 3 )
+      for _ in range( 200 ):
+         query = gen_query( rng, 2, 3 )
+         table = subtree_table( parse_all( { 'q': query } ) )
+         rootId = table.roots[ 'q' ]
+         self.assertEqual( table.text( rootId ), ' '.join( query.split() ) )
+         self.assertEqual( table.sizes[ rootId ], len( table.text( rootId ) ) )
+
+class RepeatTest( unittest.TestCase ):
+   QUERIES = {
+      'a': '{from:alice from:bob from:carol} subject:x',
+      'b': 'subject:y {from:alice from:bob from:carol}',
+      'c': '({from:alice from:bob from:carol} -is:chat)',
+      'd': '{from:dave from:erin} list:z',
+   }
+
+   def testRanked( self ):
+      table = subtree_table( parse_all( self.QUERIES ) )
+      repeats = repeated_subexpressions( table, minSize=10 )
+      self.assertEqual( [ r.text for r in repeats ],
+                        [ '{from:alice from:bob from:carol}' ] )
+      self.assertEqual( repeats[ 0 ].count, 3 )
+      self.assertEqual( sorted( repeats[ 0 ].filterIds ), [ 'a', 'b', 'c' ] )
+      self.assertEqual( repeats[ 0 ].score(), 32 * 3 )
+
+      self.assertEqual( repeated_subexpressions( table, minCount=4 ), [] )
+      self.assertEqual( repeated_subexpressions( table, minSize=40 ), [] )
+
+   def testCoveredDropped( self ):
+      table = subtree_table( parse_all( {
+         'a': '(a1 {b1 b2 b3} a2 a3)',
+         'b': '(a1 {b1 b2 b3} a2 a3)',
+         'c': '{b1 b2 b3} c1',
+      } ) )
+      repeats = repeated_subexpressions( table, minSize=5 )
+      self.assertEqual( [ ( r.text, r.count ) for r in repeats ],
+                        [ ( '(a1 {b1 b2 b3} a2 a3)', 2 ) ] )
+
+      table = subtree_table( parse_all( {
+         'a': '(a1 {b1 b2 b3} a2 a3)',
+         'b': '(a1 {b1 b2 b3} a2 a3)',
+         'c': '{b1 b2 b3} c1',
+         'd': '{b1 b2 b3} d1',
+      } ) )
+      repeats = repeated_subexpressions( table, minSize=5 )
+      self.assertEqual( [ ( r.text, r.count ) for r in repeats ],
+                        [ ( '(a1 {b1 b2 b3} a2 a3)', 2 ), ( '{b1 b2 b3}', 2 ) ] )
+
+   def testTemplatesSkipped( self ):
+      table = subtree_table( parse_all( {
+         'p': '{(M3TAP t) from:alice from:bob}',
+         'a': '{(M3TA t) from:alice from:bob} x',
+         'b': 'y {(M3TA t) from:alice from:bob}',
+      } ) )
+      self.assertEqual( repeated_subexpressions( table, minSize=1 ), [] )
+
+class ExtractTest( unittest.TestCase ):
+   def testExtract( self ):
+      filterElemById = parse_all( RepeatTest.QUERIES )
+      table = subtree_table( filterElemById )
+      repeats = repeated_subexpressions( table, minSize=10 )
+      primaries, changedIds = extract_templates( filterElemById, table,
+                                                 [ ( 'friends', repeats[ 0 ].id ) ] )
+      self.assertEqual( primaries, {
+         'friends': '{(M3TAP friends) from:alice from:bob from:carol}' } )
+      self.assertEqual( sorted( changedIds ), [ 'a', 'b', 'c' ] )
+      self.assertEqual( filterElemById[ 'b' ].full_filter_str(),
+                        'subject:y {(M3TA friends) from:alice from:bob from:carol}' )
+      self.assertEqual( filterElemById[ 'c' ].full_filter_str(),
+                        '({(M3TA friends) from:alice from:bob from:carol} -is:chat)' )
+      self.assertEqual( filterElemById[ 'd' ].full_filter_str(),
+                        RepeatTest.QUERIES[ 'd' ] )
+
+   def testUpdateIsNoop( self ):
+      rng = random.Random( 5 )
+      shared = [ gen_query( rng, 1, 3 ) for _ in range( 3 ) ]
+      queries = {}
+      for i in range( 30 ):
+         members = [ gen_query( rng, 1, 2 ), '(%s)' % rng.choice( shared ) ]
+         rng.shuffle( members )
+         queries[ 'f%d' % i ] = ' '.join( members )
+      filterElemById = parse_all( queries )
+      table = subtree_table( filterElemById )
+      repeats = repeated_subexpressions( table, minSize=1 )
+      self.assertTrue( repeats )
+      extractions = [ ( 'n%d' % i, r.id ) for i, r in enumerate( repeats[ :3 ] ) ]
+      primaries, _ = extract_templates( filterElemById, table, extractions )
+
+      rewritten = { id_: e.full_filter_str() for id_, e in filterElemById.items() }
+      for name, primary in primaries.items():
+         rewritten[ name ] = primary
+      updated = parse_all( rewritten )
+      update_all_meta_groups( updated )
+      self.assertEqual( { id_: e.full_filter_str() for id_, e in updated.items() },
+                        rewritten )
+
+   def testBadNames( self ):
+      filterElemById = parse_all( {
+         'p': '{(M3TAP taken) x}',
+         'a': '{from:alice from:bob} x',
+         'b': '{from:alice from:bob} y',
+      } )
+      table = subtree_table( filterElemById )
+      repeatId = repeated_subexpressions( table )[ 0 ].id
+      for name in ( 'taken', 'M3TA', 'two words', '(x)' ):
+         self.assertRaises( TemplateError, extract_templates, filterElemById,
+                            table, [ ( name, repeatId ) ] )
+
+if __name__ == '__main__':
+   unittest.main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+import contextlib
+import io
+import random
+
+from GmailFiltersBenchLib import gen_template_queries, best_time, print_row
+from GmailFilters import parse_filter_element
+from GmailFilters.Labels import LabelCache
+from GmailFilters.Printer import Printer
+from GmailFilters.Template import update_all_meta_groups
+
+class FakeService( object ):
+   def label_cache( self ):
+      return LabelCache.from_labels( [] )
+
+def update_pairs( numFilters ):
+   '''Returns the ( filter, new filter ) pairs of an update after one word of
+   a template's primary changed, and the parsed new queries, by id.
+   '''
+   rng = random.Random( 0 )
+   queries = gen_template_queries( rng, numFilters, 10, depth=3, width=4 )
+   elems = { id_: parse_filter_element( q ) for id_, q in queries.items() }
+   update_all_meta_groups( elems )
+   expanded = { id_: e.full_filter_str() for id_, e in elems.items() }
+
+   primary = expanded[ 'p0' ]
+   elems = { id_: parse_filter_element( q ) for id_, q in expanded.items() }
+   elems[ 'p0' ] = parse_filter_element( primary[ :-1 ] + ' from:new@example.com}' )
+   update_all_meta_groups( elems )
+   pairs = []
+   for id_, e in elems.items():
+      newQuery = e.full_filter_str()
+      if newQuery != expanded[ id_ ] and id_ != 'p0':
+         pairs.append( ( { 'id': id_, 'criteria': { 'query': expanded[ id_ ] },
+                           'action': {} },
+                         { 'id': id_, 'criteria': { 'query': newQuery },
+                           'action': {} } ) )
+   return pairs, elems
+
+def render_time( pairs, elems, diff ):
+   printer = Printer( FakeService(), False, diff=diff )
+   out = io.StringIO()
+   def render():
+      out.seek( 0 )
+      out.truncate()
+      with contextlib.redirect_stdout( out ):
+         printer.print_changes( pairs, queryElemById=elems )
+   return best_time( render, repeat=3 ), len( out.getvalue() )
+
+def main():
+   print( "Rendering the preview of an update after a template changed" )
+   print_row( 'filters changed', 'lines ms', 'tree ms', 'summary ms',
+              'lines KB', 'tree KB', 'summary KB' )
+   for numFilters in [ 100, 1000, 5000 ]:
+      pairs, elems = update_pairs( numFilters )
+      times = []
+      sizes = []
+      for diff in ( 'lines', 'tree', 'summary' ):
+         elapsed, size = render_time( pairs, elems, diff )
+         times.append( '%.1f' % ( elapsed * 1000 ) )
+         sizes.append( '%.0f' % ( size / 1024.0 ) )
+      print_row( str( len( pairs ) ), *( times + sizes ) )
+
+if __name__ == '__main__':
+   main()
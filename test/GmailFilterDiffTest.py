@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+import contextlib
+import io
+import random
+import unittest
+
+import GmailFiltersTestLib # pylint: disable=unused-import
+from GmailFilters import parse_filter_element
+from GmailFilters.Diff import TreeDiff, summarize, summary_lines, DELETE, INSERT
+from GmailFilters.Labels import LabelCache
+from GmailFilters.Printer import Printer
+from GmailFilters.Template import update_all_meta_groups
+from GmailFiltersBenchLib import gen_query
+
+def render( old, new ):
+   return TreeDiff.from_queries( old, new ).render()
+
+class FakeService( object ):
+   def label_cache( self ):
+      return LabelCache.from_labels( [ { 'id': 'L1', 'name': 'One' } ] )
+
+class TreeDiffTest( unittest.TestCase ):
+   def testRender( self ):
+      self.assertEqual( render( 'a b c', 'a b c' ), 'a b c' )
+      self.assertEqual( render( 'a b c', 'a x c' ), 'a [-b-][+x+] c' )
+      self.assertEqual( render( 'a c', 'a b c' ), 'a [+b+] c' )
+      self.assertEqual( render( 'a (b {c d}) e', 'a (b {c x}) e' ),
+                        'a (b {c [-d-][+x+]}) e' )
+      # Groups with other delimiters are not compared inside
+      self.assertEqual( render( '(x y)', '{x y}' ), '[-(x y)-][+{x y}+]' )
+      self.assertEqual( render( '"a b" c', '"a x" c' ), '[-"a b"-][+"a x"+] c' )
+      # Reordered siblings are kept apart
+      self.assertEqual( render( 'a b', 'b a' ), '[+b+] a [-b-]' )
+      self.assertEqual( render( 'x (a b c)', 'x (c a b)' ), 'x ([+c+] a b [-c-])' )
+
+   def testReconstructs( self ):
+      rng = random.Random( 4 )
+      for _ in range( 200 ):
+         old = gen_query( rng, 3, 3 )
+         new = gen_query( rng, 3, 3 ) if rng.random() < 0.3 else \
+               old.replace( rng.choice( [ 'alpha', 'news', 'jira' ] ), 'zzz' )
+         diff = TreeDiff.from_queries( old, new )
+         self.assertEqual( ''.join( t for k, t in diff.segments if k != DELETE ), new )
+         # Whitespace around changed groups is the new query's
+         self.assertEqual( ''.join( t for k, t in diff.segments
+                                    if k != INSERT ).replace( ' ', '' ),
+                           old.replace( ' ', '' ) )
+         self.assertEqual( diff.changed(), old != new )
+
+   def testParsedNewQuery( self ):
+      new = parse_filter_element( 'a (b {c x}) e' )
+      diff = TreeDiff( 'a (b {c d}) e', new )
+      self.assertEqual( diff.render(), 'a (b {c [-d-][+x+]}) e' )
+      self.assertEqual( diff.hunks, [ ( None, 'd', 'x' ) ] )
+      self.assertEqual( TreeDiff( 'a  b', parse_filter_element( 'a b' ) ).hunks, [] )
+
+   def testTemplateHunks( self ):
+      queries = {
+         'p': '{(M3TAP t) from:a from:b}',
+         'f1': 'x {(M3TA t) from:a}',
+         'f2': '{(M3TA t) from:a} y',
+         'f3': 'z {(M3TA t) from:a}',
+      }
+      filterElemById = { id_: parse_filter_element( q ) for id_, q in queries.items() }
+      update_all_meta_groups( filterElemById )
+      diffs = { id_: TreeDiff.from_queries( queries[ id_ ],
+                                            filterElemById[ id_ ].full_filter_str() )
+                for id_ in ( 'f1', 'f2', 'f3' ) }
+      self.assertEqual( diffs[ 'f1' ].hunks, [ ( ( 't', ), '', 'from:b' ) ] )
+
+      groups = summarize( diffs )
+      self.assertEqual( len( groups ), 1 )
+      hunks, filterIds = groups[ 0 ]
+      self.assertEqual( sorted( filterIds ), [ 'f1', 'f2', 'f3' ] )
+      self.assertEqual( summary_lines( hunks, filterIds ),
+                        [ 'template t changed in 3 filters: f1, f2, f3',
+                          '  + from:b' ] )
+
+class PrinterDiffTest( unittest.TestCase ):
+   def output( self, diff, pairs, queryElemById=None ):
+      printer = Printer( FakeService(), False, diff=diff )
+      out = io.StringIO()
+      with contextlib.redirect_stdout( out ):
+         printer.print_changes( pairs, queryElemById=queryElemById )
+      return out.getvalue()
+
+   def testModes( self ):
+      pairs = []
+      for i in range( 3 ):
+         old = { 'id': 'f%d' % i, 'criteria': { 'query': 'a b%d c' % i },
+                 'action': { 'addLabelIds': [ 'L1' ] } }
+         new = { 'id': 'f%d' % i, 'criteria': { 'query': 'a b%d d' % i },
+                 'action': { 'addLabelIds': [ 'L1' ] } }
+         pairs.append( ( old, new ) )
+
+      lines = self.output( 'lines', pairs )
+      self.assertIn( '-  query: a b0 c\n+  query: a b0 d\n', lines )
+      self.assertIn( '  -> addLabelIds: One', lines )
+
+      tree = self.output( 'tree', pairs )
+      self.assertIn( '~  query: a b1 [-c-][+d+]\n', tree )
+
+      # The same change in several filters is shown once
+      summary = self.output( 'summary', pairs )
+      self.assertEqual( summary, '3 filters changed: f0, f1, f2\n  - c\n  + d\n\n' )
+
+      # Filters with other changes are printed in full
+      pairs[ 0 ][ 1 ][ 'action' ] = { 'addLabelIds': [ 'L2' ] }
+      summary = self.output( 'summary', pairs )
+      self.assertIn( 'Filter f0:', summary )
+      self.assertIn( '2 filters changed: f1, f2', summary )
+
+   def testParsedQueries( self ):
+      old = { 'id': 'f', 'criteria': { 'query': 'a {b c}' }, 'action': {} }
+      new = { 'id': 'f', 'criteria': { 'query': 'a {b d}' }, 'action': {} }
+      elem = parse_filter_element( 'a {b d}' )
+      tree = self.output( 'tree', [ ( old, new ) ], queryElemById={ 'f': elem } )
+      self.assertIn( '~  query: a {b [-c-][+d+]}\n', tree )
+      # A parsed query which is out of date is not used
+      tree = self.output( 'tree', [ ( old, new ) ],
+                          queryElemById={ 'f': parse_filter_element( 'x' ) } )
+      self.assertIn( '~  query: a {b [-c-][+d+]}\n', tree )
+
+if __name__ == '__main__':
+   unittest.main()
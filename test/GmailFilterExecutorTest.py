@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+import threading
+import time
+import unittest
+
+import GmailFiltersTestLib # pylint: disable=unused-import
+from GmailFilters.Executor import ConcurrentWriter
+from GmailFilters.Write import FilterWriteResult
+
+class FakeService( object ):
+   '''Replaces filters one at a time, logging each write.'''
+   def __init__( self, log ):
+      self.log = log
+      self.thread = threading.current_thread()
+      self.batchSizes = []
+
+   def replace_filters( self, filterObjs, batchSize=50, journal=None ):
+      assert threading.current_thread() is self.thread
+      self.batchSizes.append( batchSize )
+      results = []
+      for filterObj in filterObjs:
+         result = FilterWriteResult( filterObj )
+         query = filterObj[ 'criteria' ][ 'query' ]
+         if query == 'crash':
+            raise RuntimeError( 'Connection lost' )
+         if query == 'bad':
+            result.error = 'Bad query'
+         else:
+            self.log.append( ( 'create', result.oldId ) )
+            # Give the other workers a chance to run in between
+            time.sleep( 0.001 )
+            result.created = dict( filterObj, id=result.oldId + '_new' )
+            self.log.append( ( 'delete', result.oldId ) )
+            result.deleted = True
+         results.append( result )
+      return results
+
+def filter_obj( id_, query='q' ):
+   return { 'id': id_, 'criteria': { 'query': query } }
+
+class ConcurrentWriterTest( unittest.TestCase ):
+   def testReplaceFilters( self ):
+      log = []
+      writer = ConcurrentWriter( lambda: FakeService( log ), 4 )
+      filters = [ filter_obj( 'f%d' % i ) for i in range( 40 ) ]
+      results = writer.replace_filters( filters, batchSize=1 )
+
+      self.assertEqual( [ r.oldId for r in results ], [ f[ 'id' ] for f in filters ] )
+      self.assertTrue( all( r.ok() and r.deleted for r in results ) )
+      for f in filters:
+         self.assertLess( log.index( ( 'create', f[ 'id' ] ) ),
+                          log.index( ( 'delete', f[ 'id' ] ) ) )
+      # Each worker has its own service
+      self.assertLessEqual( len( writer.services ), 4 )
+      self.assertEqual( len( set( s.thread for s in writer.services ) ),
+                        len( writer.services ) )
+
+   def testChunks( self ):
+      writer = ConcurrentWriter( lambda: FakeService( [] ), 4 )
+      self.assertEqual( writer.chunk_size( 10, 50 ), 3 )
+      self.assertEqual( writer.chunk_size( 1000, 50 ), 50 )
+      self.assertEqual( writer.chunk_size( 1000, 1 ), 1 )
+      self.assertEqual( writer.chunk_size( 0, 50 ), 1 )
+
+      writer.replace_filters( [ filter_obj( 'f%d' % i ) for i in range( 10 ) ],
+                              batchSize=50 )
+      sizes = [ size for s in writer.services for size in s.batchSizes ]
+      self.assertEqual( sizes, [ 3 ] * 4 )
+
+   def testFailures( self ):
+      writer = ConcurrentWriter( lambda: FakeService( [] ), 3 )
+      filters = [ filter_obj( 'f0' ), filter_obj( 'f1', 'bad' ),
+                  filter_obj( 'f2' ), filter_obj( 'f3', 'crash' ) ]
+      results = writer.replace_filters( filters, batchSize=1 )
+      self.assertEqual( [ r.ok() for r in results ], [ True, False, True, False ] )
+      self.assertEqual( results[ 1 ].error, 'Bad query' )
+      self.assertIsInstance( results[ 3 ].error, RuntimeError )
+
+if __name__ == '__main__':
+   unittest.main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import GmailFiltersTestLib # pylint: disable=unused-import
+from GmailFiltersBenchLib import gen_filter_set, scriptPath
+from GmailFilters.AsyncApi import AsyncService, FakeTransport, ApiError
+from GmailFilters.FakeBackend import FakeGmail, FakeHttp, BackendError, parse_spec
+
+try:
+   from googleapiclient.errors import HttpError
+   import GmailFilters.Api as Api
+except ImportError:
+   Api = None
+
+def filter_obj( id_, query ):
+   return { 'id': id_, 'criteria': { 'query': query }, 'action': {} }
+
+class FakeBackendTest( unittest.TestCase ):
+   def setUp( self ):
+      self.tmpDir = tempfile.mkdtemp()
+      self.path = os.path.join( self.tmpDir, 'store.json' )
+
+   def tearDown( self ):
+      shutil.rmtree( self.tmpDir )
+
+   def testSpec( self ):
+      self.assertEqual( parse_spec( 'fake:a.json' ), ( 'a.json', {} ) )
+      self.assertEqual( parse_spec( 'fake:a.json,latency=0.5,seed=3' ),
+                        ( 'a.json', { 'latency': 0.5, 'seed': 3 } ) )
+      for spec in [ 'gmail:x', 'fake:', 'fake:a.json,speed=1', 'fake:a.json,seed=x' ]:
+         self.assertRaises( BackendError, parse_spec, spec )
+
+   def testStore( self ):
+      gmail = FakeGmail.load( self.path )
+      self.assertEqual( gmail.filters, {} )
+      gmail.respond( 'POST', 'settings/filters', { 'criteria': { 'query': 'x' } } )
+      gmail.save()
+
+      gmail = FakeGmail.from_spec( 'fake:%s,latency=0.25' % self.path )
+      self.assertEqual( list( gmail.filters ), [ 'fake1' ] )
+      self.assertEqual( gmail.delay(), 0.25 )
+      # Ids are not reused
+      status, created, _ = gmail.respond( 'POST', 'settings/filters',
+                                          { 'criteria': { 'query': 'y' } } )
+      self.assertEqual( ( status, created[ 'id' ] ), ( 200, 'fake2' ) )
+      self.assertEqual( gmail.respond( 'DELETE', 'settings/filters/nope' )[ 0 ], 404 )
+
+   def testInjectedErrors( self ):
+      gmail = FakeGmail( rateLimitRate=0.2, errorRate=0.1, retryAfter=3, seed=5,
+                         jitter=0.5 )
+      statuses = {}
+      for _ in range( 2000 ):
+         status, _, headers = gmail.respond( 'GET', 'settings/filters' )
+         statuses[ status ] = statuses.get( status, 0 ) + 1
+         if status == 429:
+            self.assertEqual( headers, { 'retry-after': '3' } )
+      self.assertAlmostEqual( statuses[ 429 ] / 2000.0, 0.2, delta=0.03 )
+      self.assertAlmostEqual( ( statuses[ 500 ] + statuses[ 503 ] ) / 2000.0, 0.1,
+                              delta=0.03 )
+      self.assertEqual( gmail.injectedErrors, 2000 - statuses[ 200 ] )
+      self.assertTrue( all( 0 <= gmail.delay() <= 0.5 for _ in range( 100 ) ) )
+
+   @unittest.skipIf( Api is None, "Google API client is not installed" )
+   def testService( self ):
+      gmail = FakeGmail( 'me@x.com', filters=[ filter_obj( 'f1', 'x' ),
+                                              filter_obj( 'f2', 'y' ) ],
+                         labels=[ { 'id': 'L1', 'name': 'One' } ] )
+      service = Api.Service( FakeHttp( gmail ) )
+      self.assertEqual( service.get_email_addr(), 'me@x.com' )
+      self.assertEqual( service.get_labels(), gmail.labels )
+      self.assertEqual( service.get_filter( 'f1' ), filter_obj( 'f1', 'x' ) )
+      self.assertEqual( len( service.get_filters() ), 2 )
+
+      # Batched replaces
+      results = service.replace_filters( [ filter_obj( 'f1', 'x2' ),
+                                           filter_obj( 'f2', 'y2' ) ] )
+      self.assertTrue( all( r.ok() and r.deleted for r in results ) )
+      self.assertEqual( sorted( f[ 'criteria' ][ 'query' ]
+                                for f in gmail.filters.values() ), [ 'x2', 'y2' ] )
+
+      # Each request of a batch fails on its own
+      gmail.rateLimitRate = 1.0
+      gmail.retryAfter = 2
+      results = service.replace_filters( list( gmail.filters.values() ) )
+      for result in results:
+         self.assertIsInstance( result.error, HttpError )
+         self.assertEqual( result.error.resp.status, 429 )
+         self.assertEqual( result.error.resp[ 'retry-after' ], '2' )
+      self.assertEqual( len( gmail.filters ), 2 )
+
+   def testAsyncService( self ):
+      gmail = FakeGmail( filters=[ filter_obj( 'f1', 'x' ) ] )
+      service = AsyncService( FakeTransport( gmail=gmail ) )
+      loop = asyncio.new_event_loop()
+      try:
+         results = loop.run_until_complete(
+               service.replace_filters( [ filter_obj( 'f1', 'z' ) ] ) )
+         self.assertTrue( results[ 0 ].ok() )
+         self.assertEqual( [ f[ 'criteria' ][ 'query' ] for f in gmail.filters.values() ],
+                           [ 'z' ] )
+         gmail.errorRate = 1.0
+         self.assertRaises( ApiError, loop.run_until_complete, service.get_filters() )
+      finally:
+         loop.close()
+
+class FakeBackendCommandTest( unittest.TestCase ):
+   def setUp( self ):
+      self.homeDir = tempfile.mkdtemp()
+      self.env = dict( os.environ, HOME=self.homeDir )
+      self.path = os.path.join( self.homeDir, 'store.json' )
+      filters, labels = gen_filter_set( numFilters=30, numTemplates=3 )
+      with open( self.path, 'w' ) as f:
+         json.dump( { 'emailAddr': 'load@example.com', 'filters': filters,
+                      'labels': labels }, f )
+
+   def tearDown( self ):
+      shutil.rmtree( self.homeDir )
+
+   def run_cmd( self, *cmdArgs ):
+      return subprocess.run( [ sys.executable, scriptPath ] + list( cmdArgs ),
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             universal_newlines=True, env=self.env, check=True )
+
+   def testUpdate( self ):
+      for extraArgs in ( [], [ '--async', '-j', '3' ] ):
+         self.run_cmd( 'update', '-y', '--full', '--no-color', '--minimize',
+                       '--backend', 'fake:%s,latency=0.001' % self.path, *extraArgs )
+      with open( self.path ) as f:
+         store = json.load( f )
+      self.assertEqual( len( store[ 'filters' ] ), 30 )
+      self.assertTrue( any( f[ 'id' ].startswith( 'fake' ) for f in store[ 'filters' ] ) )
+
+      output = self.run_cmd( 'update', '-y', '-v', '--backend', 'fake:' + self.path )
+      self.assertIn( 'No updates to be made', output.stdout )
+      # The account files of the fake backend are kept beside its store
+      self.assertTrue( os.path.isdir( self.path + '.d' ) )
+      self.assertFalse( os.path.exists( os.path.join( self.homeDir, '.gmail_filters',
+                                                      'last_account' ) ) )
+
+   def testUpdateTemplateError( self ):
+      with open( self.path, 'w' ) as f:
+         json.dump( { 'emailAddr': 'load@example.com', 'labels': [],
+                      'filters': [ { 'id': 'f1', 'criteria': { 'query': '{(M3TA) x}' },
+                                     'action': {} } ] }, f )
+      for extraArgs in ( [], [ '--full' ] ):
+         output = self.run_cmd( 'update', '--dry-run', '--no-color',
+                                '--backend', 'fake:' + self.path, *extraArgs )
+         self.assertIn( 'Template error: ', output.stdout )
+
+if __name__ == '__main__':
+   unittest.main()
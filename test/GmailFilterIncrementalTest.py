@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from GmailFiltersTestLib import pm, ParserTestBase
+from GmailFiltersBenchLib import gen_template_queries
+from GmailFilters.Incremental import TemplateState, filter_elems_to_update
+from GmailFilters.Template import TemplateError, update_all_meta_groups
+
+class IncrementalTest( ParserTestBase ):
+   def setUp( self ):
+      self.tmpDir = tempfile.mkdtemp()
+      self.statePath = os.path.join( self.tmpDir, 'acct', 'templates.json' )
+
+   def tearDown( self ):
+      shutil.rmtree( self.tmpDir )
+
+   def update( self, queryById, state ):
+      '''Runs an update like update_cmd, and returns the
+      ( { id: new query }, ids that were expanded ).
+      '''
+      filterElems = filter_elems_to_update( queryById, state=state )
+      update_all_meta_groups( filterElems )
+      newQueries = dict( queryById )
+      newQueries.update( { id_: str( e ) for id_, e in filterElems.items() } )
+      if state is not None:
+         state.mark_up_to_date( newQueries.values() )
+         state.save()
+      return newQueries, set( filterElems )
+
+   @pm
+   def testOnlyAffectedExpanded( self ):
+      queries = {
+         'a': '{(M3TAP foo) new}',
+         'b': '{(M3TAP bar) barthing {(M3TA foo) old}}',
+         'c': 'x {(M3TA bar) old}',
+         'd': 'y {(M3TA foo) old}',
+         'e': 'unrelated',
+      }
+      state = TemplateState.load( self.statePath )
+      queries, expanded = self.update( queries, state )
+      self.assertEqual( expanded, set( queries ) )
+      self.assertEqual( queries[ 'c' ],
+                        'x {(M3TA bar) barthing {(M3TA foo) new}}' )
+
+      # Nothing changed
+      state = TemplateState.load( self.statePath )
+      self.assertEqual( self.update( queries, state ), ( queries, set() ) )
+
+      # A change to foo reaches c through bar
+      queries[ 'a' ] = '{(M3TAP foo) newer}'
+      state = TemplateState.load( self.statePath )
+      queries, expanded = self.update( queries, state )
+      self.assertEqual( expanded, set( 'abcd' ) )
+      self.assertEqual( queries[ 'c' ],
+                        'x {(M3TA bar) barthing {(M3TA foo) newer}}' )
+
+      # A changed, non-primary filter is expanded with just its primaries
+      queries[ 'e' ] = 'unrelated {(M3TA bar) x}'
+      state = TemplateState.load( self.statePath )
+      queries, expanded = self.update( queries, state )
+      self.assertEqual( expanded, set( 'abe' ) )
+
+      # Without a state, everything is expanded
+      self.assertEqual( self.update( queries, None ), ( queries, set( queries ) ) )
+
+   @pm
+   def testMatchesFull( self ):
+      rng = random.Random( 5 )
+      queries = gen_template_queries( rng, 40, 6, depth=1 )
+      state = TemplateState.load( self.statePath )
+      queries, _ = self.update( queries, state )
+      for _ in range( 10 ):
+         # Edit a few primaries or references, as a user would in Gmail
+         for id_ in rng.sample( sorted( queries ), 3 ):
+            queries[ id_ ] = queries[ id_ ].replace( 'alpha', 'omega' )
+         expected, _ = self.update( queries, None )
+         state = TemplateState.load( self.statePath )
+         queries, expanded = self.update( queries, state )
+         self.assertEqual( queries, expected )
+         self.assertLess( len( expanded ), len( queries ) )
+
+   @pm
+   def testPrimaryCollision( self ):
+      queries = { 'a': '{(M3TAP foo) new}', 'b': 'x {(M3TA foo) old}' }
+      state = TemplateState.load( self.statePath )
+      queries, _ = self.update( queries, state )
+
+      # A second primary for foo collides with the unchanged first one, as in
+      # a full update
+      queries[ 'c' ] = '{(M3TAP foo) other}'
+      with self.assertRaises( TemplateError ):
+         self.update( queries, None )
+      state = TemplateState.load( self.statePath )
+      with self.assertRaisesRegex( TemplateError, 'collision' ):
+         self.update( queries, state )
+
+   def testBadStateFile( self ):
+      os.makedirs( os.path.dirname( self.statePath ) )
+      with open( self.statePath, 'w' ) as f:
+         f.write( '{not json' )
+      state = TemplateState.load( self.statePath )
+      queries = { 'a': '{(M3TAP foo) new}', 'b': '{(M3TA foo) old}' }
+      newQueries, expanded = self.update( queries, state )
+      self.assertEqual( expanded, set( queries ) )
+      self.assertEqual( newQueries[ 'b' ], '{(M3TA foo) new}' )
+
+if __name__ == '__main__':
+   unittest.main()
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import GmailFiltersTestLib # pylint: disable=unused-import
+from GmailFiltersBenchLib import gen_filter_set, scriptPath
+from GmailFilters.FakeBackend import CRASH_STATUS
+from GmailFilters.Journal import Journal, JournalError
+
+def filter_obj( id_, query ):
+   return { 'id': id_, 'criteria': { 'query': query }, 'action': {} }
+
+OLD_FILTERS = [ filter_obj( 'f%d' % i, 'old%d' % i ) for i in range( 6 ) ]
+NEW_FILTERS = [ filter_obj( 'f%d' % i, 'new%d' % i ) for i in range( 6 ) ]
+CREATES = [ { 'criteria': { 'query': 'added%d' % i }, 'action': {} } for i in range( 3 ) ]
+
+class JournalTest( unittest.TestCase ):
+   def setUp( self ):
+      self.tmpDir = tempfile.mkdtemp()
+      self.path = os.path.join( self.tmpDir, 'journal.jsonl' )
+
+   def tearDown( self ):
+      shutil.rmtree( self.tmpDir )
+
+   def testRecords( self ):
+      self.assertIsNone( Journal.load( self.path ) )
+      journal = Journal.begin( self.path, 'update', NEW_FILTERS,
+                               [ f[ 'id' ] for f in OLD_FILTERS ], creates=CREATES,
+                               saveState=True )
+      journal.added( 1, 'a1' )
+      journal.created( 'f0', 'n0' )
+      journal.deleted( 'f0' )
+      journal.created( 'f1', 'n1' )
+      journal.close()
+      # A record cut short by a crash is ignored
+      with open( self.path, 'a' ) as f:
+         f.write( '{"deleted": "f' )
+
+      journal = Journal.load( self.path )
+      self.assertEqual( journal.command, 'update' )
+      self.assertEqual( journal.info, { 'saveState': True } )
+      self.assertEqual( journal.createdIds, { 'f0': 'n0', 'f1': 'n1' } )
+      self.assertEqual( journal.deletedIds, set( [ 'f0' ] ) )
+      self.assertEqual( journal.pending(), NEW_FILTERS[ 1: ] )
+      self.assertEqual( journal.pending_creates(), [ ( 0, CREATES[ 0 ] ),
+                                                     ( 2, CREATES[ 2 ] ) ] )
+      journal.finish()
+      self.assertFalse( os.path.exists( self.path ) )
+
+      with open( self.path, 'w' ) as f:
+         f.write( '{"version": 99}\n' )
+      self.assertRaises( JournalError, Journal.load, self.path )
+
+   def testReconcile( self ):
+      journal = Journal( self.path, 'replace', NEW_FILTERS,
+                         [ f[ 'id' ] for f in OLD_FILTERS ] + [ 'other' ] )
+      # f0 was replaced, and f1 created, as recorded
+      journal.createdIds = { 'f0': 'n0', 'f1': 'n1' }
+      journal.deletedIds = set( [ 'f0' ] )
+      filters = [
+         filter_obj( 'n0', 'new0' ),
+         filter_obj( 'n1', 'new1' ), OLD_FILTERS[ 1 ],
+         # f2 was created twice, by a request sent again, and not recorded
+         filter_obj( 'n2', 'new2' ), filter_obj( 'n2b', ' new2 ' ), OLD_FILTERS[ 2 ],
+         # f3 was replaced, but neither step recorded
+         filter_obj( 'n3', 'new3' ),
+         OLD_FILTERS[ 4 ],
+         # A filter like new5 which was there before is not taken for it
+         filter_obj( 'other', 'new5' ),
+      ]
+      recovery = journal.reconcile( filters )
+      self.assertEqual( recovery.adopted, { 'f2': 'n2', 'f3': 'n3' } )
+      self.assertEqual( recovery.duplicates, [ 'n2b' ] )
+      self.assertEqual( recovery.deletes, [ 'f1', 'f2' ] )
+      self.assertEqual( recovery.replaces, [ NEW_FILTERS[ 4 ] ] )
+      self.assertEqual( recovery.done, [ 'f3' ] )
+      self.assertEqual( recovery.missing, [ 'f5' ] )
+      self.assertFalse( recovery.empty() )
+
+      # Copies of filters already replaced are duplicates too
+      journal.createdIds[ 'f1' ] = 'n1'
+      recovery = journal.reconcile( [ filter_obj( 'n0', 'new0' ),
+                                      filter_obj( 'n0b', 'new0' ) ] )
+      self.assertEqual( recovery.duplicates, [ 'n0b' ] )
+
+      # New filters made, but not recorded, are found the same way
+      journal = Journal( self.path, 'dedup', [], [ 'f0' ], creates=CREATES )
+      journal.addedIds = { 0: 'a0' }
+      recovery = journal.reconcile( [ dict( CREATES[ 0 ], id='a0' ),
+                                      dict( CREATES[ 1 ], id='a1' ),
+                                      dict( CREATES[ 1 ], id='a1b' ) ] )
+      self.assertEqual( recovery.addedAdopted, { 1: 'a1' } )
+      self.assertEqual( recovery.creates, [ ( 2, CREATES[ 2 ] ) ] )
+      self.assertEqual( recovery.duplicates, [ 'a1b' ] )
+
+class ResumeCommandTest( unittest.TestCase ):
+   def setUp( self ):
+      self.homeDir = tempfile.mkdtemp()
+      self.env = dict( os.environ, HOME=self.homeDir )
+      self.path = os.path.join( self.homeDir, 'store.json' )
+      self.filters, labels = gen_filter_set( numFilters=30, numTemplates=3 )
+      with open( self.path, 'w' ) as f:
+         json.dump( { 'filters': self.filters, 'labels': labels }, f )
+      self.journalPath = os.path.join( self.path + '.d', 'accounts',
+                                       'fake@example.com', 'journal.jsonl' )
+
+   def tearDown( self ):
+      shutil.rmtree( self.homeDir )
+
+   def run_cmd( self, *cmdArgs, **kwargs ):
+      result = subprocess.run( [ sys.executable, scriptPath ] + list( cmdArgs ) +
+                               [ '-y', '--no-color' ],
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                               universal_newlines=True, env=self.env, check=False )
+      self.assertEqual( result.returncode, kwargs.get( 'status', 0 ),
+                        result.stdout + result.stderr )
+      return result.stdout
+
+   def queries( self ):
+      with open( self.path ) as f:
+         return sorted( f[ 'criteria' ].get( 'query', '' )
+                        for f in json.load( f )[ 'filters' ] )
+
+   def testResumeUpdate( self ):
+      for modeArgs in ( [ '--batch-size', '4' ], [ '--async', '-j', '3' ] ):
+         with open( self.path, 'w' ) as f:
+            json.dump( { 'filters': self.filters }, f )
+         self.run_cmd( 'update', '--full', '--minimize', '--backend', 'fake:' + self.path,
+                       *modeArgs )
+         expected = self.queries()
+
+         with open( self.path, 'w' ) as f:
+            json.dump( { 'filters': self.filters }, f )
+         backend = 'fake:%s,crashAfter=9' % self.path
+         self.run_cmd( 'update', '--full', '--minimize', '--backend', backend,
+                       *modeArgs, status=CRASH_STATUS )
+         self.assertTrue( os.path.exists( self.journalPath ) )
+         self.assertNotEqual( self.queries(), expected )
+
+         # Nothing else is changed until the run is finished
+         defsPath = os.path.join( self.homeDir, 'defs.json' )
+         with open( defsPath, 'w' ) as f:
+            json.dump( self.filters, f )
+         for cmdArgs in ( [ 'update' ], [ 'apply', defsPath ],
+                          [ 'dedup', '--extract', 'x', '--label', 'y' ] ):
+            output = self.run_cmd( *cmdArgs, '--backend', 'fake:' + self.path,
+                                   status=1 )
+            self.assertIn( 'Run resume to finish it', output )
+
+         output = self.run_cmd( 'resume', '--backend', 'fake:' + self.path, *modeArgs )
+         self.assertIn( 'Finished the update', output )
+         self.assertEqual( self.queries(), expected )
+         self.assertFalse( os.path.exists( self.journalPath ) )
+         # The template state was saved, as the update would have
+         output = self.run_cmd( 'update', '-v', '--backend', 'fake:' + self.path )
+         self.assertIn( 'Expanding templates in 0 of', output )
+         self.assertIn( 'No interrupted update',
+                        self.run_cmd( 'resume', '--backend', 'fake:' + self.path ) )
+
+   def testResumeDedup( self ):
+      shared = '{from:alerts@example.com from:builds@example.com}'
+      filters = [ { 'id': 'f%d' % i, 'criteria': { 'query': 'subject:(s%d) %s' % ( i, shared ) },
+                    'action': {} } for i in range( 4 ) ]
+      dedupArgs = [ 'dedup', '--extract', 'alerts', '--label', 'One' ]
+      # Interrupted while creating the template filter, and then while
+      # rewriting the filters to use it
+      for crashAfter in ( 1, 3 ):
+         with open( self.path, 'w' ) as f:
+            json.dump( { 'filters': filters, 'labels': [ { 'id': 'L1', 'name': 'One' } ] },
+                       f )
+         self.run_cmd( *dedupArgs, '--backend',
+                       'fake:%s,crashAfter=%d' % ( self.path, crashAfter ),
+                       status=CRASH_STATUS )
+         journal = Journal.load( self.journalPath )
+         self.assertEqual( ( journal.command, len( journal.creates ) ), ( 'dedup', 1 ) )
+
+         output = self.run_cmd( 'resume', '--backend', 'fake:' + self.path )
+         self.assertIn( 'Finished the dedup', output )
+         self.assertFalse( os.path.exists( self.journalPath ) )
+         queries = self.queries()
+         self.assertEqual( len( queries ), 5 )
+         self.assertEqual( sum( '(M3TAP alerts)' in q for q in queries ), 1 )
+         self.assertEqual( sum( '(M3TA alerts)' in q for q in queries ), 4 )
+
+   def testDiscardReplace( self ):
+      backend = 'fake:%s,crashAfter=3' % self.path
+      self.run_cmd( 'replace', 'from:', 'to:', '--batch-size', '1', '--backend', backend,
+                    status=CRASH_STATUS )
+      journal = Journal.load( self.journalPath )
+      self.assertEqual( journal.command, 'replace' )
+      self.assertEqual( journal.createdIds, { journal.filters[ 0 ][ 'id' ]: 'fake1' } )
+      self.assertEqual( journal.deletedIds, set( [ journal.filters[ 0 ][ 'id' ] ] ) )
+
+      self.run_cmd( 'resume', '--discard', '--backend', 'fake:' + self.path )
+      self.assertFalse( os.path.exists( self.journalPath ) )
+      # The half-applied replacement of the second filter is left as it is
+      self.assertEqual( len( self.queries() ), 31 )
+
+if __name__ == '__main__':
+   unittest.main()
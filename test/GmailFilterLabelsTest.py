@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+import contextlib
+import copy
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import GmailFiltersTestLib # pylint: disable=unused-import
+from GmailFilters.Labels import LabelCache
+from GmailFilters.Printer import Printer
+
+LABELS = [ { 'id': 'INBOX', 'name': 'INBOX' },
+           { 'id': 'Label_1', 'name': 'Work' },
+           { 'id': 'Label_2', 'name': 'Work/Builds' } ]
+
+class FakeFetch( object ):
+   def __init__( self, labels ):
+      self.labels = labels
+      self.calls = 0
+
+   def __call__( self ):
+      self.calls += 1
+      return copy.deepcopy( self.labels )
+
+class LabelCacheTest( unittest.TestCase ):
+   def setUp( self ):
+      self.tmpDir = tempfile.mkdtemp()
+      self.path = os.path.join( self.tmpDir, 'labels.json' )
+
+   def tearDown( self ):
+      shutil.rmtree( self.tmpDir )
+
+   def testLookups( self ):
+      fetch = FakeFetch( LABELS )
+      labels = LabelCache( fetch )
+      self.assertEqual( labels.name( 'Label_1' ), 'Work' )
+      self.assertEqual( labels.id_for_name( 'Work/Builds' ), 'Label_2' )
+      ids = [ 'Label_2', 'INBOX' ]
+      self.assertEqual( labels.names( ids ), [ 'Work/Builds', 'INBOX' ] )
+      self.assertEqual( ids, [ 'Label_2', 'INBOX' ] )
+      self.assertEqual( fetch.calls, 1 )
+
+      # An unknown label refetches once, in case it is new
+      fetch.labels = LABELS + [ { 'id': 'Label_3', 'name': 'New' } ]
+      self.assertEqual( labels.name( 'Label_3' ), 'New' )
+      self.assertEqual( labels.name( 'Label_9' ), 'Label_9' )
+      self.assertIsNone( labels.id_for_name( 'Missing' ) )
+      self.assertEqual( fetch.calls, 2 )
+
+   def testPersistence( self ):
+      fetch = FakeFetch( LABELS )
+      self.assertEqual( LabelCache( fetch, self.path ).name( 'Label_1' ), 'Work' )
+      self.assertEqual( fetch.calls, 1 )
+
+      # A later run reads them from disk
+      labels = LabelCache( fetch, self.path )
+      self.assertEqual( labels.name( 'Label_1' ), 'Work' )
+      self.assertEqual( fetch.calls, 1 )
+
+      # Until they are older than the ttl
+      with open( self.path ) as f:
+         obj = json.load( f )
+      obj[ 'fetchedAt' ] = time.time() - 7200
+      with open( self.path, 'w' ) as f:
+         json.dump( obj, f )
+      fetch.labels = [ { 'id': 'Label_1', 'name': 'Renamed' } ]
+      labels = LabelCache( fetch, self.path, ttl=3600 )
+      self.assertEqual( labels.name( 'Label_1' ), 'Renamed' )
+      self.assertEqual( fetch.calls, 2 )
+
+      labels.invalidate()
+      labels.get_labels()
+      self.assertEqual( fetch.calls, 3 )
+
+   def testFromLabels( self ):
+      labels = LabelCache.from_labels( LABELS, fetchedAt=0 )
+      self.assertFalse( labels.expired() )
+      self.assertEqual( labels.name( 'Label_1' ), 'Work' )
+      self.assertEqual( labels.name( 'Label_9' ), 'Label_9' )
+
+class FakeService( object ):
+   def __init__( self ):
+      self.labelCache = LabelCache.from_labels( LABELS )
+
+   def label_cache( self ):
+      return self.labelCache
+
+class PrinterTest( unittest.TestCase ):
+   def testPrintFilter( self ):
+      filter_ = { 'id': 'f1', 'criteria': { 'query': 'x' },
+                  'action': { 'addLabelIds': [ 'Label_1', 'Label_2' ],
+                              'removeLabelIds': [ 'INBOX' ] } }
+      orig = copy.deepcopy( filter_ )
+      out = io.StringIO()
+      with contextlib.redirect_stdout( out ):
+         Printer( FakeService(), False ).print_filter( filter_ )
+      self.assertIn( '  -> addLabelIds: Work, Work/Builds', out.getvalue() )
+      self.assertIn( '  -> removeLabelIds: INBOX', out.getvalue() )
+      # The filter is left as it was, to be sent back to Gmail
+      self.assertEqual( filter_, orig )
+
+if __name__ == '__main__':
+   unittest.main()
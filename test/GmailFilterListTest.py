@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+import io
+import json
+import re
+import unittest
+
+import GmailFiltersTestLib # pylint: disable=unused-import
+from GmailFilters.Labels import LabelCache
+from GmailFilters.Listing import FilterSearch, write_filters, query_terms
+
+LABELS = LabelCache.from_labels( [ { 'id': 'L1', 'name': 'Work' },
+                                   { 'id': 'L2', 'name': 'Builds' } ] )
+
+FILTERS = [
+   { 'id': 'f1', 'criteria': { 'query': 'from:alice {"weekly digest" jira}' },
+     'action': { 'addLabelIds': [ 'L1' ] } },
+   { 'id': 'f2', 'criteria': { 'from': 'jira@example.com', 'query': 'failed' },
+     'action': { 'addLabelIds': [ 'L2' ], 'removeLabelIds': [ 'INBOX' ] } },
+   { 'id': 'f3', 'criteria': { 'subject': 'invoice' },
+     'action': { 'forward': 'billing@example.com' } },
+]
+
+class CountingOut( io.StringIO ):
+   def __init__( self ):
+      io.StringIO.__init__( self )
+      self.flushes = 0
+
+   def flush( self ):
+      self.flushes += 1
+
+class FilterSearchTest( unittest.TestCase ):
+   def ids( self, search ):
+      return [ f[ 'id' ] for f in FILTERS if search.matches( f ) ]
+
+   def testPattern( self ):
+      self.assertEqual( self.ids( FilterSearch() ), [ 'f1', 'f2', 'f3' ] )
+      self.assertEqual( self.ids( FilterSearch( pattern=re.compile( 'jira' ) ) ),
+                        [ 'f1', 'f2' ] )
+      self.assertEqual( self.ids( FilterSearch( pattern=re.compile( 'jira' ),
+                                                fields=[ 'from' ] ) ), [ 'f2' ] )
+      # Only the given fields are searched, not ids or actions
+      self.assertEqual( self.ids( FilterSearch( pattern=re.compile( 'f1|L1' ),
+                                                fields=[ 'query', 'from' ] ) ),
+                        [] )
+
+   def testLabelAndAction( self ):
+      self.assertEqual( self.ids( FilterSearch( labelId='L2' ) ), [ 'f2' ] )
+      self.assertEqual( self.ids( FilterSearch( labelId='INBOX' ) ), [ 'f2' ] )
+      self.assertEqual( self.ids( FilterSearch( action='forward' ) ), [ 'f3' ] )
+      self.assertEqual( self.ids( FilterSearch( action='addLabelIds',
+                                                labelId='L1' ) ), [ 'f1' ] )
+
+   def testTerm( self ):
+      self.assertEqual( query_terms( 'a {(b) "c d"}' ), { 'a', 'b', 'c d' } )
+      self.assertEqual( self.ids( FilterSearch( term='jira' ) ), [ 'f1' ] )
+      self.assertEqual( self.ids( FilterSearch( term='Weekly Digest' ) ), [ 'f1' ] )
+      self.assertEqual( self.ids( FilterSearch( term='weekly' ) ), [] )
+      self.assertEqual( self.ids( FilterSearch( term='from:alice' ) ), [ 'f1' ] )
+
+class WriteFiltersTest( unittest.TestCase ):
+   def testJson( self ):
+      for chunkSize in ( 1, 2, 10 ):
+         out = CountingOut()
+         self.assertEqual( write_filters( out, iter( FILTERS ), 'json',
+                                          chunkSize=chunkSize ), 3 )
+         self.assertEqual( json.loads( out.getvalue() ), FILTERS )
+      self.assertEqual( out.flushes, 2 )
+
+      out = CountingOut()
+      write_filters( out, [], 'json' )
+      self.assertEqual( json.loads( out.getvalue() ), [] )
+
+   def testJsonl( self ):
+      out = CountingOut()
+      write_filters( out, iter( FILTERS ), 'jsonl', chunkSize=2 )
+      lines = out.getvalue().splitlines()
+      self.assertEqual( [ json.loads( l ) for l in lines ], FILTERS )
+      self.assertEqual( out.flushes, 2 )
+
+   def testTable( self ):
+      out = CountingOut()
+      write_filters( out, FILTERS, 'table', labels=LABELS )
+      lines = out.getvalue().splitlines()
+      self.assertEqual( len( lines ), 4 )
+      self.assertTrue( lines[ 0 ].startswith( 'ID' ) )
+      self.assertEqual( lines[ 1 ].split(), [ 'f1', '+Work', 'from:alice',
+                                              '{"weekly', 'digest"', 'jira}' ] )
+      self.assertEqual( lines[ 2 ].split(), [ 'f2', '+Builds', '-INBOX',
+                                              'from:jira@example.com', 'failed' ] )
+      self.assertIn( 'forward=billing@example.com', lines[ 3 ] )
+
+      # Filters are formatted a chunk at a time, without reading ahead
+      def gen():
+         yield FILTERS[ 0 ]
+         self.assertEqual( len( out.getvalue().splitlines() ), 2 )
+         yield dict( FILTERS[ 1 ], id='longer-id' )
+      out = CountingOut()
+      self.assertEqual( write_filters( out, gen(), 'table', labels=LABELS,
+                                       chunkSize=1 ), 2 )
+      lines = out.getvalue().splitlines()
+      self.assertEqual( lines[ 2 ].split()[ 0 ], 'longer-id' )
+      self.assertEqual( out.flushes, 2 )
+
+      out = CountingOut()
+      write_filters( out, [], 'table' )
+      self.assertTrue( out.getvalue().startswith( 'ID' ) )
+
+if __name__ == '__main__':
+   unittest.main()
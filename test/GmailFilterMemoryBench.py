@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+
+import gc
+import tracemalloc
+
+from GmailFiltersBenchLib import gen_queries, print_row
+from GmailFilters import parse_filter_element
+from GmailFilters.Table import FilterElementTable
+
+def traced_bytes( func ):
+   '''Returns ( result, bytes allocated by func still held by result ).'''
+   gc.collect()
+   tracemalloc.start()
+   result = func()
+   gc.collect()
+   size = tracemalloc.get_traced_memory()[ 0 ]
+   tracemalloc.stop()
+   return result, size
+
+def main():
+   print_row( 'per 1k filters', 'query KB', 'trees KB', 'tables KB', 'nodes' )
+   for depth, width in [ ( 1, 4 ), ( 3, 4 ), ( 5, 3 ) ]:
+      queries = gen_queries( 1000, seed=depth, depth=depth, width=width )
+      queryBytes = sum( len( q ) for q in queries )
+      _, treeBytes = traced_bytes(
+            lambda: [ parse_filter_element( q ) for q in queries ] )
+      tables, tableBytes = traced_bytes(
+            lambda: [ FilterElementTable.parse( q ) for q in queries ] )
+      print_row( 'depth %d, width %d' % ( depth, width ), queryBytes // 1024,
+                 treeBytes // 1024, tableBytes // 1024,
+                 sum( len( t ) for t in tables ) )
+
+if __name__ == '__main__':
+   main()
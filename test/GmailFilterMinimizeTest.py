@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+import random
+import unittest
+
+import GmailFiltersTestLib # pylint: disable=unused-import
+from GmailFilters import parse_filter_element
+from GmailFilters.Match import Message, query_matcher
+from GmailFilters.Minimize import minimized_str, same_query
+from GmailFilters.Template import update_all_meta_groups
+from GmailFiltersBenchLib import gen_query, gen_message, gen_template_queries
+
+def minimized( query ):
+   return minimized_str( parse_filter_element( query ) )
+
+class MinimizeTest( unittest.TestCase ):
+   def check( self, query, expected ):
+      self.assertEqual( minimized( query ), expected, query )
+
+   def testWhitespace( self ):
+      self.check( '  a   b ', 'a b' )
+      self.check( 'x ( a  {b   c } )', 'x (a {b c})' )
+      self.check( '"a   phrase"  x', '"a phrase" x' )
+      # Operators and '-' stay attached to their groups
+      self.check( 'subject:(x)  -( y )', 'subject:(x) -(y)' )
+      self.check( 'subject: (x)', 'subject: (x)' )
+
+   def testUnwrap( self ):
+      self.check( 'a ((x))', 'a (x)' )
+      self.check( 'a (((x y)))', 'a (x y)' )
+      self.check( '({x y})', '{x y}' )
+      self.check( 'a {(x y)}', 'a (x y)' )
+      self.check( 'a (x)', 'a (x)' )
+      self.check( '-((x))', '-(x)' )
+      self.check( 'a ((x) y)', 'a ((x) y)' )
+      # Parentheses around the whole query
+      self.check( '((x y))', 'x y' )
+      self.check( '( (x) y )', '(x) y' )
+      self.check( '{x y}', '{x y}' )
+      self.check( '({(x y)})', 'x y' )
+      self.check( '((M3TA k))', '(M3TA k)' )
+
+   def testDuplicateOrMembers( self ):
+      self.check( '{a b a}', '{a b}' )
+      self.check( '{(x y) a (x  y)}', '{(x y) a}' )
+      self.check( '{-(x) (x) -(x)}', '{-(x) (x)}' )
+      # Members joined by OR can't be dropped alone
+      self.check( '{a OR b a}', '{a OR b a}' )
+      # Nor those of AND groups
+      self.check( 'x (a b a)', 'x (a b a)' )
+
+   def testMetaGroupsKept( self ):
+      self.check( '{(M3TA k)}', '{(M3TA k)}' )
+      self.check( '(({(M3TAP k) ((x))}))', '{(M3TAP k) (x)}' )
+      self.check( '(M3TA k)', '(M3TA k)' )
+      self.check( '{ "M3TA k"  a a }', '{"M3TA k" a}' )
+
+   def testSameQuery( self ):
+      self.assertTrue( same_query( '((a))  b', '(a) b' ) )
+      self.assertFalse( same_query( 'a b', 'b a' ) )
+
+   def testIdempotentAndEquivalent( self ):
+      rng = random.Random( 11 )
+      messages = [ Message( gen_message( rng, i, bodyWords=20 ) )
+                   for i in range( 30 ) ]
+      for _ in range( 200 ):
+         query = gen_query( rng, 3, 3 )
+         query = rng.choice( [ '((%s))', '{%s %s}', '{ %s }', '%s' ] ).replace(
+               '%s', query )
+         minQuery = minimized( query )
+         self.assertEqual( minimized( minQuery ), minQuery )
+         self.assertLessEqual( len( minQuery ), len( query ) )
+         matcher = query_matcher( query )
+         minMatcher = query_matcher( minQuery )
+         for msg in messages:
+            self.assertEqual( matcher( msg ), minMatcher( msg ), query )
+
+   def testTemplatesResolve( self ):
+      rng = random.Random( 7 )
+      queries = gen_template_queries( rng, 60, 6 )
+      filterElemById = { id_: parse_filter_element( '((%s))' % q )
+                         for id_, q in queries.items() }
+      update_all_meta_groups( filterElemById )
+      minQueries = { id_: minimized_str( e ) for id_, e in filterElemById.items() }
+
+      # Updating the minimized filters changes nothing
+      updated = { id_: parse_filter_element( q ) for id_, q in minQueries.items() }
+      update_all_meta_groups( updated )
+      self.assertEqual( { id_: e.full_filter_str() for id_, e in updated.items() },
+                        minQueries )
+
+if __name__ == '__main__':
+   unittest.main()
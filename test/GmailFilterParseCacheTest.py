@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from GmailFiltersTestLib import pm, prs, ParserTestBase
+from GmailFilters import SpanParser, parse_filter_element, set_parse_cache
+from GmailFilters.ParseCache import ParseCache
+
+class ParseCacheTest( ParserTestBase ):
+   queries = [ '', ' x ', '{(M3TAP foo) x}', 'a (b "c d") {e f}  ' ]
+
+   @staticmethod
+   def uncached_parse( string ):
+      return SpanParser( string ).parse()
+
+   def setUp( self ):
+      self.tmpDir = tempfile.mkdtemp()
+      self.path = os.path.join( self.tmpDir, 'cache', 'parse_cache.marshal' )
+
+   def tearDown( self ):
+      set_parse_cache( None )
+      shutil.rmtree( self.tmpDir )
+
+   @pm
+   def testTransparent( self ):
+      cache = ParseCache( self.path )
+      set_parse_cache( cache )
+      for q in self.queries:
+         self.assertEqual( parse_filter_element( q ), self.uncached_parse( q ) )
+      self.assertEqual( ( cache.hits, cache.misses ), ( 0, len( self.queries ) ) )
+      cache.save()
+
+      cache = ParseCache( self.path )
+      set_parse_cache( cache )
+      for q in self.queries:
+         self.assertEqual( parse_filter_element( q ), self.uncached_parse( q ) )
+      self.assertEqual( ( cache.hits, cache.misses ), ( len( self.queries ), 0 ) )
+      self.assertFalse( cache.dirty )
+
+   @pm
+   def testCopiesAreIndependent( self ):
+      cache = ParseCache( self.path )
+      cache.put( 'a b', prs( 'a b' ) )
+      elem = cache.get( 'a b' )
+      elem.subElems[ 0 ].filterStr = 'x'
+      self.assertEqual( cache.get( 'a b' ), prs( 'a b' ) )
+
+   def testLruEviction( self ):
+      cache = ParseCache( self.path, maxEntries=2 )
+      cache.put( 'a', prs( 'a' ) )
+      cache.put( 'b', prs( 'b' ) )
+      self.assertIsNotNone( cache.get( 'a' ) )
+      cache.put( 'c', prs( 'c' ) )
+      cache.save()
+
+      cache = ParseCache( self.path, maxEntries=2 )
+      self.assertIsNone( cache.get( 'b' ) )
+      self.assertIsNotNone( cache.get( 'a' ) )
+      self.assertIsNotNone( cache.get( 'c' ) )
+
+   def testLruOrderSaved( self ):
+      cache = ParseCache( self.path, maxEntries=2 )
+      cache.put( 'a', prs( 'a' ) )
+      cache.put( 'b', prs( 'b' ) )
+      cache.save()
+
+      # A run with only hits still saves their order
+      cache = ParseCache( self.path, maxEntries=2 )
+      self.assertIsNotNone( cache.get( 'a' ) )
+      self.assertTrue( cache.dirty )
+      cache.save()
+
+      cache = ParseCache( self.path, maxEntries=2 )
+      cache.put( 'c', prs( 'c' ) )
+      self.assertIsNone( cache.get( 'b' ) )
+      self.assertIsNotNone( cache.get( 'a' ) )
+
+   def testCorruptFile( self ):
+      os.makedirs( os.path.dirname( self.path ) )
+      with open( self.path, 'wb' ) as f:
+         f.write( b'\x00garbage' )
+      cache = ParseCache( self.path )
+      self.assertIsNone( cache.get( 'a' ) )
+      cache.put( 'a', prs( 'a' ) )
+      cache.save()
+      self.assertEqual( ParseCache( self.path ).get( 'a' ), prs( 'a' ) )
+
+if __name__ == '__main__':
+   unittest.main()
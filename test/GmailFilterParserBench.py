@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+
+from GmailFiltersBenchLib import gen_queries, best_time, print_row, ElementParser
+from GmailFilters import SpanParser
+
+def main():
+   print_row( 'queries (depth x width)', 'chars', 'old ms', 'new ms', 'speedup' )
+   for depth, width in [ ( 2, 4 ), ( 4, 4 ), ( 6, 3 ), ( 10, 2 ) ]:
+      queries = gen_queries( 200, seed=depth, depth=depth, width=width )
+      chars = sum( len( q ) for q in queries )
+
+      oldTime = best_time( lambda: [ ElementParser( q ).parse() for q in queries ] )
+      newTime = best_time( lambda: [ SpanParser( q ).parse() for q in queries ] )
+      print_row( '200 (%d x %d)' % ( depth, width ), chars,
+                 '%.1f' % ( oldTime * 1000 ), '%.1f' % ( newTime * 1000 ),
+                 '%.1fx' % ( oldTime / newTime ) )
+
+if __name__ == '__main__':
+   main()
@@ -1,15 +1,22 @@
 #!/usr/bin/env python3
 
+import copy
+import random
 import unittest
 
 from GmailFiltersTestLib import pm, grp, grp2, prs, prs1, ParserTestBase
-from GmailFilters import ElementParser, ParseError
+from GmailFiltersBenchLib import ElementParser
+from GmailFilters import ParseError, tokenize_filter_str
 from GmailFilters import FilterElement as Fe
 
 class ParsingTest( ParserTestBase ):
    def testCheckDelims( self ):
       def check( string ):
-         return ElementParser( string ).check_delims() is None
+         try:
+            self.parse_str( string )
+         except ParseError:
+            return False
+         return True
 
       self.assertTrue( check( "()" ) )
       self.assertTrue( check( "{}" ) )
@@ -106,6 +113,81 @@ class ParsingTest( ParserTestBase ):
       self.assertRaises( ParseError, self.parse_str, '({)' )
       # While technically valid, this is not supported right now
       self.assertRaises( ParseError, self.parse_str, '("xx)")' )
+      self.assertRaises( ParseError, self.parse_str, '"xx' )
+      self.assertRaises( ParseError, self.parse_str, '(x}' )
+
+   def testTokenize( self ):
+      string = ' x:(y "a b"){'
+      spans = list( tokenize_filter_str( string ) )
+      self.assertEqual( [ string[ s:e ] for _, s, e in spans ],
+                        [ ' ', 'x:', '(', 'y', ' ', '"a b"', ')', '{' ] )
+      self.assertEqual( [ k for k, _, _ in spans ],
+                        [ 'ws', 'text', 'open', 'text', 'ws', 'quoted', 'close',
+                          'open' ] )
+
+   def testMatchesElementParser( self ):
+      rng = random.Random( 1234 )
+      checked = 0
+      for _ in range( 20000 ):
+         string = ''.join( rng.choice( 'ab  (){}"' )
+                           for _ in range( rng.randint( 0, 16 ) ) )
+         try:
+            expected = ElementParser( string ).parse()
+         except ParseError:
+            self.assertRaises( ParseError, self.parse_str, string )
+            continue
+         except AssertionError:
+            # The old parser did not support these
+            continue
+         if str( expected ) != string:
+            # Groups closed within quotes do not round trip in the old parser
+            continue
+         self.assertEqual( self.parse_str( string ), expected )
+         checked += 1
+      self.assertGreater( checked, 1000 )
+
+class FilterElementTest( ParserTestBase ):
+   # pylint: disable=protected-access
+   def testCachedStrInvalidation( self ):
+      root = self.parse_str( 'a {b (c d) e} (f)' )
+      self.assertEqual( root.full_filter_str(), 'a {b (c d) e} (f)' )
+      orGrp = root.subElems[ 1 ]
+      andGrp = orGrp.subElems[ 1 ]
+      sibling = root.subElems[ 2 ]
+      for elem in ( root, orGrp, andGrp, sibling ):
+         self.assertIsNotNone( elem._strCache )
+
+      # Only the ancestors of the changed element are invalidated
+      andGrp.subElems[ 0 ].filterStr = 'x'
+      self.assertIsNone( andGrp._strCache )
+      self.assertIsNone( orGrp._strCache )
+      self.assertIsNone( root._strCache )
+      self.assertIsNotNone( sibling._strCache )
+      self.assertEqual( str( root ), 'a {b (x d) e} (f)' )
+
+      andGrp.postWs = '  '
+      andGrp.delims = '{}'
+      self.assertEqual( str( root ), 'a {b {x d}  e} (f)' )
+
+      orGrp.subElems[ 1 ] = Fe( 'y' )
+      self.assertIsNone( andGrp._parent )
+      self.assertIs( orGrp.subElems[ 1 ]._parent, orGrp )
+      self.assertEqual( str( root ), 'a {b ye} (f)' )
+
+      orGrp.subElems.append( Fe( 'z', preWs=' ' ) )
+      del root.subElems[ 0 ]
+      self.assertEqual( str( root ), '{b ye z} (f)' )
+
+      sibling.subElems = [ Fe( 'g' ) ]
+      self.assertEqual( str( root ), '{b ye z} (g)' )
+
+   def testCopy( self ):
+      root = self.parse_str( 'a {b (c d) e}' )
+      rootCopy = copy.deepcopy( root )
+      self.assertEqual( root, rootCopy )
+      rootCopy.subElems[ 1 ].subElems[ 0 ].filterStr = 'x'
+      self.assertEqual( str( rootCopy ), 'a {x (c d) e}' )
+      self.assertEqual( str( root ), 'a {b (c d) e}' )
 
 if __name__ == '__main__':
    unittest.main()
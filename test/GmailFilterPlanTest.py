@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+import copy
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import GmailFiltersTestLib # pylint: disable=unused-import
+from GmailFilters.Labels import LabelCache
+from GmailFilters.Plan import Plan, DefinitionError, load_definitions, \
+                              resolve_labels, filter_key, read_json
+
+LABELS = LabelCache.from_labels( [ { 'id': 'L1', 'name': 'Work' },
+                                   { 'id': 'L2', 'name': 'Builds' } ] )
+
+FILTERS = [
+   { 'id': 'f1', 'criteria': { 'query': 'from:alice {a b}' },
+     'action': { 'addLabelIds': [ 'L1' ] } },
+   { 'id': 'f2', 'criteria': { 'from': 'ci@example.com' },
+     'action': { 'addLabelIds': [ 'L2' ], 'removeLabelIds': [ 'INBOX' ] } },
+   { 'id': 'f3', 'criteria': { 'subject': 'old' },
+     'action': { 'addLabelIds': [ 'L1' ] } },
+]
+
+class FakeService( object ):
+   def __init__( self, filters, failCreate=False ):
+      self.filters = copy.deepcopy( filters )
+      self.calls = []
+      self.failCreate = failCreate
+
+   def create_filter( self, filterObj ):
+      self.calls.append( 'create_filter' )
+      if self.failCreate:
+         raise IOError( "quota" )
+      created = dict( filterObj, id='new%d' % len( self.calls ) )
+      self.filters.append( created )
+      return created
+
+   def delete_filter( self, filterId ):
+      self.calls.append( 'delete_filter' )
+      self.filters = [ f for f in self.filters if f[ 'id' ] != filterId ]
+      return ''
+
+class PlanTest( unittest.TestCase ):
+   def setUp( self ):
+      self.tmpDir = tempfile.mkdtemp()
+
+   def tearDown( self ):
+      shutil.rmtree( self.tmpDir )
+
+   def write( self, name, obj ):
+      path = os.path.join( self.tmpDir, name )
+      with open( path, 'w' ) as f:
+         json.dump( obj, f )
+      return path
+
+   def testKey( self ):
+      # Ids, empty values, label order and trivial query differences don't count
+      self.assertEqual(
+            filter_key( FILTERS[ 0 ] ),
+            filter_key( { 'criteria': { 'query': '( from:alice  {a b a} )', 'to': '' },
+                          'action': { 'addLabelIds': [ 'L1' ], 'forward': None } } ) )
+      self.assertNotEqual( filter_key( FILTERS[ 0 ] ),
+                           filter_key( { 'criteria': { 'query': 'from:alice {a}' },
+                                         'action': { 'addLabelIds': [ 'L1' ] } } ) )
+
+   def testLoadDefinitions( self ):
+      # The output of list --format json can be used as definitions
+      self.assertEqual( len( load_definitions( self.write( 'a.json', FILTERS ) ) ), 3 )
+      definitions = load_definitions( self.write( 'b.json', { 'filters': [
+         { 'criteria': { 'from': 'ci@example.com' },
+           'action': { 'addLabels': [ 'Builds' ], 'removeLabelIds': [ 'INBOX' ] } },
+      ] } ) )
+      self.assertEqual( resolve_labels( definitions, LABELS ), [
+         { 'criteria': { 'from': 'ci@example.com' },
+           'action': { 'addLabelIds': [ 'L2' ], 'removeLabelIds': [ 'INBOX' ] } } ] )
+
+      self.assertRaises( DefinitionError, resolve_labels,
+                         [ { 'criteria': {}, 'action': { 'addLabels': [ 'Nope' ] } } ],
+                         LABELS )
+      self.assertRaises( DefinitionError, load_definitions,
+                         self.write( 'c.json', [ { 'action': {} } ] ) )
+      path = os.path.join( self.tmpDir, 'd.json' )
+      with open( path, 'w' ) as f:
+         f.write( '[' )
+      self.assertRaises( DefinitionError, load_definitions, path )
+
+   def testPlan( self ):
+      definitions = [
+         { 'criteria': { 'query': 'from:alice  {a b}' },
+           'action': { 'addLabelIds': [ 'L1' ] } },
+         { 'criteria': { 'from': 'ci@example.com' },
+           'action': { 'removeLabelIds': [ 'INBOX' ], 'addLabelIds': [ 'L2' ] } },
+         { 'criteria': { 'subject': 'new' }, 'action': { 'addLabelIds': [ 'L1' ] } },
+      ]
+      plan = Plan.compute( definitions, FILTERS, emailAddr='me@example.com' )
+      self.assertEqual( plan.creates, [ definitions[ 2 ] ] )
+      self.assertEqual( [ f[ 'id' ] for f in plan.deletes ], [ 'f3' ] )
+
+      # A saved plan applies to the filters it was made from
+      path = os.path.join( self.tmpDir, 'plan.json' )
+      plan.save( path )
+      obj = read_json( path )
+      self.assertTrue( Plan.is_plan( obj ) )
+      loaded = Plan.from_json( obj )
+      self.assertTrue( loaded.matches( list( reversed( FILTERS ) ) ) )
+      changed = copy.deepcopy( FILTERS )
+      changed[ 0 ][ 'criteria' ][ 'query' ] = 'from:bob'
+      self.assertFalse( loaded.matches( changed ) )
+
+      service = FakeService( FILTERS )
+      self.assertEqual( loaded.apply( service ), [] )
+      self.assertEqual( service.calls, [ 'create_filter', 'delete_filter' ] )
+      # Applying only wrote what changed, so nothing is left to do
+      self.assertTrue( Plan.compute( definitions, service.filters ).empty() )
+
+   def testDuplicates( self ):
+      dup = { 'criteria': { 'subject': 'x' }, 'action': {} }
+      filters = [ dict( dup, id='a' ), dict( dup, id='b' ), dict( dup, id='c' ) ]
+      plan = Plan.compute( [ dup, dup ], filters )
+      self.assertEqual( plan.creates, [] )
+      self.assertEqual( [ f[ 'id' ] for f in plan.deletes ], [ 'c' ] )
+
+      plan = Plan.compute( [ dup, dup ], [] )
+      self.assertEqual( plan.creates, [ dup, dup ] )
+
+   def testFailedCreateKeepsFilters( self ):
+      plan = Plan.compute( [ { 'criteria': { 'subject': 'new' }, 'action': {} } ],
+                           FILTERS )
+      service = FakeService( FILTERS, failCreate=True )
+      failures = plan.apply( service )
+      self.assertEqual( [ op for op, _, _ in failures ], [ 'create' ] )
+      self.assertEqual( service.calls, [ 'create_filter' ] )
+      self.assertEqual( len( service.filters ), 3 )
+
+if __name__ == '__main__':
+   unittest.main()
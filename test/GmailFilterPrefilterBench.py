@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import tempfile
+import time
+
+from GmailFiltersBenchLib import gen_queries, gen_vocabulary, write_mbox, print_row
+from GmailFilters.Corpus import iter_messages
+from GmailFilters.Simulate import Simulation
+
+def time_simulation( filters, mboxPath, prefilter ):
+   simulation = Simulation( filters, prefilter=prefilter )
+   start = time.perf_counter()
+   simulation.run( iter_messages( [ mboxPath ] ) )
+   elapsed = time.perf_counter() - start
+   counts = { id_: r.count for id_, r in simulation.results.items() }
+   return simulation.messages / elapsed, counts
+
+def main():
+   words = gen_vocabulary( 5000 )
+   tmpDir = tempfile.mkdtemp()
+   try:
+      mboxPath = os.path.join( tmpDir, 'corpus.mbox' )
+      write_mbox( mboxPath, 2000, words=words )
+      print( "Messages per second over 2000 messages, of a 5000 word vocabulary" )
+      print_row( 'filters', 'naive', 'indexed', 'speedup' )
+      for numFilters in [ 100, 1000, 5000 ]:
+         filters = [ { 'id': 'f%d' % i, 'criteria': { 'query': q } }
+                     for i, q in enumerate( gen_queries( numFilters, depth=2,
+                                                         words=words ) ) ]
+         naiveRate, naiveCounts = time_simulation( filters, mboxPath, False )
+         indexedRate, indexedCounts = time_simulation( filters, mboxPath, True )
+         assert naiveCounts == indexedCounts
+         print_row( str( numFilters ), '%.0f' % naiveRate, '%.0f' % indexedRate,
+                    '%.1fx' % ( indexedRate / naiveRate ) )
+   finally:
+      shutil.rmtree( tmpDir )
+
+if __name__ == '__main__':
+   main()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+
+import asyncio
+import contextlib
+import io
+import unittest
+
+import GmailFiltersTestLib # pylint: disable=unused-import
+from GmailFilters.AsyncApi import AsyncService, FakeTransport, ApiError
+from GmailFilters.FakeBackend import FakeGmail
+from GmailFilters.Scheduler import Scheduler, AdaptiveLimit, error_status, \
+                                   is_retryable, is_throttled
+
+class FakeClock( object ):
+   def __init__( self ):
+      self.now = 100.0
+      self.sleeps = []
+
+   def __call__( self ):
+      return self.now
+
+   def sleep( self, seconds ):
+      self.sleeps.append( seconds )
+      self.now += seconds
+
+class HttpError( Exception ):
+   '''Like googleapiclient's HttpError, with the response in resp.'''
+   def __init__( self, status, headers=None, content=b'' ):
+      Exception.__init__( self, status )
+      self.resp = dict( headers or {} )
+      self.resp[ 'status' ] = status
+      self.content = content
+
+class Resp( dict ):
+   @property
+   def status( self ):
+      return self[ 'status' ]
+
+def http_error( status, headers=None, content=b'' ):
+   error = HttpError( status, headers, content )
+   error.resp = Resp( error.resp )
+   return error
+
+class SchedulerTest( unittest.TestCase ):
+   def scheduler( self, **kwargs ):
+      self.clock = FakeClock()
+      return Scheduler( clock=self.clock, sleep=self.clock.sleep, seed=2, **kwargs )
+
+   def testTokenBucket( self ):
+      scheduler = self.scheduler( rate=250 )
+      # A burst of the rate is allowed, and then requests wait for their cost
+      self.assertEqual( [ scheduler.reserve( 5 ) for _ in range( 50 ) ], [ 0.0 ] * 50 )
+      self.assertAlmostEqual( scheduler.reserve( 5 ), 0.02 )
+      self.assertAlmostEqual( scheduler.reserve( 1 ), 0.024 )
+      self.clock.now += 1.0
+      self.assertEqual( scheduler.reserve( 5 ), 0.0 )
+
+   def testErrors( self ):
+      self.assertEqual( error_status( http_error( 429, { 'retry-after': '3' } ) ),
+                        ( 429, 3.0 ) )
+      self.assertEqual( error_status( ApiError( 503, 'Unavailable', '1.5' ) ),
+                        ( 503, 1.5 ) )
+      self.assertEqual( error_status( IOError( 'reset' ) ), ( None, None ) )
+      for status in ( 429, 500, 503 ):
+         self.assertTrue( is_retryable( ApiError( status, '' ) ) )
+      for status in ( 400, 401, 404 ):
+         self.assertFalse( is_retryable( ApiError( status, '' ) ) )
+      self.assertFalse( is_retryable( IOError( 'reset' ) ) )
+      self.assertTrue( is_retryable(
+            http_error( 403, content=b'{"reason": "userRateLimitExceeded"}' ) ) )
+      self.assertFalse( is_retryable( http_error( 403, content=b'Forbidden' ) ) )
+      self.assertTrue( is_throttled( ApiError( 429, '' ) ) )
+      self.assertTrue( is_throttled( ApiError( 403, 'rateLimitExceeded' ) ) )
+      self.assertFalse( is_throttled( ApiError( 503, '' ) ) )
+
+   def testBackoff( self ):
+      scheduler = self.scheduler( baseDelay=0.5, maxDelay=4.0, maxRetries=6 )
+      error = ApiError( 503, '' )
+      for attempt in range( 6 ):
+         delay = scheduler.retry_delay( error, attempt )
+         self.assertTrue( 0 <= delay <= min( 4.0, 0.5 * 2 ** attempt ), delay )
+      self.assertIsNone( scheduler.retry_delay( error, 6 ) )
+      self.assertIsNone( scheduler.retry_delay( ApiError( 400, '' ), 0 ) )
+      self.assertEqual( ( scheduler.retries, scheduler.throttles ), ( 6, 0 ) )
+
+   def testRetryAfterPausesEveryRequest( self ):
+      scheduler = self.scheduler()
+      self.assertGreaterEqual( scheduler.retry_delay( ApiError( 429, '', '10' ), 0 ), 10 )
+      self.assertEqual( scheduler.throttles, 1 )
+      self.assertAlmostEqual( scheduler.reserve( 1 ), 10.0 )
+
+   def testCall( self ):
+      scheduler = self.scheduler()
+      errors = [ ApiError( 503, '' ), ApiError( 429, '', '2' ) ]
+      def request():
+         if errors:
+            raise errors.pop( 0 )
+         return 'ok'
+      self.assertEqual( scheduler.call( 'get_filters', request ), 'ok' )
+      self.assertEqual( scheduler.retries, 2 )
+      self.assertGreaterEqual( self.clock.sleeps[ -1 ], 2.0 )
+
+      def bad():
+         raise ApiError( 400, 'Bad' )
+      self.assertRaises( ApiError, scheduler.call, 'get_filters', bad )
+
+   def testCreateRetriedOnlyWhenNotMade( self ):
+      scheduler = self.scheduler()
+      sent = []
+      def create( *errors ):
+         errors = list( errors )
+         def request():
+            sent.append( 'create' )
+            if errors:
+               raise errors.pop( 0 )
+            return 'created'
+         return request
+
+      # Throttled creates were not made, so are sent again
+      self.assertEqual( scheduler.call( 'create_filter', create( ApiError( 429, '' ) ) ),
+                        'created' )
+      self.assertEqual( len( sent ), 2 )
+
+      # A create failing with a 5xx may have been made
+      del sent[ : ]
+      self.assertRaises( ApiError, scheduler.call, 'create_filter',
+                         create( ApiError( 503, '' ) ) )
+      self.assertEqual( len( sent ), 1 )
+
+      del sent[ : ]
+      self.assertEqual( scheduler.call( 'create_filter', create( ApiError( 500, '' ) ),
+                                        reconcile=lambda: 'found' ), 'found' )
+      self.assertEqual( len( sent ), 1 )
+
+      del sent[ : ]
+      self.assertEqual( scheduler.call( 'create_filter', create( ApiError( 502, '' ) ),
+                                        reconcile=lambda: None ), 'created' )
+      self.assertEqual( len( sent ), 2 )
+
+   def testAsyncCreateNotDuplicated( self ):
+      class FlakyGmail( FakeGmail ):
+         '''Fails the first create with a 503, after making it.'''
+         failed = False
+
+         def respond( self, method, path, body=None ):
+            status, result, headers = FakeGmail.respond( self, method, path, body=body )
+            if method == 'POST' and not self.failed:
+               self.failed = True
+               return 503, { 'error': { 'message': 'Backend Error' } }, {}
+            return status, result, headers
+
+      gmail = FlakyGmail( filters=[ { 'id': 'f1', 'criteria': { 'query': 'old' } } ] )
+      service = AsyncService( FakeTransport( gmail=gmail ),
+                              scheduler=Scheduler( baseDelay=0.001, seed=1 ) )
+      with contextlib.redirect_stdout( io.StringIO() ):
+         results = asyncio.run( service.replace_filters(
+               [ { 'id': 'f1', 'criteria': { 'query': 'new' } } ] ) )
+      self.assertTrue( results[ 0 ].ok() )
+      self.assertEqual( [ f[ 'criteria' ] for f in gmail.filters.values() ],
+                        [ { 'query': 'new' } ] )
+      self.assertEqual( results[ 0 ].created[ 'id' ], list( gmail.filters )[ 0 ] )
+
+class AdaptiveLimitTest( unittest.TestCase ):
+   def testAimd( self ):
+      clock = FakeClock()
+      limit = AdaptiveLimit( 8, cooldown=1.0, clock=clock )
+      limit.throttled()
+      self.assertEqual( limit.value, 4 )
+      # Throttles of requests already in flight don't lower it further
+      limit.throttled()
+      self.assertEqual( limit.value, 4 )
+      clock.now += 1.0
+      limit.throttled()
+      self.assertEqual( limit.value, 2 )
+      for _ in range( 2 + 3 ):
+         limit.succeeded()
+      self.assertEqual( limit.value, 4 )
+      for _ in range( 100 ):
+         limit.succeeded()
+      self.assertEqual( limit.value, 8 )
+      for _ in range( 5 ):
+         clock.now += 1.0
+         limit.throttled()
+      self.assertEqual( limit.value, 1 )
+
+   def testAsyncConcurrencyAdapts( self ):
+      filters = [ { 'id': 'f%d' % i, 'criteria': { 'query': 'q%d' % i } }
+                  for i in range( 60 ) ]
+      gmail = FakeGmail( filters=filters, rateLimitRate=0.2, seed=3 )
+      transport = FakeTransport( gmail=gmail )
+      scheduler = Scheduler( baseDelay=0.001, maxRetries=20, seed=1, rate=10000 )
+      service = AsyncService( transport, scheduler=scheduler )
+      values = []
+      class Limits( list ):
+         def append( self, limit ):
+            throttled = limit.throttled
+            def record():
+               throttled()
+               values.append( limit.value )
+            limit.throttled = record
+            list.append( self, limit )
+      scheduler.limits = Limits()
+
+      with contextlib.redirect_stdout( io.StringIO() ):
+         results = asyncio.run( service.replace_filters(
+               [ dict( f, criteria={ 'query': 'new' } ) for f in filters ],
+               concurrency=20 ) )
+      self.assertTrue( all( r.ok() for r in results ) )
+      self.assertEqual( len( gmail.filters ), 60 )
+      self.assertGreater( scheduler.throttles, 0 )
+      self.assertEqual( transport.maxInFlight, 20 )
+      # Concurrency was halved on the first throttle, and not again within
+      # the cooldown
+      self.assertEqual( values[ 0 ], 10 )
+      self.assertEqual( scheduler.limits, [] )
+
+if __name__ == '__main__':
+   unittest.main()
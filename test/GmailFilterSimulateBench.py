@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import tempfile
+import time
+
+from GmailFiltersBenchLib import gen_queries, write_mbox, print_row
+from GmailFilters.Corpus import iter_messages
+from GmailFilters.Simulate import Simulation
+
+def main():
+   tmpDir = tempfile.mkdtemp()
+   try:
+      mboxPath = os.path.join( tmpDir, 'corpus.mbox' )
+      write_mbox( mboxPath, 5000 )
+      print_row( 'filters', 'messages', 'seconds', 'msgs/s' )
+      for numFilters in [ 10, 100, 500 ]:
+         filters = [ { 'id': 'f%d' % i, 'criteria': { 'query': q } }
+                     for i, q in enumerate( gen_queries( numFilters, depth=2 ) ) ]
+         simulation = Simulation( filters )
+         start = time.perf_counter()
+         simulation.run( iter_messages( [ mboxPath ] ) )
+         elapsed = time.perf_counter() - start
+         print_row( str( numFilters ), str( simulation.messages ),
+                    '%.2f' % elapsed, '%.0f' % ( simulation.messages / elapsed ) )
+   finally:
+      shutil.rmtree( tmpDir )
+
+if __name__ == '__main__':
+   main()
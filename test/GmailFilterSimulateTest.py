@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import GmailFiltersTestLib # pylint: disable=unused-import
+from GmailFilters.Corpus import iter_messages
+from GmailFilters.Match import Message, query_matcher, filter_matcher, \
+                               required_terms, UnsupportedQuery
+from GmailFilters.Prefilter import LiteralIndex
+from GmailFilters.Simulate import Simulation
+from GmailFiltersBenchLib import gen_queries, gen_message
+
+MESSAGE = b'''From: Alice Smith <alice@github.com>
+To: me@example.com
+Cc: team@example.com
+Subject: =?utf-8?q?Build_failed=3A_weekly?= digest
+Message-ID: <1@example.com>
+List-Id: <builds.example.com>
+Content-Type: multipart/mixed; boundary=BB
+
+--BB
+Content-Type: text/plain
+
+Hello world, the invoice is attached.
+--BB
+Content-Type: text/html
+
+<p>Some <b>bold</b> news</p>
+--BB
+Content-Type: application/pdf
+Content-Disposition: attachment; filename="invoice-2024.pdf"
+
+JVBERi0=
+--BB--
+'''
+
+def message( sender, subject, body='' ):
+   return ( 'From: %s\nTo: me@example.com\nSubject: %s\n\n%s\n' %
+            ( sender, subject, body ) ).encode( 'utf-8' )
+
+class MatchTest( unittest.TestCase ):
+   def assertMatches( self, query, expected=True, msg=MESSAGE ):
+      self.assertEqual( query_matcher( query )( Message( msg ) ), expected, query )
+
+   def testTerms( self ):
+      self.assertMatches( 'hello' )
+      self.assertMatches( 'HELLO World' )
+      self.assertMatches( 'bold news' )
+      self.assertMatches( 'github' )
+      self.assertMatches( 'goodbye', False )
+      self.assertMatches( '"hello world"' )
+      self.assertMatches( '"world hello"', False )
+      self.assertMatches( 'alice@github.com' )
+      # Only punctuation is ignored
+      self.assertMatches( '* hello' )
+
+   def testOperators( self ):
+      self.assertMatches( 'from:alice' )
+      self.assertMatches( 'from:github.com' )
+      self.assertMatches( 'from:me@example.com', False )
+      self.assertMatches( 'to:me@example.com' )
+      self.assertMatches( 'to:team' )
+      self.assertMatches( 'cc:me', False )
+      self.assertMatches( 'subject:weekly' )
+      self.assertMatches( 'subject:hello', False )
+      self.assertMatches( 'subject:"build failed"' )
+      self.assertMatches( 'subject:(digest weekly)' )
+      self.assertMatches( 'subject:{nope digest}' )
+      self.assertMatches( 'list:builds.example.com' )
+      self.assertMatches( 'has:attachment' )
+      self.assertMatches( 'filename:pdf' )
+      self.assertMatches( 'larger:100' )
+      self.assertMatches( 'smaller:1K' )
+      self.assertMatches( 'smaller:100', False )
+      # Not an operator
+      self.assertMatches( 'http://example.com', False )
+      self.assertRaises( UnsupportedQuery, query_matcher, 'is:unread' )
+      self.assertRaises( UnsupportedQuery, query_matcher, 'from: alice' )
+
+   def testGroups( self ):
+      self.assertMatches( '(hello goodbye)', False )
+      self.assertMatches( '{hello goodbye}' )
+      self.assertMatches( 'hello OR goodbye' )
+      self.assertMatches( 'goodbye OR nope', False )
+      # OR binds before AND
+      self.assertMatches( 'nope goodbye OR hello', False )
+      self.assertMatches( 'hello goodbye OR world' )
+      self.assertMatches( '-goodbye' )
+      self.assertMatches( '-hello', False )
+      self.assertMatches( '-(hello goodbye)' )
+      self.assertMatches( '-{hello goodbye}', False )
+      self.assertMatches( '-from:alice', False )
+      self.assertMatches( 'from:(bob OR alice) {(M3TA t1) invoice}' )
+      self.assertMatches( '()' )
+
+   def testFilterCriteria( self ):
+      msg = Message( MESSAGE )
+      def matches( **criteria ):
+         return filter_matcher( { 'id': 'f', 'criteria': criteria } )( msg )
+      self.assertTrue( matches( **{ 'from': 'alice', 'query': 'invoice' } ) )
+      self.assertFalse( matches( **{ 'from': 'alice', 'query': 'nope' } ) )
+      self.assertFalse( matches( subject='hello' ) )
+      self.assertFalse( matches( negatedQuery='hello' ) )
+      self.assertTrue( matches( hasAttachment=True, to='me' ) )
+      self.assertTrue( matches( size=1, sizeComparison='larger' ) )
+      self.assertFalse( matches( size=10000000, sizeComparison='larger' ) )
+      self.assertRaises( UnsupportedQuery, matches )
+
+class CorpusTest( unittest.TestCase ):
+   def setUp( self ):
+      self.tmpDir = tempfile.mkdtemp()
+
+   def tearDown( self ):
+      shutil.rmtree( self.tmpDir )
+
+   def path( self, *names ):
+      return os.path.join( self.tmpDir, *names )
+
+   def testMbox( self ):
+      with open( self.path( 'mail.mbox' ), 'wb' ) as f:
+         f.write( b'From a@x.com Mon Jan  1 00:00:00 2024\n' +
+                  message( 'a@x.com', 'one', 'line\n>From here\n' ) +
+                  b'\nFrom b@x.com Mon Jan  1 00:00:00 2024\n' +
+                  message( 'b@x.com', 'two' ) )
+      msgs = list( iter_messages( [ self.path( 'mail.mbox' ) ] ) )
+      self.assertEqual( [ m.header( 'subject' ) for m in msgs ], [ 'one', 'two' ] )
+      self.assertIn( 'From here', msgs[ 0 ].body() )
+
+   def testMaildirAndEml( self ):
+      for subDir in ( 'cur', 'new', 'tmp' ):
+         os.makedirs( self.path( 'maildir', subDir ) )
+      with open( self.path( 'maildir', 'cur', '1:2,S' ), 'wb' ) as f:
+         f.write( message( 'a@x.com', 'read' ) )
+      with open( self.path( 'maildir', 'new', '2' ), 'wb' ) as f:
+         f.write( message( 'b@x.com', 'unread' ) )
+      os.makedirs( self.path( 'eml', 'sub' ) )
+      with open( self.path( 'eml', 'sub', 'x.eml' ), 'wb' ) as f:
+         f.write( MESSAGE )
+      msgs = list( iter_messages( [ self.path( 'maildir' ), self.path( 'eml' ),
+                                    self.path( 'eml', 'sub', 'x.eml' ) ] ) )
+      self.assertEqual( [ m.header( 'subject' ) for m in msgs ],
+                        [ 'unread', 'read' ] + [ 'Build failed: weekly digest' ] * 2 )
+
+class SimulationTest( unittest.TestCase ):
+   def testRun( self ):
+      msgs = [ Message( message( 'a@x.com', 'invoice %d' % i ), 'm%d' % i )
+               for i in range( 10 ) ]
+      msgs.append( Message( message( 'b@x.com', 'news' ), 'news' ) )
+      filters = [ { 'id': 'f1', 'criteria': { 'query': 'from:a@x.com' } },
+                  { 'id': 'f2', 'criteria': { 'query': 'news' } },
+                  { 'id': 'f3', 'criteria': { 'query': 'in:inbox' } } ]
+      newFilters = { 'f2': { 'id': 'f2', 'criteria': { 'query': '{news invoice}' } } }
+      simulation = Simulation( filters, newFilters=newFilters, maxExamples=3 )
+      simulation.run( iter( msgs ) )
+
+      self.assertEqual( list( simulation.errors ), [ 'f3' ] )
+      self.assertEqual( simulation.messages, 11 )
+      f1 = simulation.results[ 'f1' ]
+      self.assertEqual( f1.count, 10 )
+      self.assertEqual( f1.examples, [ 'm0: invoice 0', 'm1: invoice 1',
+                                       'm2: invoice 2' ] )
+      f2 = simulation.results[ 'f2' ]
+      self.assertEqual( ( f2.count, f2.added, f2.removed ), ( 1, 10, 0 ) )
+      self.assertEqual( len( f2.addedExamples ), 3 )
+
+class PrefilterTest( unittest.TestCase ):
+   def testRequiredTerms( self ):
+      def required( query ):
+         terms = required_terms( query_matcher( query ) )
+         return sorted( terms ) if terms is not None else None
+      self.assertEqual( required( 'hello' ), [ ( 'all', 'hello' ) ] )
+      self.assertEqual( required( 'from:alice' ), [ ( 'from', 'alice' ) ] )
+      self.assertEqual( required( '"hello wonderful world"' ),
+                        [ ( 'all', 'wonderful' ) ] )
+      self.assertEqual( required( '{a subject:b}' ),
+                        [ ( 'all', 'a' ), ( 'subject', 'b' ) ] )
+      # Any one member of an AND group is required
+      self.assertEqual( required( '{a b} c' ), [ ( 'all', 'c' ) ] )
+      self.assertEqual( required( '-a b' ), [ ( 'all', 'b' ) ] )
+      self.assertIsNone( required( '-a' ) )
+      self.assertIsNone( required( '{a -b}' ) )
+      self.assertIsNone( required( 'has:attachment' ) )
+
+   def testCandidates( self ):
+      matchers = [ query_matcher( q ) for q in [ 'hello', 'from:bob', '-nope',
+                                                 '{goodbye subject:weekly}' ] ]
+      index = LiteralIndex( matchers )
+      self.assertEqual( index.candidates( Message( MESSAGE ) ), set( [ 0, 2, 3 ] ) )
+
+   def testMatchesNaive( self ):
+      rng = random.Random( 3 )
+      msgs = [ Message( gen_message( rng, i, bodyWords=5 ) ) for i in range( 100 ) ]
+      queries = gen_queries( 200, seed=4, depth=2 )
+      filters = [ { 'id': 'f%d' % i, 'criteria': { 'query': q } }
+                  for i, q in enumerate( queries ) ]
+      newFilters = { f[ 'id' ]: { 'id': f[ 'id' ], 'criteria': { 'query': q } }
+                     for f, q in zip( filters[ :50 ], queries[ 50:100 ] ) }
+      results = []
+      for prefilter in ( False, True ):
+         simulation = Simulation( filters, newFilters=newFilters,
+                                  prefilter=prefilter )
+         simulation.run( iter( msgs ) )
+         results.append( { id_: ( r.count, r.added, r.removed )
+                           for id_, r in simulation.results.items() } )
+      self.assertEqual( results[ 0 ], results[ 1 ] )
+
+if __name__ == '__main__':
+   unittest.main()
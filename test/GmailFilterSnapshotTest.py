@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+import copy
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import GmailFiltersTestLib # pylint: disable=unused-import
+import GmailFilters.Config
+import GmailFilters.Snapshot as Snapshot
+from GmailFilters.Snapshot import SnapshotService, OfflineError
+from GmailFilters.Write import FilterWriteResult
+
+class FakeService( object ):
+   def __init__( self ):
+      self.filters = [ { 'id': 'f1', 'criteria': { 'query': 'x' },
+                         'action': { 'addLabelIds': [ 'L1' ] } } ]
+      self.labels = [ { 'id': 'L1', 'name': 'One' } ]
+      self.calls = []
+      self.dryWrites = False
+
+   def get_filters( self ):
+      self.calls.append( 'get_filters' )
+      return copy.deepcopy( self.filters )
+
+   def get_labels( self ):
+      self.calls.append( 'get_labels' )
+      return copy.deepcopy( self.labels )
+
+   def create_filter( self, filterObj ):
+      self.calls.append( 'create_filter' )
+      created = dict( filterObj, id=filterObj[ 'id' ] + '_new' )
+      self.filters.append( created )
+      return created
+
+   def delete_filter( self, filterId ):
+      self.calls.append( 'delete_filter' )
+      self.filters = [ f for f in self.filters if f[ 'id' ] != filterId ]
+      return ''
+
+   def replace_filters( self, filterObjs, batchSize=50 ):
+      self.calls.append( 'replace_filters' )
+      results = []
+      for filterObj in filterObjs:
+         result = FilterWriteResult( filterObj )
+         if filterObj[ 'criteria' ][ 'query' ] == 'bad':
+            result.error = 'Bad query'
+         else:
+            result.created = self.create_filter( filterObj )
+            self.delete_filter( result.oldId )
+            result.deleted = True
+         results.append( result )
+      return results
+
+class SnapshotTest( unittest.TestCase ):
+   def setUp( self ):
+      self.tmpDir = tempfile.mkdtemp()
+      self.origConfigDir = GmailFilters.Config.config_dir
+      GmailFilters.Config.config_dir = self.tmpDir
+
+   def tearDown( self ):
+      GmailFilters.Config.config_dir = self.origConfigDir
+      shutil.rmtree( self.tmpDir )
+
+   def testFetchAndLoad( self ):
+      service = FakeService()
+      self.assertIsNone( Snapshot.last_account() )
+      snapshot = Snapshot.Snapshot.fetch( service, 'me@x.com' )
+      self.assertEqual( Snapshot.last_account(), 'me@x.com' )
+      # Paths follow the config dir, even when it changes after import
+      self.assertTrue( os.path.exists( os.path.join( self.tmpDir, 'last_account' ) ) )
+      self.assertTrue( os.path.exists( os.path.join( self.tmpDir, 'accounts', 'me@x.com',
+                                                     'snapshot.json' ) ) )
+
+      loaded = Snapshot.Snapshot.load( 'me@x.com' )
+      self.assertEqual( loaded.filters, service.filters )
+      self.assertEqual( loaded.labels, service.labels )
+      self.assertLess( loaded.age(), 60 )
+      self.assertAlmostEqual( loaded.fetchedAt, snapshot.fetchedAt )
+      self.assertIsNone( Snapshot.Snapshot.load( 'other@x.com' ) )
+
+   def testReadsAndWrites( self ):
+      service = FakeService()
+      snapshot = Snapshot.Snapshot.fetch( service, 'me@x.com' )
+      connects = []
+      def connect():
+         connects.append( 1 )
+         return service
+      sService = SnapshotService( snapshot, connect=connect )
+      del service.calls[ : ]
+
+      self.assertEqual( sService.get_filters(), service.filters )
+      self.assertEqual( sService.get_labels(), service.labels )
+      self.assertEqual( sService.get_filter( 'f1' )[ 'id' ], 'f1' )
+      self.assertEqual( ( service.calls, connects ), ( [], [] ) )
+
+      # Changes to returned filters don't change the snapshot
+      sService.get_filters()[ 0 ][ 'criteria' ][ 'query' ] = 'changed'
+      self.assertEqual( sService.get_filter( 'f1' )[ 'criteria' ][ 'query' ], 'x' )
+
+      sService.create_filter( sService.get_filter( 'f1' ) )
+      sService.delete_filter( 'f1' )
+      self.assertEqual( service.calls, [ 'create_filter', 'delete_filter' ] )
+      self.assertEqual( connects, [ 1 ] )
+      self.assertEqual( [ f[ 'id' ] for f in sService.get_filters() ], [ 'f1_new' ] )
+
+      # Writes are saved together, once the command is done
+      loaded = Snapshot.Snapshot.load( 'me@x.com' )
+      self.assertEqual( [ f[ 'id' ] for f in loaded.filters ], [ 'f1' ] )
+      snapshot.save_changes()
+      loaded = Snapshot.Snapshot.load( 'me@x.com' )
+      self.assertEqual( [ f[ 'id' ] for f in loaded.filters ], [ 'f1_new' ] )
+      self.assertFalse( snapshot.dirty )
+
+   def testReplaceFilters( self ):
+      service = FakeService()
+      service.filters.append( { 'id': 'f2', 'criteria': { 'query': 'y' },
+                                'action': {} } )
+      snapshot = Snapshot.Snapshot.fetch( service, 'me@x.com' )
+      sService = SnapshotService( snapshot, connect=lambda: service )
+      newFilters = sService.get_filters()
+      newFilters[ 1 ][ 'criteria' ][ 'query' ] = 'bad'
+      results = sService.replace_filters( newFilters, batchSize=10 )
+      self.assertEqual( [ r.ok() for r in results ], [ True, False ] )
+
+      snapshot.save_changes()
+      loaded = Snapshot.Snapshot.load( 'me@x.com' )
+      self.assertEqual( sorted( f[ 'id' ] for f in loaded.filters ),
+                        [ 'f1_new', 'f2' ] )
+
+   def testOffline( self ):
+      snapshot = Snapshot.Snapshot( 'me@x.com', FakeService().filters, [],
+                                    fetchedAt=time.time() - 3600 )
+      sService = SnapshotService( snapshot, dryWrites=True )
+      self.assertEqual( sService.create_filter( snapshot.filters[ 0 ] )[ 'id' ],
+                        'f1_FAKE_NEW_ID' )
+      self.assertEqual( sService.delete_filter( 'f1' )[ 'id' ], 'f1' )
+      self.assertEqual( len( snapshot.filters ), 1 )
+      results = sService.replace_filters( snapshot.filters )
+      self.assertEqual( results[ 0 ].created[ 'id' ], 'f1_FAKE_NEW_ID' )
+      self.assertEqual( len( snapshot.filters ), 1 )
+
+      sService = SnapshotService( snapshot )
+      self.assertRaises( OfflineError, sService.create_filter, snapshot.filters[ 0 ] )
+
+if __name__ == '__main__':
+   unittest.main()
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+
+import shutil
+import tempfile
+
+from GmailFiltersBenchLib import startup_times, offline_home, print_row
+
+COMMANDS = [
+   [ '--help' ],
+   [ 'list', '--help' ],
+   [ 'update', '--help' ],
+   [ 'replace', '--help' ],
+   [ 'list', '--offline' ],
+   [ 'update', '--offline', '--dry-run', '-y' ],
+   [ 'replace', '--offline', '--dry-run', '-y', 'alpha', 'omega' ],
+]
+
+def main():
+   homeDir = tempfile.mkdtemp()
+   try:
+      env = offline_home( homeDir, numFilters=200 )
+      print_row( 'command', 'wall ms', 'import ms' )
+      for cmdArgs in COMMANDS:
+         runs = [ startup_times( cmdArgs, env=env ) for _ in range( 5 ) ]
+         wallTime = min( wall for wall, _ in runs )
+         times = min( ( times for _, times in runs ),
+                      key=lambda t: sum( t.values() ) )
+         print_row( ' '.join( cmdArgs )[ :27 ], '%.1f' % ( wallTime * 1000 ),
+                    '%.1f' % ( sum( times.values() ) / 1000.0 ) )
+   finally:
+      shutil.rmtree( homeDir )
+
+if __name__ == '__main__':
+   main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+import argparse
+import shutil
+import tempfile
+import unittest
+
+import GmailFiltersTestLib # pylint: disable=unused-import
+from GmailFiltersBenchLib import startup_times, offline_home, load_script
+
+# Modules which only commands talking to Gmail may import
+HEAVY_MODULES = [ 'googleapiclient', 'apiclient', 'oauth2client', 'httplib2',
+                  'asyncio', 'GmailFilters.Api', 'GmailFilters.AsyncApi' ]
+
+# Import time budgets in milliseconds, about three times what they take
+# today, so that they only fail when something heavy is imported again.
+STARTUP_BUDGETS = [
+   ( [ '--help' ], 100 ),
+   ( [ 'list', '--help' ], 100 ),
+   ( [ 'update', '--help' ], 100 ),
+   ( [ 'replace', '--help' ], 100 ),
+   ( [ 'list', '--offline' ], 120 ),
+   ( [ 'update', '--offline', '--dry-run', '-y' ], 120 ),
+   ( [ 'replace', '--offline', '--dry-run', '-y', 'alpha', 'omega' ], 120 ),
+]
+
+class StartupTest( unittest.TestCase ):
+   def setUp( self ):
+      self.homeDir = tempfile.mkdtemp()
+      self.env = offline_home( self.homeDir )
+
+   def tearDown( self ):
+      shutil.rmtree( self.homeDir )
+
+   def testImportBudgets( self ):
+      for cmdArgs, budgetMs in STARTUP_BUDGETS:
+         _, times = startup_times( cmdArgs, env=self.env )
+         for module in HEAVY_MODULES:
+            self.assertNotIn( module, times, "%s imported by %s" %
+                              ( module, ' '.join( cmdArgs ) ) )
+         importMs = sum( times.values() ) / 1000.0
+         self.assertLess( importMs, budgetMs, "%s took %.1f ms to import" %
+                          ( ' '.join( cmdArgs ), importMs ) )
+
+   def testAuthArguments( self ):
+      try:
+         from oauth2client import tools
+      except ImportError:
+         self.skipTest( "oauth2client is not installed" )
+      script = load_script()
+
+      # The options run_flow reads must match those of oauth2client
+      parser = argparse.ArgumentParser( add_help=False )
+      script.add_auth_arguments( parser )
+      self.assertEqual( vars( parser.parse_args( [] ) ),
+                        vars( tools.argparser.parse_args( [] ) ) )
+      flags = [ '--noauth_local_webserver', '--auth_host_port', '9000',
+                '--logging_level', 'DEBUG', '--auth_host_name', 'host' ]
+      self.assertEqual( vars( parser.parse_args( flags ) ),
+                        vars( tools.argparser.parse_args( flags ) ) )
+
+if __name__ == '__main__':
+   unittest.main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import sys
+import tempfile
+import time
+
+from GmailFiltersBenchLib import gen_filter_set, load_script, compare_results, \
+                                 print_row
+import GmailFilters.Config
+from GmailFilters import parse_filter_element
+from GmailFilters.Labels import LabelCache
+from GmailFilters.Printer import Printer
+from GmailFilters.Template import update_all_meta_groups
+
+RESULTS_VERSION = 1
+
+class FakeService( object ):
+   '''An account whose filters and labels are kept in memory.'''
+   def __init__( self, filters, labels ):
+      self.filters = filters
+      self.labels = labels
+      self.emailAddr = 'bench@example.com'
+
+   def label_cache( self ):
+      return LabelCache.from_labels( self.labels )
+
+   def get_filters( self ):
+      return [ dict( f ) for f in self.filters ]
+
+def best_split_time( setup, func, repeat ):
+   '''Returns the best time in seconds of func( setup() ), not counting setup.'''
+   times = []
+   for _ in range( repeat ):
+      arg = setup()
+      start = time.perf_counter()
+      func( arg )
+      times.append( time.perf_counter() - start )
+   return min( times )
+
+def parse_all( queries ):
+   return { id_: parse_filter_element( q ) for id_, q in queries.items() }
+
+def update_plan_time( filters, labels, repeat ):
+   '''Returns the best time of planning update --full against the filters,
+   answering no to making the changes.
+   '''
+   script = load_script()
+   service = FakeService( filters, labels )
+   script.get_service = lambda forWrite=False: service
+   script.check_with_user = lambda msg, requireLongConfirm=False: False
+   argv = [ 'gmail-filters', 'update', '--full', '--no-parse-cache', '--no-color' ]
+
+   def run( _ ):
+      oldArgv = sys.argv
+      sys.argv = argv
+      try:
+         with contextlib.redirect_stdout( io.StringIO() ):
+            script.main()
+      finally:
+         sys.argv = oldArgv
+   return best_split_time( lambda: None, run, repeat )
+
+def run_benchmarks( params, repeat=5 ):
+   '''Returns { benchmark name: best seconds } for a filter set generated with
+   params.
+   '''
+   filters, labels = gen_filter_set( **params )
+   queries = { f[ 'id' ]: f[ 'criteria' ][ 'query' ] for f in filters }
+   results = {}
+   results[ 'parse' ] = best_split_time( lambda: queries, parse_all, repeat )
+   results[ 'full_filter_str' ] = best_split_time(
+         lambda: parse_all( queries ),
+         lambda elems: [ e.full_filter_str() for e in elems.values() ], repeat )
+   results[ 'update_all_meta_groups' ] = best_split_time(
+         lambda: parse_all( queries ), update_all_meta_groups, repeat )
+
+   elems = parse_all( queries )
+   update_all_meta_groups( elems )
+   pairs = []
+   for filter_ in filters:
+      newQuery = elems[ filter_[ 'id' ] ].full_filter_str()
+      newFilter = dict( filter_, criteria={ 'query': newQuery } )
+      pairs.append( ( filter_, newFilter ) )
+   printer = Printer( FakeService( filters, labels ), False, diff='tree' )
+   def render( _ ):
+      with contextlib.redirect_stdout( io.StringIO() ):
+         for filter_, newFilter in pairs:
+            printer.print_filter( filter_, newFilter=newFilter )
+   results[ 'print_filter' ] = best_split_time( lambda: None, render, repeat )
+
+   results[ 'update_plan' ] = update_plan_time( filters, labels, repeat )
+   return results
+
+def main():
+   parser = argparse.ArgumentParser(
+         description="Time the stages of an update of a generated filter set. "
+                     "With --baseline, fails if any is slower than in a saved "
+                     "run by more than --threshold." )
+   parser.add_argument( '--filters', type=int, default=1000 )
+   parser.add_argument( '--templates', type=int, default=50 )
+   parser.add_argument( '--depth', type=int, default=2,
+                        help="How deeply groups are nested" )
+   parser.add_argument( '--width', type=int, default=3,
+                        help="Up to how many members groups have" )
+   parser.add_argument( '--or-width', type=int, default=3,
+                        help="Up to how many members {} groups have" )
+   parser.add_argument( '--fanout', type=int, default=2,
+                        help="Up to how many templates each filter references" )
+   parser.add_argument( '--seed', type=int, default=0 )
+   parser.add_argument( '--repeat', type=int, default=5 )
+   parser.add_argument( '--out', metavar='FILE', help="Write the results as JSON" )
+   parser.add_argument( '--baseline', metavar='FILE',
+                        help="Compare with the results written to FILE by --out" )
+   parser.add_argument( '--threshold', type=float, default=0.25,
+                        help="How much slower, as a fraction, counts as a "
+                             "regression. (Default: %(default)s)" )
+   args = parser.parse_args()
+
+   params = { 'seed': args.seed, 'numFilters': args.filters,
+              'numTemplates': args.templates, 'depth': args.depth,
+              'width': args.width, 'orWidth': args.or_width,
+              'fanout': args.fanout }
+   baseline = None
+   if args.baseline:
+      with open( args.baseline ) as f:
+         baseline = json.load( f )
+      if baseline.get( 'params' ) != params:
+         print( "The baseline was measured with other parameters: %r" %
+                baseline.get( 'params' ) )
+         return 2
+
+   # update reads the template state of the account from the config dir
+   with tempfile.TemporaryDirectory() as homeDir:
+      GmailFilters.Config.config_dir = homeDir
+      results = run_benchmarks( params, repeat=args.repeat )
+
+   if args.out:
+      with open( args.out, 'w' ) as f:
+         json.dump( { 'version': RESULTS_VERSION, 'python': platform.python_version(),
+                      'params': params, 'results': results }, f, indent=1,
+                    sort_keys=True )
+
+   baseResults = baseline[ 'results' ] if baseline else {}
+   print_row( 'benchmark', 'ms', 'baseline ms' )
+   for name, seconds in sorted( results.items() ):
+      baseSeconds = baseResults.get( name )
+      print_row( name, '%.1f' % ( seconds * 1000 ),
+                 '%.1f' % ( baseSeconds * 1000 ) if baseSeconds else '-' )
+
+   regressions = compare_results( baseResults, results, args.threshold )
+   for name, baseSeconds, seconds in regressions:
+      print( "%s regressed by %.0f%%: %.1f ms, from %.1f ms" %
+             ( name, 100 * ( seconds / baseSeconds - 1 ), seconds * 1000,
+               baseSeconds * 1000 ) )
+   return 1 if regressions else 0
+
+if __name__ == '__main__':
+   sys.exit( main() )
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import GmailFiltersTestLib # pylint: disable=unused-import
+from GmailFiltersBenchLib import gen_filter_set, compare_results
+from GmailFilterSuiteBench import run_benchmarks
+
+class SuiteTest( unittest.TestCase ):
+   def testGenerator( self ):
+      params = dict( seed=3, numFilters=40, numTemplates=5, fanout=3, orWidth=6 )
+      filters, labels = gen_filter_set( **params )
+      self.assertEqual( ( filters, labels ), gen_filter_set( **params ) )
+      self.assertEqual( len( filters ), 40 )
+      self.assertEqual( len( [ f for f in filters
+                               if 'M3TAP' in f[ 'criteria' ][ 'query' ] ] ), 5 )
+      labelIds = set( l[ 'id' ] for l in labels )
+      for filter_ in filters:
+         self.assertLessEqual( set( filter_[ 'action' ][ 'addLabelIds' ] ), labelIds )
+
+   def testRun( self ):
+      results = run_benchmarks( dict( numFilters=20, numTemplates=3 ), repeat=1 )
+      self.assertEqual( sorted( results ),
+                        [ 'full_filter_str', 'parse', 'print_filter', 'update_all_meta_groups',
+                          'update_plan' ] )
+
+   def testCompare( self ):
+      baseline = { 'parse': 1.0, 'update_plan': 2.0, 'gone': 1.0 }
+      results = { 'parse': 1.2, 'update_plan': 2.6, 'new': 5.0 }
+      self.assertEqual( compare_results( baseline, results, 0.25 ),
+                        [ ( 'update_plan', 2.0, 2.6 ) ] )
+      self.assertEqual( compare_results( baseline, results, 0.1 ),
+                        [ ( 'parse', 1.0, 1.2 ), ( 'update_plan', 2.0, 2.6 ) ] )
+
+if __name__ == '__main__':
+   unittest.main()
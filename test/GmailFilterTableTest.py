@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+import unittest
+
+from GmailFiltersTestLib import pm, prs, ParserTestBase
+from GmailFilters import FilterElement
+from GmailFilters.Table import FilterElementTable
+from GmailFilters.Template import find_all_meta_group_keys, \
+                                  find_primary_template_group
+
+class TableTest( ParserTestBase ):
+   queries = [
+      '',
+      '  ',
+      'bla',
+      ' foo  bar ',
+      '( )',
+      ' {x} (y) ',
+      '("(blar)") "a b" c',
+      '({(M3TA label=foo) from:bla@gmail.com} subject:("Fo bar")) OR Foo',
+      '{(M3TAP foo) x {(M3TA bar) y}}',
+   ]
+
+   @pm
+   def testRoundTrip( self ):
+      for q in self.queries:
+         table = FilterElementTable.parse( q )
+         self.assertEqual( table.to_element(), prs( q ) )
+         self.assertEqual( str( table.root() ), q )
+         self.assertEqual( len( table ),
+                           len( FilterElementTable.from_element( prs( q ) ) ) )
+
+   @pm
+   def testView( self ):
+      table = FilterElementTable.parse( ' x (y "z") ' )
+      root = table.root()
+      self.assertTrue( root.has_sub_elems() )
+      x, grp = root.subElems
+      self.assertEqual( ( x.filterStr, x.preWs, x.postWs ), ( 'x', ' ', ' ' ) )
+      self.assertFalse( x.has_sub_elems() )
+      self.assertIsNone( x.subElems )
+      self.assertEqual( grp.delims, '()' )
+      self.assertIsNone( grp.filterStr )
+      self.assertEqual( grp.full_filter_str(), '(y "z") ' )
+      y, z = grp.subElems
+      self.assertEqual( ( z.filterStr, z.delims, y.postWs ), ( 'z', '""', ' ' ) )
+      self.assertEqual( z.parent.full_filter_str(), grp.full_filter_str() )
+      self.assertIsNone( root.parent )
+      self.assertEqual( y.to_element(), FilterElement( 'y', postWs=' ' ) )
+
+   @pm
+   def testTemplateFunctions( self ):
+      for q in self.queries:
+         view = FilterElementTable.parse( q ).root()
+         self.assertEqual( find_all_meta_group_keys( view ),
+                           find_all_meta_group_keys( prs( q ) ) )
+         viewPrimary = find_primary_template_group( view )
+         primary = find_primary_template_group( prs( q ) )
+         self.assertEqual( viewPrimary is None, primary is None )
+         if primary is not None:
+            self.assertEqual( viewPrimary.to_element(), primary )
+
+if __name__ == '__main__':
+   unittest.main()
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+
+import random
+
+from GmailFiltersBenchLib import gen_template_queries, best_time, print_row, \
+                                 update_all_meta_groups_walk
+from GmailFilters import parse_filter_element
+from GmailFilters.Template import update_all_meta_groups
+
+def time_update( updateFunc, queries ):
+   def run():
+      filters = { id_: parse_filter_element( q ) for id_, q in queries.items() }
+      updateFunc( filters )
+   parseTime = best_time(
+         lambda: { id_: parse_filter_element( q ) for id_, q in queries.items() },
+         repeat=3 )
+   return best_time( run, repeat=1 ) - parseTime
+
+def main():
+   print_row( 'filters / templates', 'walk ms', 'indexed ms', 'speedup' )
+   for numFilters, numTemplates in [ ( 200, 10 ), ( 1000, 50 ), ( 1000, 200 ),
+                                     ( 2000, 100 ) ]:
+      queries = gen_template_queries( random.Random( numTemplates ), numFilters,
+                                      numTemplates, depth=2 )
+      walkTime = time_update( update_all_meta_groups_walk, queries )
+      indexedTime = time_update( update_all_meta_groups, queries )
+      print_row( '%d / %d' % ( numFilters, numTemplates ),
+                 '%.1f' % ( walkTime * 1000 ), '%.1f' % ( indexedTime * 1000 ),
+                 '%.1fx' % ( walkTime / indexedTime ) )
+
+if __name__ == '__main__':
+   main()
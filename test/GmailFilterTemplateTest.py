@@ -1,8 +1,10 @@
 #!/usr/bin/env python3
 
+import random
 import unittest
 
 from GmailFiltersTestLib import pm, grp, grp2, prs, prs1, ParserTestBase
+from GmailFiltersBenchLib import gen_template_queries, update_all_meta_groups_walk
 from GmailFilters.Template import get_meta_group_key, \
                                   find_primary_template_group, \
                                   sub_meta_groups, \
@@ -155,5 +157,28 @@ class ParsingTest( ParserTestBase ):
          }
       self.assertRaises( TemplateError, update_all_meta_groups, filters )
 
+   def testMatchesWalk( self ):
+      def run( updateFunc, queries ):
+         filters = { id_: prs( q ) for id_, q in queries.items() }
+         try:
+            updateFunc( filters )
+         except TemplateError:
+            return TemplateError
+         return { id_: str( f ) for id_, f in filters.items() }
+
+      rng = random.Random( 99 )
+      for _ in range( 200 ):
+         queries = gen_template_queries( rng, rng.randint( 1, 12 ),
+                                         rng.randint( 1, 4 ), fanout=3,
+                                         depth=1 )
+         # Mix in self and forward references, nested references and
+         # undefined keys.
+         for id_ in list( queries ):
+            if rng.random() < 0.2:
+               queries[ id_ ] += ' {(M3TA t%d) {(M3TA t%d) x}}' % (
+                     rng.randrange( 5 ), rng.randrange( 5 ) )
+         expected = run( update_all_meta_groups_walk, queries )
+         self.assertEqual( run( update_all_meta_groups, queries ), expected )
+
 if __name__ == '__main__':
    unittest.main( failfast=True )
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import pstats
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import GmailFiltersTestLib # pylint: disable=unused-import
+from GmailFiltersBenchLib import offline_home, scriptPath
+import GmailFilters.Timings as Timings
+from GmailFilterApiTest import batch_response, filter_obj, error_body
+
+try:
+   from googleapiclient.http import HttpMockSequence
+   import GmailFilters.Api as Api
+except ImportError:
+   Api = None
+
+ROOT = 'https://gmail.googleapis.com/gmail/v1/users/me/'
+
+class TimingsTest( unittest.TestCase ):
+   def tearDown( self ):
+      Timings.disable()
+
+   def testDisabled( self ):
+      self.assertIsNone( Timings.current() )
+      self.assertIs( Timings.phase( 'a' ), Timings.phase( 'b' ) )
+      http = object()
+      self.assertIs( Timings.instrument_http( http ), http )
+
+   def testPhases( self ):
+      timings = Timings.enable()
+      for _ in range( 2 ):
+         with Timings.phase( 'parse' ):
+            pass
+      timings.add_phase( 'render', 0.5 )
+      obj = timings.to_json()
+      self.assertEqual( sorted( obj[ 'phases' ] ), [ 'parse', 'render' ] )
+      self.assertEqual( obj[ 'phases' ][ 'render' ], 0.5 )
+      self.assertIn( '  render                        500.0 ms',
+                     timings.summary_lines() )
+
+   def testRequestNames( self ):
+      self.assertEqual( Timings.request_name( 'GET', ROOT + 'settings/filters' ),
+                        'get_filters' )
+      self.assertEqual( Timings.request_name( 'POST', ROOT + 'settings/filters?alt=json' ),
+                        'create_filter' )
+      self.assertEqual( Timings.request_name( 'DELETE', ROOT + 'settings/filters/f1' ),
+                        'delete_filter' )
+      self.assertEqual( Timings.request_name( 'GET', ROOT + 'profile' ),
+                        'get_email_addr' )
+      self.assertEqual( Timings.request_name(
+                           'POST', 'https://www.googleapis.com/batch/gmail/v1' ),
+                        'batch' )
+      self.assertEqual( Timings.request_name(
+                           'POST', 'https://oauth2.googleapis.com/token' ),
+                        'oauth token refresh' )
+      self.assertEqual( Timings.request_name( 'PUT', ROOT + 'x' ),
+                        'PUT /gmail/v1/users/me/x' )
+
+   def testPercentile( self ):
+      values = list( range( 1, 101 ) )
+      self.assertEqual( [ Timings.percentile( values, p ) for p in ( 50, 90, 99, 100 ) ],
+                        [ 50, 90, 99, 100 ] )
+      self.assertEqual( Timings.percentile( [ 7 ], 50 ), 7 )
+      self.assertEqual( Timings.percentile( [ 1, 2, 3 ], 50 ), 2 )
+
+   @unittest.skipIf( Api is None, "Google API client is not installed" )
+   def testServiceRequests( self ):
+      timings = Timings.enable()
+      http = Timings.instrument_http( HttpMockSequence( [
+         ( { 'status': '200' }, json.dumps( { 'filter': [ filter_obj( 'f0', 'q' ) ] } ) ),
+         ( { 'status': '200' }, json.dumps( filter_obj( 'n0', 'q' ) ) ),
+         ( { 'status': '400' }, json.dumps( error_body( 400, 'Bad' ) ) ),
+         batch_response( [ ( 200, filter_obj( 'n1', 'q' ) ) ] ),
+         batch_response( [ ( 204, None ) ] ),
+      ] ) )
+      service = Api.Service( http )
+      service.get_filters()
+      service.create_filter( { 'criteria': { 'query': 'q' }, 'action': {} } )
+      self.assertRaises( Exception, service.create_filter,
+                         { 'criteria': {}, 'action': {} } )
+      service.replace_filters( [ filter_obj( 'f0', 'q' ) ] )
+
+      requests = timings.to_json()[ 'requests' ]
+      self.assertEqual( { name: obj[ 'calls' ] for name, obj in requests.items() },
+                        { 'get_filters': 1, 'create_filter': 2, 'batch': 2 } )
+      self.assertEqual( requests[ 'create_filter' ][ 'errors' ], 1 )
+      self.assertGreater( requests[ 'create_filter' ][ 'sentBytes' ], 0 )
+      self.assertGreater( requests[ 'get_filters' ][ 'receivedBytes' ], 0 )
+      self.assertIn( 'build service', timings.phases )
+      self.assertTrue( any( line.startswith( '  create_filter' ) and
+                            line.endswith( '(1 failed)' )
+                            for line in timings.summary_lines() ) )
+
+class CommandTimingsTest( unittest.TestCase ):
+   def setUp( self ):
+      self.homeDir = tempfile.mkdtemp()
+      self.env = offline_home( self.homeDir )
+
+   def tearDown( self ):
+      shutil.rmtree( self.homeDir )
+
+   def testTimingsAndProfile( self ):
+      profilePath = os.path.join( self.homeDir, 'update.prof' )
+      proc = subprocess.run( [ sys.executable, scriptPath, 'update', '--offline',
+                               '--dry-run', '-y', '--full', '--timings-format', 'json',
+                               '--profile', profilePath ],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             universal_newlines=True, env=self.env, check=True )
+      obj = json.loads( proc.stderr )
+      for name in ( 'load snapshot', 'parse', 'expand templates', 'compare queries' ):
+         self.assertIn( name, obj[ 'phases' ] )
+      self.assertEqual( obj[ 'requests' ], {} )
+      self.assertNotIn( 'Total', proc.stdout )
+      stats = pstats.Stats( profilePath )
+      self.assertTrue( any( func[ 2 ] == 'pending_updates' for func in stats.stats ) )
+
+   def testTimingsBeforePositional( self ):
+      proc = subprocess.run( [ sys.executable, scriptPath, 'list', '--offline',
+                               '--timings', 'foo' ],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             universal_newlines=True, env=self.env, check=True )
+      self.assertIn( 'load snapshot', proc.stderr )
+
+if __name__ == '__main__':
+   unittest.main()
@@ -0,0 +1,409 @@
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import timeit
+
+# Make sure that the parent directory is in path
+testDir = os.path.dirname( __file__ )
+baseDir = os.path.realpath( os.path.join( testDir, '..' ) )
+sys.path = [ baseDir ] + sys.path
+
+from GmailFilters import CLOSE_DELIMS, OPEN_DELIMS, FilterElement, ParseError
+from GmailFilters.Template import find_all_meta_group_keys, \
+                                  find_primary_template_group, \
+                                  get_template_group_key, sub_meta_groups, \
+                                  TemplateError
+
+scriptPath = os.path.join( baseDir, 'gmail-filters' )
+
+WORDS = [ 'alpha', 'beta', 'gamma', 'delta', 'news', 'invoice', 'receipt',
+          'github', 'jira', 'build', 'failed', 'weekly', 'digest', 'promo' ]
+
+def gen_vocabulary( count, seed=0 ):
+   '''Returns count distinct made up words.'''
+   rng = random.Random( seed )
+   words = set()
+   while len( words ) < count:
+      words.add( ''.join( rng.choice( 'bcdfghjklmnprstvwz' ) + rng.choice( 'aeiou' )
+                          for _ in range( rng.randint( 2, 4 ) ) ) )
+   return sorted( words )
+
+def gen_term( rng, words=WORDS ):
+   r = rng.random()
+   word = rng.choice( words )
+   if r < 0.2:
+      return '"%s %s"' % ( word, rng.choice( words ) )
+   elif r < 0.5:
+      return 'from:%s@%s.com' % ( word, rng.choice( words ) )
+   elif r < 0.6:
+      return 'subject:(%s)' % word
+   return word
+
+def gen_query( rng, depth=3, width=4, words=WORDS, orWidth=None ):
+   '''Returns a random query with groups nested up to depth levels, each
+   holding up to width members, or orWidth for {} groups.
+   '''
+   orWidth = orWidth or width
+   members = []
+   for _ in range( rng.randint( 1, width ) ):
+      if depth > 0 and rng.random() < 0.5:
+         delims = rng.choice( [ '()', '{}' ] )
+         members.append( delims[ 0 ] +
+                         gen_query( rng, depth - 1,
+                                    orWidth if delims == '{}' else width, words,
+                                    orWidth ) +
+                         delims[ 1 ] )
+      else:
+         members.append( gen_term( rng, words ) )
+   return ' '.join( members )
+
+def gen_queries( count, seed=0, **kwargs ):
+   rng = random.Random( seed )
+   return [ gen_query( rng, **kwargs ) for _ in range( count ) ]
+
+def gen_template_queries( rng, numFilters, numTemplates, fanout=2, depth=2,
+                          width=3, nestedRefs=True, orWidth=None ):
+   '''Returns { filter id: query }, where the first numTemplates filters are
+   primaries of templates t0, t1, etc., and every filter references up to
+   fanout templates. With nestedRefs, primaries may reference the templates
+   defined before them.
+   '''
+   def ref( key ):
+      return '{(M3TA %s) %s}' % ( key, gen_query( rng, 0, orWidth or width ) )
+
+   queries = {}
+   for t in range( numTemplates ):
+      members = [ gen_query( rng, depth, width, orWidth=orWidth ) ]
+      if nestedRefs and t > 0 and rng.random() < 0.5:
+         members.append( ref( 't%d' % rng.randrange( t ) ) )
+      queries[ 'p%d' % t ] = '{(M3TAP t%d) %s}' % ( t, ' '.join( members ) )
+
+   for f in range( numFilters - numTemplates ):
+      members = [ gen_query( rng, depth, width, orWidth=orWidth ) ]
+      for _ in range( rng.randint( 0, fanout ) ):
+         members.insert( rng.randint( 0, len( members ) ),
+                         ref( 't%d' % rng.randrange( numTemplates ) ) )
+      queries[ 'f%d' % f ] = ' '.join( members )
+   return queries
+
+def gen_filter_set( seed=0, numFilters=1000, numTemplates=50, numLabels=20,
+                    **kwargs ):
+   '''Returns the filters and labels of a random account, with
+   gen_template_queries( numFilters, numTemplates, **kwargs ) as the queries of
+   its filters, each adding one of numLabels labels.
+   '''
+   rng = random.Random( seed )
+   queries = gen_template_queries( rng, numFilters, numTemplates, **kwargs )
+   labels = [ { 'id': 'Label_%d' % i, 'name': 'Label %d' % i }
+              for i in range( numLabels ) ]
+   filters = [ { 'id': id_, 'criteria': { 'query': q },
+                 'action': { 'addLabelIds': [ rng.choice( labels )[ 'id' ] ] } }
+               for id_, q in sorted( queries.items() ) ]
+   return filters, labels
+
+def gen_message( rng, index, bodyWords=60, words=WORDS ):
+   '''Returns the raw bytes of a random message.'''
+   sender = '%s@%s.com' % ( rng.choice( words ), rng.choice( words ) )
+   subject = ' '.join( rng.choice( words ) for _ in range( rng.randint( 2, 6 ) ) )
+   body = ' '.join( rng.choice( words ) for _ in range( bodyWords ) )
+   return ( 'From: %s\nTo: me@example.com\nSubject: %s\n'
+            'Message-ID: <%d@example.com>\n\n%s\n' %
+            ( sender, subject, index, body ) ).encode( 'utf-8' )
+
+def write_mbox( path, count, seed=0, **kwargs ):
+   '''Writes an mbox of count random messages to path.'''
+   rng = random.Random( seed )
+   with open( path, 'wb' ) as f:
+      for i in range( count ):
+         f.write( b'From sender@example.com Mon Jan  1 00:00:00 2024\n' )
+         f.write( gen_message( rng, i, **kwargs ) )
+         f.write( b'\n' )
+
+def best_time( func, repeat=5, number=1 ):
+   '''Returns the best time in seconds of one call to func.'''
+   return min( timeit.repeat( func, repeat=repeat, number=number ) ) / number
+
+def print_row( name, *cols ):
+   print( '%-28s' % name + ''.join( '%14s' % c for c in cols ) )
+
+def parse_import_times( output ):
+   '''Returns { module: cumulative microseconds } for the top level imports in
+   the output of python -X importtime.
+   '''
+   times = {}
+   for line in output.splitlines():
+      if not line.startswith( 'import time:' ):
+         continue
+      _, cumulative, name = line[ len( 'import time:' ): ].split( '|' )
+      if cumulative.strip().isdigit() and not name.startswith( '  ' ):
+         times[ name.strip() ] = int( cumulative )
+   return times
+
+_interpreterModules = None
+
+def startup_times( cmdArgs, env=None ):
+   '''Runs gmail-filters with cmdArgs, and returns the wall time in seconds,
+   and { module: cumulative microseconds } of its top level imports, other than
+   those the interpreter makes before running any script.
+   '''
+   global _interpreterModules
+   if _interpreterModules is None:
+      output = subprocess.run( [ sys.executable, '-X', 'importtime', '-c', 'pass' ],
+                               stderr=subprocess.PIPE, universal_newlines=True,
+                               check=True ).stderr
+      _interpreterModules = set( parse_import_times( output ) )
+
+   start = time.perf_counter()
+   proc = subprocess.run( [ sys.executable, '-X', 'importtime', scriptPath ] + cmdArgs,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                          universal_newlines=True, env=env, check=True )
+   wallTime = time.perf_counter() - start
+   times = parse_import_times( proc.stderr )
+   return wallTime, { m: t for m, t in times.items() if m not in _interpreterModules }
+
+def load_script():
+   '''Returns the gmail-filters script, imported as a module.'''
+   import importlib.machinery
+   import importlib.util
+   loader = importlib.machinery.SourceFileLoader( 'gmail_filters', scriptPath )
+   spec = importlib.util.spec_from_loader( 'gmail_filters', loader )
+   script = importlib.util.module_from_spec( spec )
+   loader.exec_module( script )
+   return script
+
+def compare_results( baseline, results, threshold ):
+   '''Returns [ ( name, baseline seconds, seconds ) ] of the benchmarks of
+   results more than threshold, as a fraction, slower than in baseline.
+   '''
+   regressions = []
+   for name, seconds in sorted( results.items() ):
+      baseSeconds = baseline.get( name )
+      if baseSeconds and seconds > baseSeconds * ( 1 + threshold ):
+         regressions.append( ( name, baseSeconds, seconds ) )
+   return regressions
+
+def offline_home( homeDir, emailAddr='me@example.com', numFilters=20 ):
+   '''Sets up a config dir in homeDir with a snapshot of emailAddr, so that
+   commands can run --offline, and returns the environment to run them with.
+   '''
+   from GmailFilters.Snapshot import SNAPSHOT_VERSION
+   accountDir = os.path.join( homeDir, '.gmail_filters', 'accounts', emailAddr )
+   os.makedirs( accountDir )
+   filters = [ { 'id': 'f%d' % i, 'criteria': { 'query': q },
+                 'action': { 'addLabelIds': [ 'L1' ] } }
+               for i, q in enumerate( gen_queries( numFilters ) ) ]
+   with open( os.path.join( accountDir, 'snapshot.json' ), 'w' ) as f:
+      json.dump( { 'version': SNAPSHOT_VERSION, 'fetchedAt': time.time(),
+                   'filters': filters, 'labels': [ { 'id': 'L1', 'name': 'One' } ] },
+                 f )
+   with open( os.path.join( homeDir, '.gmail_filters', 'last_account' ), 'w' ) as f:
+      f.write( emailAddr )
+   return dict( os.environ, HOME=homeDir )
+
+# The original implementations of the parser and the template engine, kept as
+# references for tests and benchmarks.
+
+PRE_TEXT_MODE = 'pre'
+TEXT_MODE = 'text'
+POST_TEXT_MODE = 'post'
+QUOTED_TEXT_MODE = 'quoted'
+
+class ElementParser( object ):
+   def __init__( self, filterStr, startIdx=0, lastIdx=None ):
+      self.filterStr = filterStr
+      if lastIdx is None:
+         lastIdx = len( filterStr ) - 1
+      self.startIdx = startIdx
+      self.currIdx = startIdx
+      self.lastIdx = lastIdx
+
+   def last_group_idx( self, groupStart ):
+      delimStack = []
+      i = groupStart
+      assert self.filterStr[ i ] in OPEN_DELIMS
+      while True:
+         c = self.filterStr[ i ]
+         if c in OPEN_DELIMS:
+            di = OPEN_DELIMS.index( c )
+            delimStack.append( c )
+         elif c in CLOSE_DELIMS:
+            di = CLOSE_DELIMS.index( c )
+            if not delimStack or delimStack[ -1 ] != OPEN_DELIMS[ di ]:
+               raise ParseError( "Mismatched closing delim at index " + i )
+            else:
+               delimStack.pop()
+
+         if not delimStack:
+            break
+         i += 1
+
+      return i
+
+   def parse_delimited_group( self, startIdx ):
+      '''Return ( group, lastIdx )'''
+      lastDelimIdx = self.last_group_idx( startIdx )
+      assert lastDelimIdx
+
+      subElmParser = ElementParser( self.filterStr, startIdx + 1, lastDelimIdx - 1 )
+      groupElem = subElmParser.parse()
+      groupElem.delims = '()' if self.filterStr[ startIdx ] == '(' else '{}'
+
+      return groupElem, lastDelimIdx
+
+   def parse_next( self ):
+      # pylint: disable=too-many-branches,too-many-statements
+      mode = PRE_TEXT_MODE
+      delims = None
+      substr = None
+      groupElem = None
+      preWs = ''
+      postWs = ''
+      isFirstParse = self.startIdx == self.currIdx
+      i = self.currIdx
+      while i <= self.lastIdx:
+         if mode == PRE_TEXT_MODE:
+            if self.filterStr[ i ] == ' ':
+               preWs += ' '
+            elif self.filterStr[ i ] in OPEN_DELIMS:
+               groupElem, i = self.parse_delimited_group( i )
+               mode = POST_TEXT_MODE
+            elif self.filterStr[ i ] in CLOSE_DELIMS:
+               assert 0, "Found unmatched close delim while parsing: idx %d" % i
+            elif self.filterStr[ i ] == '"':
+               mode = QUOTED_TEXT_MODE
+               delims = '""'
+               substr = ''
+            else:
+               mode = TEXT_MODE
+               substr = self.filterStr[ i ]
+
+         elif mode == TEXT_MODE:
+            if self.filterStr[ i ] == ' ':
+               mode = POST_TEXT_MODE
+               postWs += ' '
+            elif self.filterStr[ i ] in OPEN_DELIMS:
+               break
+            elif self.filterStr[ i ] in CLOSE_DELIMS:
+               assert 0, "Found unmatched close delim while parsing: idx %d" % i
+            elif self.filterStr[ i ] == '"':
+               # This quoted element will be next
+               break
+            else:
+               substr += self.filterStr[ i ]
+
+         elif mode == POST_TEXT_MODE:
+            if self.filterStr[ i ] == ' ':
+               postWs += ' '
+            else:
+               break
+
+         elif mode == QUOTED_TEXT_MODE:
+            if self.filterStr[ i ] == '"':
+               i += 1
+               break
+            else:
+               substr += self.filterStr[ i ]
+         else:
+            assert 0, mode
+         i += 1
+
+      self.currIdx = i
+      if substr is None and groupElem is None:
+         if isFirstParse:
+            substr = ''
+            if self.currIdx == self.startIdx:
+               self.currIdx = self.startIdx + 1
+         else:
+            assert not preWs and not postWs
+            return None
+
+      if groupElem is not None:
+         elm = groupElem
+         elm.preWs = preWs
+         elm.postWs = postWs
+      else:
+         elm = FilterElement( substr,
+                              delims=delims,
+                              preWs=preWs,
+                              postWs=postWs )
+      return elm
+
+   def parse( self ):
+      delimsError = self.check_delims()
+      if delimsError is not None:
+         raise ParseError( delimsError )
+
+      filterElements = []
+      done = False
+      while not done:
+         nextElem = self.parse_next()
+         if nextElem is None:
+            done = True
+         else:
+            filterElements.append( nextElem )
+
+      return FilterElement( subElems=filterElements )
+
+   def parse_error( self, index ):
+      return self.filterStr + '\n' + ( ( ' ' * index ) + '^' )
+
+   def check_delims( self ):
+      delimStack = []
+      for i, c in enumerate( self.filterStr ):
+         if c in OPEN_DELIMS:
+            di = OPEN_DELIMS.index( c )
+            delimStack.append( c )
+         elif c in CLOSE_DELIMS:
+            di = CLOSE_DELIMS.index( c )
+            if not delimStack or delimStack[ -1 ] != OPEN_DELIMS[ di ]:
+               return "Mismatched closing delim:\n" + self.parse_error( i )
+            else:
+               delimStack.pop()
+      if delimStack:
+         return "Unmatched delim:\n" + \
+                self.parse_error( len( self.filterStr ) - 1 )
+
+      if self.filterStr.count( '"' ) % 2:
+         return "Unmatched quote"
+
+      return None
+
+def update_all_meta_groups_walk( filterElemById ):
+   '''The original implementation of update_all_meta_groups, which walks every
+   tree once per primary.
+   '''
+   primaryKeyToId = {}
+   primaryKeyToGroup = {}
+
+   for id_, filterElem in filterElemById.items():
+      primaryGroup = find_primary_template_group( filterElem )
+      if primaryGroup is None:
+         continue
+      key = get_template_group_key( primaryGroup, primaryOnly=True )
+      assert key is not None
+
+      if key in primaryKeyToId:
+         raise TemplateError( "Primary key collision for %r between filters %s, %s" %
+                              ( key, primaryKeyToId[ key ], id_ ) )
+      primaryKeyToId[ key ] = id_
+      primaryKeyToGroup[ key ] = primaryGroup
+
+   for pKey, id_ in primaryKeyToId.items():
+      for id2, filterElem in filterElemById.items():
+         if id_ == id2:
+            # Don't want to try to update the same filter
+            continue
+
+         sub_meta_groups( filterElem, primaryKeyToGroup[ pKey ] )
+
+   allKeys = set()
+   for id_, filterElem in filterElemById.items():
+      allKeys |= find_all_meta_group_keys( filterElem )
+
+   undefinedKeys = allKeys - set( primaryKeyToId.keys() )
+   if undefinedKeys:
+      raise TemplateError( "Could not find definition for keys: %s" %
+                           ', '.join( str( k ) for k in undefinedKeys ) )